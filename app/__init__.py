@@ -14,8 +14,11 @@ from app.tasks import start_hls_worker
 from .commands.user_commands import create_user, create_superadmin, rotate_superadmin_password
 from .commands.search_commands import search_reindex
 from .commands.setup_commands import setup_command
+from .commands.worker_commands import hls_worker
+from .commands.batch_commands import hls_batch
 
 from app.routes import register_blueprints
+from app.routes.v1.video_route import HLS_OFFLOAD_MODES
 
 from .config import Config
 from .extensions import jwt, db, migrate, ma
@@ -100,6 +103,8 @@ def create_app(config_class=Config):
 
     configure_logging(app)
     app.logger.info("Using config: %s", config_class.__name__)
+    if app.config.get("HLS_OFFLOAD", "none") not in HLS_OFFLOAD_MODES:
+        raise ValueError(f"HLS_OFFLOAD must be one of {HLS_OFFLOAD_MODES}, got {app.config['HLS_OFFLOAD']!r}")
 
     # Optional proxy fix: enable when running behind a trusted proxy by setting PROXY_FIX_NUM
     try:
@@ -120,6 +125,8 @@ def create_app(config_class=Config):
     app.cli.add_command(rotate_superadmin_password)
     app.cli.add_command(search_reindex)
     app.cli.add_command(setup_command)
+    app.cli.add_command(hls_worker)
+    app.cli.add_command(hls_batch)
 
     # ------------------------------------------------------------------
     # Logging & Access log middleware
@@ -0,0 +1,132 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app.extensions import db
+
+POLL_SECONDS = 5
+DONE_STATES = ("succeeded", "failed", "missing")
+
+
+def _load_checkpoint(path: str, fingerprint: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {"fingerprint": fingerprint, "videos": {}}
+    if state.get("fingerprint") != fingerprint:
+        click.echo("Encode settings changed since the checkpoint was written; starting over")
+        return {"fingerprint": fingerprint, "videos": {}}
+    return state
+
+
+def _save_checkpoint(path: str, state: dict) -> None:
+    from app.utils.hls_playlists import write_atomic
+    state["updated_at"] = datetime.now(timezone.utc).isoformat()
+    write_atomic(path, json.dumps(state, indent=1, sort_keys=True))
+
+
+def _dry_run(todo, current: int) -> None:
+    from app import tasks
+    from app.models.enumerations import TranscodeJobKind
+    speeds, mean_seconds = tasks.encode_speeds()
+    default_speed = float(current_app.config.get("TRANSCODE_DEFAULT_SPEED", 4.0))
+    total, unknown = 0.0, 0
+    for video in todo:
+        cost, speed_class = tasks._job_cost(video, TranscodeJobKind.FULL, None)
+        seconds = tasks.estimate_encode_seconds(cost, speed_class, speeds, mean_seconds, default_speed)
+        if seconds is None:
+            unknown += 1
+        else:
+            total += seconds
+    slots = max(1, tasks.live_worker_slots())
+    click.echo(f"{len(todo)} video(s) to re-encode, {current} already current")
+    click.echo(f"Estimated encode time: {total / 3600:.1f} slot-hours, "
+               f"~{total / slots / 3600:.1f} h on {slots} live slot(s)")
+    if unknown:
+        click.echo(f"{unknown} video(s) have no probe or speed data and are not in the estimate")
+
+
+@click.command("hls-batch")
+@click.option("--only-failed", is_flag=True, help="Only videos whose transcode failed")
+@click.option("--since", type=click.DateTime(), default=None, help="Only videos uploaded at or after this time (UTC)")
+@click.option("--dry-run", is_flag=True, help="Print the work and its estimated encode time; queue nothing")
+@click.option("--force", is_flag=True, help="Re-encode even when the output fingerprint is current")
+@click.option("--checkpoint", "checkpoint_path", type=click.Path(dir_okay=False), default=None,
+              help="Progress file (default: <instance>/hls-batch.json)")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint and start over")
+@click.option("--in-flight", type=int, default=None,
+              help="Batch jobs kept queued or running at once (default: twice the live worker slots)")
+@click.option("--priority", type=int, default=None, help="Queue priority (default: TRANSCODE_BATCH_PRIORITY)")
+@click.option("--limit", type=int, default=None, help="Queue at most this many videos in this run")
+@with_appcontext
+def hls_batch(only_failed, since, dry_run, force, checkpoint_path, restart, in_flight, priority, limit):
+    """Bulk re-encode videos through the transcode queue.
+
+    Skips videos whose output fingerprint (ladder, preset and output settings)
+    matches the current config, keeps a bounded number of jobs in the queue
+    for the workers and records every outcome in a checkpoint file: stop it
+    at any point and the next run carries on where it left off.
+    """
+    from app import tasks
+    from app.models import TranscodeJob
+
+    fingerprint = tasks.output_fingerprint(current_app.config)
+    todo, current = tasks.batch_candidates(fingerprint, only_failed=only_failed, since=since, force=force)
+    if dry_run:
+        _dry_run(todo, current)
+        return
+
+    checkpoint_path = checkpoint_path or os.path.join(current_app.instance_path, "hls-batch.json")
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    state = {"fingerprint": fingerprint, "videos": {}} if restart else _load_checkpoint(checkpoint_path, fingerprint)
+    videos = state["videos"]
+    pending = [v for v in todo if videos.get(v.uuid, {}).get("status") not in DONE_STATES]
+    running = {uuid: entry["job_id"] for uuid, entry in videos.items() if entry.get("status") == "running"}
+    pending = [v for v in pending if v.uuid not in running]
+    priority = priority if priority is not None else int(current_app.config.get("TRANSCODE_BATCH_PRIORITY", -20))
+    in_flight = max(1, in_flight or 2 * tasks.live_worker_slots())
+    click.echo(f"{len(pending)} video(s) to queue, {len(running)} in flight, {current} already current "
+               f"(checkpoint: {checkpoint_path})")
+
+    queued = 0
+    try:
+        while (pending and (limit is None or queued < limit)) or running:
+            while pending and len(running) < in_flight and (limit is None or queued < limit):
+                video = pending.pop(0)
+                source = tasks.batch_source(video)
+                if source is None:
+                    videos[video.uuid] = {"status": "missing"}
+                    click.echo(f"[skip ] {video.uuid}: source file not found")
+                    continue
+                job = tasks.enqueue_batch(video, source, priority, force=force)
+                running[video.uuid] = job.id
+                videos[video.uuid] = {"status": "running", "job_id": job.id}
+                queued += 1
+                click.echo(f"[queue] {video.uuid} -> job {job.id}")
+            _save_checkpoint(checkpoint_path, state)
+            if not running:
+                break
+            time.sleep(POLL_SECONDS)
+            db.session.commit()    # end the read transaction so job updates are visible
+            for uuid, job_id in list(running.items()):
+                job = db.session.get(TranscodeJob, job_id)
+                status = job.status.value if job is not None else "missing"
+                if status in DONE_STATES:
+                    videos[uuid] = {"status": status, "job_id": job_id}
+                    del running[uuid]
+                    click.echo(f"[{status[:5]:5}] {uuid} (job {job_id})")
+    except KeyboardInterrupt:
+        click.echo("Interrupted; queued jobs keep running and the next run resumes from the checkpoint")
+    finally:
+        _save_checkpoint(checkpoint_path, state)
+
+    counts = {}
+    for entry in videos.values():
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    click.echo("Summary: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
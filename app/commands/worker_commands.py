@@ -0,0 +1,23 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+
+@click.command("hls-worker")
+@click.option("--slots", type=int, default=None, help="Concurrent encode slots (default: HLS_WORKER_SLOTS)")
+@click.option("--drain-seconds", type=int, default=None,
+              help="On SIGTERM, how long in-flight encodes may run before being released (default: HLS_WORKER_DRAIN_SECONDS)")
+@with_appcontext
+def hls_worker(slots, drain_seconds):
+    """Run the standalone HLS transcode worker.
+
+    Claims jobs from transcode_jobs with N concurrent slots, heartbeats its
+    capacity into transcode_workers and shuts down gracefully on SIGTERM.
+    Pair with HLS_WORKER_EMBEDDED=false on the web processes.
+    """
+    from app.tasks import run_hls_worker
+    app = current_app._get_current_object()
+    slots = slots or app.config.get('HLS_WORKER_SLOTS', 1)
+    click.echo(f"Starting HLS worker with {slots} slot(s)")
+    run_hls_worker(app, slots=slots, drain_seconds=drain_seconds)
+    click.echo("HLS worker stopped")
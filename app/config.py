@@ -72,12 +72,131 @@ class Config:
     ALLOW_PUBLIC_PLAYBACK = os.getenv("ALLOW_PUBLIC_PLAYBACK", "false").lower() == "true"
     # Auto-run migrations at startup if set (safe for dev containers / CI). Accepts: true/1/yes
     AUTO_MIGRATE_ON_STARTUP = os.getenv("AUTO_MIGRATE_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+    # HLS segment/key delivery after authorization: "none" streams the file from
+    # Flask, "nginx" returns X-Accel-Redirect to HLS_OFFLOAD_PREFIX (an internal
+    # location aliased to app/static/hls_output), "sendfile" returns X-Sendfile
+    # (Apache mod_xsendfile, lighttpd). See docs/hls_pipeline.md.
+    HLS_OFFLOAD = os.getenv("HLS_OFFLOAD", "none")
+    HLS_OFFLOAD_PREFIX = os.getenv("HLS_OFFLOAD_PREFIX", "/_hls/")
+    # Signed asset URLs: the master prefixes its URIs with an HMAC token
+    # (HLS_URL_SIGNING_KEY, default SECRET_KEY) valid for the video's duration
+    # plus HLS_SIGNED_URL_TTL seconds; segment and key requests under it skip
+    # the JWT check and the database.
+    HLS_SIGNED_URLS = os.getenv("HLS_SIGNED_URLS", "false").lower() in ("1", "true", "yes")
+    HLS_SIGNED_URL_TTL = int(os.getenv("HLS_SIGNED_URL_TTL", "600"))
+    HLS_URL_SIGNING_KEY = os.getenv("HLS_URL_SIGNING_KEY", "")
+    # Per-process cache of video id -> HLS output dir / status for the streaming
+    # routes (0 = off). Status and file_path changes made by this process drop
+    # the entry at once; other processes pick them up within the TTL.
+    HLS_LOCATION_CACHE_TTL = float(os.getenv("HLS_LOCATION_CACHE_TTL", "30"))
+    HLS_LOCATION_CACHE_SIZE = int(os.getenv("HLS_LOCATION_CACHE_SIZE", "4096"))
+    # Plays (master fetches, POST /<id>/view) are counted in a per-process buffer
+    # written every VIEW_BUFFER_SECONDS, or once VIEW_BUFFER_MAX_PENDING entries
+    # pile up (0 = write each view immediately).
+    VIEW_BUFFER_SECONDS = float(os.getenv("VIEW_BUFFER_SECONDS", "5"))
+    VIEW_BUFFER_MAX_PENDING = int(os.getenv("VIEW_BUFFER_MAX_PENDING", "1000"))
 
     # Upload hardening
     MAX_CONTENT_LENGTH_MB = int(os.getenv("MAX_CONTENT_LENGTH_MB", "600"))  # global cap
     MAX_CONTENT_LENGTH = MAX_CONTENT_LENGTH_MB * 1024 * 1024
     ID_UPLOAD_MAX_MB = int(os.getenv("ID_UPLOAD_MAX_MB", "10"))
 
+    # Transcode queue (transcode_jobs table). Lease is renewed while ffmpeg runs;
+    # a job whose lease lapses (worker crash) becomes visible to other workers again.
+    TRANSCODE_LEASE_SECONDS = int(os.getenv("TRANSCODE_LEASE_SECONDS", "120"))
+    TRANSCODE_MAX_ATTEMPTS = int(os.getenv("TRANSCODE_MAX_ATTEMPTS", "3"))
+    TRANSCODE_RETRY_BACKOFF_SECONDS = int(os.getenv("TRANSCODE_RETRY_BACKOFF_SECONDS", "60"))
+    # Upper bound on how long an idle worker waits before re-checking the table
+    # (wake-ups normally come from add_to_queue / PostgreSQL NOTIFY).
+    TRANSCODE_IDLE_WAIT_SECONDS = int(os.getenv("TRANSCODE_IDLE_WAIT_SECONDS", "30"))
+    # Minimum interval between ffmpeg progress writes to the job row
+    TRANSCODE_PROGRESS_INTERVAL_SECONDS = float(os.getenv("TRANSCODE_PROGRESS_INTERVAL_SECONDS", "5"))
+
+    # HLS worker placement. Set HLS_WORKER_EMBEDDED=false in production and run
+    # `flask hls-worker --slots N` separately so web processes only enqueue.
+    # flask CLI commands never start the embedded slot.
+    HLS_WORKER_EMBEDDED = os.getenv("HLS_WORKER_EMBEDDED", "true").lower() in ("1", "true", "yes")
+    HLS_WORKER_SLOTS = int(os.getenv("HLS_WORKER_SLOTS", "1"))
+    HLS_WORKER_HEARTBEAT_SECONDS = int(os.getenv("HLS_WORKER_HEARTBEAT_SECONDS", "30"))
+    # On SIGTERM, in-flight encodes get this long to finish before ffmpeg is
+    # stopped and the job is released back to the queue.
+    HLS_WORKER_DRAIN_SECONDS = int(os.getenv("HLS_WORKER_DRAIN_SECONDS", "300"))
+
+    # Segment-parallel encoding for long sources: the file is cut into
+    # TRANSCODE_CHUNK_SECONDS slices encoded by parallel ffmpeg processes.
+    # Sources shorter than two slices always use the single-process path.
+    TRANSCODE_CHUNKED = os.getenv("TRANSCODE_CHUNKED", "false").lower() in ("1", "true", "yes")
+    TRANSCODE_CHUNK_SECONDS = int(os.getenv("TRANSCODE_CHUNK_SECONDS", "120"))
+    TRANSCODE_CHUNK_PARALLELISM = int(os.getenv("TRANSCODE_CHUNK_PARALLELISM", "0"))  # 0 = cpu_count // 4
+
+    # Segment length in seconds; optionally the first TRANSCODE_STARTUP_SECONDS
+    # (rounded up to whole segments) are cut into short segments of
+    # TRANSCODE_STARTUP_SEGMENT_SECONDS (e.g. 2) for a faster first frame (0 = off).
+    TRANSCODE_SEGMENT_SECONDS = int(os.getenv("TRANSCODE_SEGMENT_SECONDS", "4"))
+    TRANSCODE_STARTUP_SEGMENT_SECONDS = float(os.getenv("TRANSCODE_STARTUP_SEGMENT_SECONDS", "0"))
+    TRANSCODE_STARTUP_SECONDS = float(os.getenv("TRANSCODE_STARTUP_SECONDS", "6"))
+
+    # Segment container: "ts" (MPEG-TS, one file per segment) or "fmp4" (CMAF
+    # fragments packed into one encrypted file per rung, addressed by byte range).
+    TRANSCODE_SEGMENT_FORMAT = os.getenv("TRANSCODE_SEGMENT_FORMAT", "ts")
+
+    # I-frame playlists (#EXT-X-I-FRAMES-ONLY) for trick play and fast seeking:
+    # "lowest" rung of each video, "all" rungs, or "none".
+    TRANSCODE_IFRAME_PLAYLISTS = os.getenv("TRANSCODE_IFRAME_PLAYLISTS", "lowest")
+
+    # Fast-start publishing: encode one rung (the largest <= MAX_HEIGHT) first,
+    # mark the video playable, then add the other rungs as backfill jobs queued
+    # at TRANSCODE_BACKFILL_PRIORITY (below fresh uploads at 0).
+    TRANSCODE_FAST_START = os.getenv("TRANSCODE_FAST_START", "false").lower() in ("1", "true", "yes")
+    TRANSCODE_FAST_START_MAX_HEIGHT = int(os.getenv("TRANSCODE_FAST_START_MAX_HEIGHT", "720"))
+    TRANSCODE_BACKFILL_PRIORITY = int(os.getenv("TRANSCODE_BACKFILL_PRIORITY", "-10"))
+    # Re-transcodes of a video queue below fresh uploads (0) and above backfills
+    TRANSCODE_REENCODE_PRIORITY = int(os.getenv("TRANSCODE_REENCODE_PRIORITY", "-5"))
+    # Bulk re-encodes (flask hls-batch) queue below everything else
+    TRANSCODE_BATCH_PRIORITY = int(os.getenv("TRANSCODE_BATCH_PRIORITY", "-20"))
+    # Queue forecast: encode speed (seconds x megapixels per second) assumed
+    # until completed jobs provide measurements, and the demand window compared
+    # against worker capacity.
+    TRANSCODE_DEFAULT_SPEED = float(os.getenv("TRANSCODE_DEFAULT_SPEED", "4.0"))
+    TRANSCODE_CAPACITY_WINDOW_HOURS = float(os.getenv("TRANSCODE_CAPACITY_WINDOW_HOURS", "24"))
+    # transcode-status polls reuse a forecast this recent instead of replaying the queue
+    TRANSCODE_FORECAST_CACHE_SECONDS = float(os.getenv("TRANSCODE_FORECAST_CACHE_SECONDS", "5"))
+
+    # Shared audio: encode AAC once per listed bitrate (one or two, kbps) as an
+    # #EXT-X-MEDIA audio group instead of muxing a copy into every variant.
+    TRANSCODE_AUDIO_GROUP = os.getenv("TRANSCODE_AUDIO_GROUP", "false").lower() in ("1", "true", "yes")
+    TRANSCODE_AUDIO_BITRATES = os.getenv("TRANSCODE_AUDIO_BITRATES", "128")
+
+    # Remux (-c:v copy) a source that already matches a ladder rung instead of
+    # re-encoding it; the other rungs are still transcoded. Single-process mode only.
+    TRANSCODE_STREAM_COPY = os.getenv("TRANSCODE_STREAM_COPY", "true").lower() in ("1", "true", "yes")
+
+    # Content-aware ladder: CRF-encode a few sampled clips at every rung size,
+    # then pick per-title bitrates and drop rungs that add little detail.
+    TRANSCODE_CONTENT_AWARE = os.getenv("TRANSCODE_CONTENT_AWARE", "false").lower() in ("1", "true", "yes")
+    TRANSCODE_ANALYSIS_CLIPS = int(os.getenv("TRANSCODE_ANALYSIS_CLIPS", "3"))
+    TRANSCODE_ANALYSIS_CLIP_SECONDS = float(os.getenv("TRANSCODE_ANALYSIS_CLIP_SECONDS", "4"))
+
+    # Dedup: a job whose source media (packet hash, any container) and encode
+    # settings match a published output hardlinks that output instead of encoding.
+    TRANSCODE_DEDUP = os.getenv("TRANSCODE_DEDUP", "true").lower() in ("1", "true", "yes")
+
+    # Trickplay: sprite sheets + WebVTT thumbnail track (one tile per interval),
+    # written by the ladder encode alongside the poster image.
+    TRANSCODE_TRICKPLAY = os.getenv("TRANSCODE_TRICKPLAY", "true").lower() in ("1", "true", "yes")
+    TRANSCODE_TRICKPLAY_INTERVAL_SECONDS = float(os.getenv("TRANSCODE_TRICKPLAY_INTERVAL_SECONDS", "10"))
+
+    # Resource governor: ffmpeg runs under nice/ionice (optionally pinned to
+    # TRANSCODE_CPU_AFFINITY, e.g. "2-7"), each job gets the usable cores
+    # (all minus TRANSCODE_RESERVED_CPUS) split over the running jobs, and idle
+    # slots wait while the 1-min load average exceeds TRANSCODE_MAX_LOAD per core (0 = off).
+    TRANSCODE_RESERVED_CPUS = int(os.getenv("TRANSCODE_RESERVED_CPUS", "1"))
+    TRANSCODE_NICE = int(os.getenv("TRANSCODE_NICE", "10"))
+    TRANSCODE_IONICE_CLASS = os.getenv("TRANSCODE_IONICE_CLASS", "best-effort")  # best-effort | idle | none
+    TRANSCODE_IONICE_LEVEL = int(os.getenv("TRANSCODE_IONICE_LEVEL", "7"))
+    TRANSCODE_CPU_AFFINITY = os.getenv("TRANSCODE_CPU_AFFINITY", "")
+    TRANSCODE_MAX_LOAD = float(os.getenv("TRANSCODE_MAX_LOAD", "1.0"))
+
     # Typesense (optional: if configured, search endpoint will use it)
     TYPESENSE_HOST = os.getenv("TYPESENSE_HOST")
     TYPESENSE_PORT = os.getenv("TYPESENSE_PORT")
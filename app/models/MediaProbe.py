@@ -0,0 +1,17 @@
+from app.extensions import db
+from app.models.utils import utcnow
+
+
+class MediaProbe(db.Model):
+    """Cached ``probe_media()`` result for a source file, keyed by its MD5.
+
+    Keyed by content hash rather than by video so a re-upload of the same file,
+    re-transcodes and batch re-runs reuse the probe without calling ffprobe.
+    """
+    __tablename__ = 'media_probes'
+
+    md5 = db.Column(db.String(32), primary_key=True)
+    data = db.Column(db.JSON, nullable=False)
+    # Packet hash of the first video/audio stream (media_probe.content_hash)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
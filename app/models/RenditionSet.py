@@ -0,0 +1,22 @@
+from app.extensions import db
+from app.models.utils import utcnow
+
+
+class RenditionSet(db.Model):
+    """A complete, published HLS output, keyed by what it was encoded from.
+
+    ``key`` hashes the source's ``content_hash`` (packet hash, so container
+    independent) together with every setting that shapes the output. A later
+    transcode with the same key hardlinks this output instead of encoding.
+    Rows whose ``output_dir`` no longer holds a master playlist are stale and
+    dropped on lookup.
+    """
+    __tablename__ = 'rendition_sets'
+
+    key = db.Column(db.String(64), primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    video_uuid = db.Column(db.String(36), nullable=False, index=True)
+    output_dir = db.Column(db.String(512), nullable=False)
+    reuse_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=True)
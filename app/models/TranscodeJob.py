@@ -0,0 +1,133 @@
+from sqlalchemy import Index
+from app.extensions import db
+from app.models.utils import utcnow
+from app.models.enumerations import TranscodeJobStatus, TranscodeJobKind
+
+
+class TranscodeJob(db.Model):
+    """Durable HLS transcode queue entry.
+
+    A job is claimed by a worker by atomically flipping it to RUNNING with a
+    lease (``lease_owner`` + ``lease_expires_at``). Workers renew the lease while
+    ffmpeg runs; if a worker dies the lease lapses and another worker reclaims
+    the job. ``active_key`` is set while the job is queued/running and cleared
+    when it finishes, so the unique constraint dedups concurrent enqueues of the
+    same video without blocking later re-transcodes. Backfill jobs use a
+    per-rung key (``<video>:backfill:<rung>``) so they never collide with the
+    video's primary job.
+
+    Workers claim by ``priority``, then fair share across uploaders
+    (``owner_id``), then shortest ``cost_estimate`` first (see
+    app.tasks.schedule_jobs).
+    """
+    __tablename__ = 'transcode_jobs'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    video_uuid = db.Column(db.String(36), db.ForeignKey('videos.uuid', ondelete='CASCADE'), nullable=False, index=True)
+    input_path = db.Column(db.String(512), nullable=False)
+    status = db.Column(db.Enum(TranscodeJobStatus, name='transcodejobstatus'),
+                       nullable=False, default=TranscodeJobStatus.QUEUED)
+    active_key = db.Column(db.String(64), unique=True, nullable=True)
+    kind = db.Column(db.Enum(TranscodeJobKind, name='transcodejobkind'),
+                     nullable=False, default=TranscodeJobKind.FULL)
+    # Higher runs first: uploads 0 > re-encodes > backfills; admins may bump/demote
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    # Uploader of the video (fair share) and expected work: source seconds x
+    # megapixels encoded across the job's rungs (shortest job first)
+    owner_id = db.Column(db.String(36), nullable=True, index=True)
+    cost_estimate = db.Column(db.Float, nullable=True)
+    # Throughput bucket (top rung + x264 preset, e.g. "1080p/veryfast") and the
+    # wall time of the successful attempt; together they calibrate queue ETAs
+    speed_class = db.Column(db.String(32), nullable=True)
+    encode_seconds = db.Column(db.Float, nullable=True)
+    # Kind-specific options, e.g. {"rungs": ["1080p"]} for a backfill
+    params = db.Column(db.JSON, nullable=True)
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    available_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    lease_owner = db.Column(db.String(128), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    # Live progress parsed from ffmpeg -progress, written at a throttled rate
+    duration_seconds = db.Column(db.Float, nullable=True)
+    progress_pct = db.Column(db.Float, nullable=True)
+    progress_out_time = db.Column(db.Float, nullable=True)
+    progress_fps = db.Column(db.Float, nullable=True)
+    progress_speed = db.Column(db.Float, nullable=True)
+    progress_updated_at = db.Column(db.DateTime, nullable=True)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    __table_args__ = (
+        Index('ix_transcode_jobs_status_available', 'status', 'available_at'),
+        Index('ix_transcode_jobs_status_priority', 'status', 'priority'),
+    )
+
+    def eta_seconds(self):
+        """Remaining encode time, from ffmpeg's speed or the elapsed/percent ratio."""
+        if self.status != TranscodeJobStatus.RUNNING:
+            return 0.0 if self.status == TranscodeJobStatus.SUCCEEDED else None
+        if self.duration_seconds and self.progress_speed and self.progress_out_time is not None:
+            return max(0.0, (self.duration_seconds - self.progress_out_time) / self.progress_speed)
+        if self.progress_pct and self.started_at:
+            elapsed = (utcnow() - self.started_at).total_seconds()
+            return max(0.0, elapsed * (100.0 - self.progress_pct) / self.progress_pct)
+        return None
+
+    def progress_dict(self):
+        eta = self.eta_seconds()
+        return {
+            'percent': round(self.progress_pct, 1) if self.progress_pct is not None else None,
+            'out_time': self.progress_out_time,
+            'duration': self.duration_seconds,
+            'fps': self.progress_fps,
+            'speed': self.progress_speed,
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'updated_at': self.progress_updated_at.isoformat() if self.progress_updated_at else None,
+        }
+
+    def to_dict(self, include_sensitive=False):
+        """Job state for the uploader; ``include_sensitive`` (admins) adds the
+        scheduling internals, the worker holding the lease, the job params and
+        the raw ffmpeg error, which names server paths."""
+        if not include_sensitive:
+            return {
+                'id': self.id,
+                'video_uuid': self.video_uuid,
+                'status': self.status.value if self.status else None,
+                'kind': self.kind.value if self.kind else None,
+                'attempts': self.attempts,
+                'max_attempts': self.max_attempts,
+                'error': 'Transcoding failed' if self.last_error else None,
+                'created_at': self.created_at.isoformat() if self.created_at else None,
+                'started_at': self.started_at.isoformat() if self.started_at else None,
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+                'progress': self.progress_dict(),
+            }
+        return {
+            'id': self.id,
+            'video_uuid': self.video_uuid,
+            'status': self.status.value if self.status else None,
+            'kind': self.kind.value if self.kind else None,
+            'priority': self.priority,
+            'owner_id': self.owner_id,
+            'cost_estimate': self.cost_estimate,
+            'speed_class': self.speed_class,
+            'encode_seconds': self.encode_seconds,
+            'params': self.params,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'available_at': self.available_at.isoformat() if self.available_at else None,
+            'lease_owner': self.lease_owner,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'progress': self.progress_dict(),
+        }
@@ -0,0 +1,39 @@
+from app.extensions import db
+from app.models.utils import utcnow
+
+
+class TranscodeWorker(db.Model):
+    """Heartbeat row for a running ``flask hls-worker`` daemon (or embedded worker).
+
+    ``slots`` is the advertised encode capacity and ``busy_slots`` how many are
+    currently encoding. A worker whose ``heartbeat_at`` is older than a few
+    heartbeat intervals is considered dead.
+    """
+    __tablename__ = 'transcode_workers'
+
+    worker_id = db.Column(db.String(128), primary_key=True)
+    hostname = db.Column(db.String(255), nullable=False)
+    pid = db.Column(db.Integer, nullable=False)
+    slots = db.Column(db.Integer, nullable=False, default=1)
+    busy_slots = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(16), nullable=False, default='running')  # running | draining | stopped
+    started_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    heartbeat_at = db.Column(db.DateTime, nullable=False, default=utcnow, index=True)
+
+    def is_alive(self, stale_after_seconds: int) -> bool:
+        if self.status == 'stopped' or not self.heartbeat_at:
+            return False
+        return (utcnow() - self.heartbeat_at).total_seconds() <= stale_after_seconds
+
+    def to_dict(self, stale_after_seconds: int = 90):
+        return {
+            'worker_id': self.worker_id,
+            'hostname': self.hostname,
+            'pid': self.pid,
+            'slots': self.slots,
+            'busy_slots': self.busy_slots,
+            'status': self.status,
+            'alive': self.is_alive(stale_after_seconds),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+        }
@@ -6,3 +6,7 @@ from .Token import Token
 from .video import Video, VideoTag, Tag, Category, Surgeon, VideoSurgeon, VideoViewEvent, Playlist, PlaylistItem
 from .AuditLog import AuditLog
 from .SystemSetting import SystemSetting
+from .TranscodeJob import TranscodeJob
+from .TranscodeWorker import TranscodeWorker
+from .MediaProbe import MediaProbe
+from .RenditionSet import RenditionSet
@@ -46,4 +46,15 @@ class VIDEO_SPEED(str, Enum):
     _1_0X = '1.0x'
     _1_25X = '1.25x'
     _1_5X = '1.5x'
-    _2X = '2.0x'
\ No newline at end of file
+    _2X = '2.0x'
+
+class TranscodeJobStatus(str, Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+
+class TranscodeJobKind(str, Enum):
+    FULL = 'full'          # primary encode of a video (may be staged as fast-start)
+    BACKFILL = 'backfill'  # extra rungs added after a fast-start publish
@@ -0,0 +1,6 @@
+from datetime import datetime, timezone
+
+
+def utcnow() -> datetime:
+    # Naive UTC so comparisons behave the same on SQLite and PostgreSQL
+    return datetime.now(timezone.utc).replace(tzinfo=None)
@@ -1,15 +1,17 @@
 from datetime import datetime, timedelta, timezone
 from flask import Blueprint, jsonify, request, current_app
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import func
 
 from app.extensions import db
 from app.security_utils import coerce_uuid
-from app.models import User, Surgeon, Video, VideoSurgeon, Token
+from app.models import User, Surgeon, Video, VideoSurgeon, Token, TranscodeWorker, TranscodeJob
 from app.models.video import VideoViewEvent
 from app.models.User import UserRole
 from app.models.video import Favourite
-from app.models.enumerations import Role
+from app.models.enumerations import Role, TranscodeJobStatus
+from app.security_utils import audit_log
+from app import tasks
 from app.utils.decorator import require_roles
 from app.utils.api_helper import parse_pagination_params, build_page_dict
 from app.utils import metrics_cache
@@ -341,6 +343,78 @@ def user_videos(uid):
     out['subject'] = {'type': 'user', 'id': str(u.id), 'username': u.username}
     return jsonify(out)
 
+@admin_api_bp.get('/transcode/workers')
+@jwt_required()
+@require_roles(Role.ADMIN.value, Role.SUPERADMIN.value)
+def transcode_workers():
+    """Registered HLS workers with heartbeat liveness and slot capacity."""
+    stale_after = 3 * current_app.config.get('HLS_WORKER_HEARTBEAT_SECONDS', 30)
+    rows = TranscodeWorker.query.order_by(TranscodeWorker.heartbeat_at.desc()).all()
+    items = [w.to_dict(stale_after_seconds=stale_after) for w in rows]
+    alive = [w for w in items if w['alive']]
+    return jsonify({
+        'items': items,
+        'capacity': {
+            'workers': len(alive),
+            'slots': sum(w['slots'] for w in alive),
+            'busy_slots': sum(w['busy_slots'] for w in alive),
+        }
+    })
+
+@admin_api_bp.get('/transcode/queue')
+@jwt_required()
+@require_roles(Role.ADMIN.value, Role.SUPERADMIN.value)
+def transcode_queue():
+    """Queued transcode jobs in the order workers will claim them (the first
+    SCHEDULE_WINDOW; ``total`` counts them all)."""
+    items = []
+    for position, job in enumerate(tasks.queue_order(), start=1):
+        data = job.to_dict(include_sensitive=True)
+        data['queue_position'] = position
+        items.append(data)
+    return jsonify({'items': items, 'total': tasks.queued_count()})
+
+@admin_api_bp.get('/transcode/forecast')
+@jwt_required()
+@require_roles(Role.ADMIN.value, Role.SUPERADMIN.value)
+def transcode_forecast():
+    """Queue depth, estimated drain time, per-job ETA (claim order) and whether
+    recent upload volume exceeds encode capacity (?window_hours=, default 24)."""
+    window = request.args.get('window_hours', type=float) \
+        or current_app.config.get('TRANSCODE_CAPACITY_WINDOW_HOURS', 24)
+    return jsonify(tasks.queue_forecast(
+        default_speed=current_app.config.get('TRANSCODE_DEFAULT_SPEED', 4.0),
+        stale_after_seconds=3 * current_app.config.get('HLS_WORKER_HEARTBEAT_SECONDS', 30),
+        window_hours=max(1.0, window)))
+
+@admin_api_bp.post('/transcode/jobs/<int:job_id>/priority')
+@jwt_required()
+@require_roles(Role.ADMIN.value, Role.SUPERADMIN.value)
+def transcode_job_priority(job_id):
+    """Bump or demote a queued job.
+    Body: {"action": "bump" | "demote"} (above / below every other queued job)
+    or {"priority": <int>}.
+    """
+    job = db.session.get(TranscodeJob, job_id)
+    if not job:
+        return jsonify({'msg': 'not found'}), 404
+    if job.status != TranscodeJobStatus.QUEUED:
+        return jsonify({'msg': f'job is {job.status.value}, not queued'}), 409
+    body = request.get_json(silent=True) or {}
+    action = body.get('action')
+    priority = body.get('priority')
+    if action not in (None, 'bump', 'demote') or (action is None and not isinstance(priority, int)) \
+            or isinstance(priority, bool):
+        return jsonify({'msg': 'expected {"action": "bump"|"demote"} or {"priority": <int>}'}), 400
+    old = job.priority
+    new = tasks.reprioritize_job(job, priority=priority, action=action)
+    try:
+        audit_log('transcode_job_priority', actor_id=get_jwt_identity(),
+                  detail=f'job={job.id};video={job.video_uuid};priority={old}->{new}')
+    except Exception:
+        pass
+    return jsonify(job.to_dict(include_sensitive=True))
+
 @admin_api_bp.get('/dashboard/metrics')
 @jwt_required()
 @require_roles(Role.ADMIN.value, Role.SUPERADMIN.value)
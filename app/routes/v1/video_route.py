@@ -1,36 +1,38 @@
+import functools
 import hashlib
 import json
 import hashlib as _hashlib
-import subprocess
 from flask_jwt_extended import get_jwt_identity
 import os
-import shutil
+import posixpath
+import time
 from datetime import datetime, timedelta, timezone
-from typing import List
+from typing import List, Optional, Tuple
 import uuid
 from sqlalchemy.exc import SQLAlchemyError
 
 from flask import Blueprint, Response, current_app, jsonify, request, send_from_directory, abort
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, verify_jwt_in_request
 from marshmallow import EXCLUDE
 from sqlalchemy import and_, case, desc, or_, func, literal, literal_column, text as sa_text, cast, String
 import re
 
 from app.extensions import db
-from app.models.video import Favourite, VideoProgress, VideoViewEvent, Playlist, PlaylistItem
+from app.models.video import Favourite, VideoProgress, Playlist, PlaylistItem
 from app.schemas.video_schema import (
     VideoMetaInputSchema, VideoMiniSchema, TagSchema, CategorySchema,
     SurgeonSchema, UserSchema
 )
 
 from app.models import (
-    Video, VideoTag, Tag, Category, Surgeon, VideoSurgeon, User
+    Video, VideoTag, Tag, Category, Surgeon, VideoSurgeon, User, TranscodeJob
 )
-from app.models.enumerations import Role, VideoStatus
+from app.models.enumerations import Role, VideoStatus, TranscodeJobStatus
 
 from werkzeug.utils import secure_filename
-from app.tasks import enqueue_transcode, extract_thumbnail_ffmpeg
-from app.utils import metrics_cache
+from app.tasks import enqueue_transcode, forget_renditions, queue_forecast
+from app.utils import hls_signing, metrics_cache, video_location_cache, view_buffer
+from app.utils.media_probe import probe_media
 from app.utils.decorator import require_roles  # we'll define in #2
 from app.security_utils import rate_limit, ip_and_path_key, audit_log, coerce_uuid
 from app.utils.uploads import ALLOWED_VIDEO_EXT, VIDEO_MIME_PREFIX, get_max_video_mb
@@ -128,35 +130,168 @@ def _related_by_category(video: Video, limit: int = 6) -> List[Video]:
 # 1) HLS Playback — Master Manifest + (optional) segment passthrough
 # ------------------------------------------------------------------------------
 
-def _build_master_response(video: Video):
-    if not video.file_path or not os.path.exists(video.file_path):
-        abort(404, description="HLS master not found")
+# ---------------- HLS asset caching -----------------
+# Everything under a video's output dir is written once per encode, and every
+# encode (re-encode, batch re-encode) starts with a fresh key. The master
+# therefore points players at "_v<key digest>/<rung>/...": those URLs never
+# change content and are cached as immutable; a stale version 404s so the
+# player reloads the master. Unversioned assets (trickplay VTT, direct links)
+# revalidate with their ETag on every use.
+HLS_VERSION_PREFIX = "_v"
+HLS_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+_URI_ATTR = re.compile(r'URI="([^"]+)"')
+HLS_OUTPUT_ROOT = os.path.join("app", "static", "hls_output")
+HLS_OFFLOAD_MODES = ("none", "nginx", "sendfile")
+PUBLIC_PLAYBACK_STATUSES = (VideoStatus.PUBLISHED, VideoStatus.PROCESSED)
+# mimetypes maps .ts to TypeScript and .key to PGP keys
+_HLS_MIMETYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".mp4": "video/mp4",
+    ".m4s": "video/iso.segment",
+    ".key": "application/octet-stream",
+    ".vtt": "text/vtt",
+}
+
+
+def _hls_version(base_dir: str):
+    # One stat per request; the key is only re-read when it was replaced
+    path = os.path.join(base_dir, "keys", "enc.key")
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _key_digest(path, st.st_ino, st.st_mtime_ns, st.st_size)
+
 
-    # Increment view count; do not commit yet if part of wider transaction
-    video.views = (video.views or 0) + 1
+@functools.lru_cache(maxsize=4096)
+def _key_digest(path: str, ino: int, mtime_ns: int, size: int):
     try:
-        # If user context exists, record a view event (may be public route without JWT)
-        from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:16]
+    except OSError:
+        return None
+
+
+def _asset_path_ok(asset: str) -> bool:
+    # Output directories hold no symlinks, so a normalised relative path that
+    # stays inside the directory is enough; no realpath() per request
+    rel = posixpath.normpath(asset)
+    return not (rel == ".." or rel.startswith("../") or rel.startswith("/"))
+
+
+def _hls_master(file_path: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(realpath of the output directory, master name) when ``file_path`` is a
+    master playlist under HLS_OUTPUT_ROOT, else (None, None): until a video is
+    encoded its file_path is the raw upload, which is not served."""
+    if not file_path or not file_path.endswith(".m3u8"):
+        return None, None
+    base_dir = os.path.realpath(os.path.dirname(file_path))
+    if os.path.dirname(base_dir) != os.path.realpath(HLS_OUTPUT_ROOT):
+        return None, None
+    return base_dir, os.path.basename(file_path)
+
+
+def _locate(video: Video) -> video_location_cache.VideoLocation:
+    base_dir, master = _hls_master(video.file_path)
+    return video_location_cache.VideoLocation(
+        base_dir=base_dir, master=master, status=video.status,
+        published=video.status in PUBLIC_PLAYBACK_STATUSES,
+        duration=float(video.duration or 0.0))
+
+
+def _video_location(video_id: str) -> video_location_cache.VideoLocation:
+    """Where a video's HLS output lives, from the location cache or one query.
+
+    404 for unknown videos. Entries live HLS_LOCATION_CACHE_TTL seconds and
+    are dropped in this process when the video's status or file_path changes.
+    Videos that are not encoded yet are not cached: the hls-worker that
+    publishes them runs in another process and cannot drop this one's entry.
+    """
+    ttl = float(current_app.config.get("HLS_LOCATION_CACHE_TTL", 30))
+    location = video_location_cache.get(video_id, ttl) if ttl > 0 else None
+    if location is None:
+        location = _locate(Video.query.filter_by(uuid=video_id).first_or_404())
+        if ttl > 0 and location.base_dir is not None:
+            video_location_cache.put(video_id, location,
+                                     int(current_app.config.get("HLS_LOCATION_CACHE_SIZE", 4096)))
+    return location
+
+
+def _prefix_master(text: str, prefix: str) -> str:
+    lines = []
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            line = prefix + line
+        elif line.startswith("#"):
+            line = _URI_ATTR.sub(lambda m: f'URI="{prefix}{m.group(1)}"', line)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+# ---------------- Signed asset URLs -----------------
+# With HLS_SIGNED_URLS the master prefixes its URIs with an HMAC token bound to
+# the route scope ("jwt" or "public"), the video, the user and an expiry (see
+# app.utils.hls_signing). JWT-route asset requests under a valid token skip the
+# JWT / blocklist check and the Video lookup: the token names the video, whose
+# output directory is fixed by the pipeline. Public ones still check, through
+# the location cache, that the video is published.
+def _hls_signed_urls() -> bool:
+    return bool(current_app.config.get("HLS_SIGNED_URLS"))
+
+
+def _hls_signing_key() -> str:
+    return current_app.config.get("HLS_URL_SIGNING_KEY") or current_app.config["SECRET_KEY"]
+
+
+def _hls_output_dir(video_id: str) -> str:
+    return os.path.abspath(os.path.join(HLS_OUTPUT_ROOT, video_id))
+
+
+def _signed_hls_asset(video_id: str, asset: str, public: bool = False):
+    """Serve ``asset`` ("_s<token>/...") if the token is valid for the video, else None."""
+    token, rest = hls_signing.split(asset)
+    if token is None or not _hls_signed_urls():
+        return None
+    user = hls_signing.verify(_hls_signing_key(), "public" if public else "jwt", token, video_id)
+    if user is None:
+        abort(403)
+    if _audit_hls_asset(rest, signed=True):
         try:
-            verify_jwt_in_request(optional=True)
-            uid = get_jwt_identity()
+            audit_log('public_video_stream_segment' if public else 'video_stream_segment',
+                      target_user_id=user or None, detail=f'video={video_id};asset={rest}')
         except Exception:
-            uid = None
-        if uid:
-            evt = VideoViewEvent(user_id=uid, video_id=video.uuid)
-            db.session.add(evt)
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-        current_app.logger.warning('view_event_persist_failed', exc_info=True)
+            pass
+    return _serve_hls_asset(_hls_output_dir(video_id), rest, public=public or not user)
 
-    directory = os.path.dirname(video.file_path)
-    filename = os.path.basename(video.file_path)
-    path = os.path.join(directory, filename)
-    if not os.path.exists(path):
+
+def _build_master_response(video_id: str, location: video_location_cache.VideoLocation, public: bool = False):
+    if not location.master:
         abort(404, description="HLS master not found")
-    with open(path, "rb") as f:
-        data = f.read()
+    try:
+        with open(os.path.join(location.base_dir, location.master), "r", encoding="utf-8") as f:
+            data = f.read()
+    except (OSError, ValueError):    # UnicodeDecodeError: not a playlist
+        abort(404, description="HLS master not found")
+
+    # If user context exists, record a view event (may be public route without JWT)
+    try:
+        verify_jwt_in_request(optional=True)
+        uid = get_jwt_identity()
+    except Exception:
+        uid = None
+    # Buffered: written in batches by app.utils.view_buffer
+    view_buffer.record(video_id, coerce_uuid(uid) if uid else None)
+
+    prefix = ""
+    version = _hls_version(location.base_dir)
+    if version:
+        prefix = f"{HLS_VERSION_PREFIX}{version}/"
+    if _hls_signed_urls() and location.base_dir == os.path.realpath(_hls_output_dir(video_id)):
+        expires = int(time.time() + location.duration + current_app.config.get("HLS_SIGNED_URL_TTL", 600))
+        prefix = hls_signing.sign(_hls_signing_key(), "public" if public else "jwt", video_id, uid, expires) + "/" + prefix
+    if prefix:
+        data = _prefix_master(data, prefix)
     resp = Response(data, status=200, mimetype="application/vnd.apple.mpegurl")
     resp.headers["Accept-Ranges"] = "none"
     resp.headers.pop("Content-Range", None)
@@ -174,66 +309,130 @@ def hls_master(video_id):
     Serve the .m3u8 stored in Video.file_path.
     file_path should point to .../master.m3u8. We serve the file from its folder.
     """
-    video = Video.query.filter_by(uuid=video_id).first_or_404()
+    location = _video_location(video_id)
     try:
         audit_log('video_stream_master', target_user_id=get_jwt_identity(), detail=f'video={video_id}')
     except Exception:
         pass
-    return _build_master_response(video)
+    return _build_master_response(video_id, location)
 
     
 
 
-def _serve_hls_asset(video: Video, asset: str):
-    base_dir = os.path.dirname(video.file_path)
-    full_path = os.path.join(base_dir, asset)
-    if not os.path.commonpath([os.path.realpath(full_path), os.path.realpath(base_dir)]) == os.path.realpath(base_dir):
-        abort(403)
-    if not os.path.exists(full_path):
+def _hls_offload() -> str:
+    # Validated in create_app
+    return current_app.config.get("HLS_OFFLOAD", "none")
+
+
+def _audit_hls_asset(asset: str, signed: bool = False) -> bool:
+    """Whether an asset request gets an audit row. With offload on or a signed
+    URL, segments skip it: the master and the key fetch (one per rung per
+    playback) already record who played what, and the insert would cost more
+    than the request."""
+    return (_hls_offload() == "none" and not signed) or os.path.basename(os.path.dirname(asset)) == "keys"
+
+
+def _offload_response(base_dir: str, asset: str, mode: str) -> Response:
+    """Empty response telling the front server which file to send.
+
+    nginx: X-Accel-Redirect to HLS_OFFLOAD_PREFIX/<output dir name>/<asset>,
+    an ``internal`` location aliased to the HLS output root. Others
+    (Apache mod_xsendfile, lighttpd): X-Sendfile with the absolute path. The
+    front server answers Range / conditional requests itself.
+    """
+    rel = posixpath.normpath(asset)
+    ext = os.path.splitext(rel)[1].lower()
+    resp = Response(status=200, mimetype=_HLS_MIMETYPES.get(ext, "application/octet-stream"))
+    if mode == "nginx":
+        prefix = current_app.config.get("HLS_OFFLOAD_PREFIX", "/_hls/").rstrip("/")
+        resp.headers["X-Accel-Redirect"] = f"{prefix}/{os.path.basename(os.path.normpath(base_dir))}/{rel}"
+    else:
+        resp.headers["X-Sendfile"] = os.path.join(os.path.abspath(base_dir), rel)
+    return resp
+
+
+def _serve_hls_asset(base_dir: str, asset: str, public: bool = False):
+    if not base_dir:
         abort(404)
-    return send_from_directory(base_dir, asset)
+    versioned = asset.startswith(HLS_VERSION_PREFIX)
+    if versioned:
+        version, _, asset = asset.partition("/")
+        if version[len(HLS_VERSION_PREFIX):] != _hls_version(base_dir):
+            abort(404)
+    if not _asset_path_ok(asset):
+        abort(403)
+    mode = _hls_offload()
+    if mode != "none":
+        resp = _offload_response(base_dir, asset, mode)
+    else:
+        # send_from_directory 404s missing files itself;
+        # conditional: strong ETag + Last-Modified answer If-None-Match /
+        # If-Modified-Since with 304, and Range requests (the #EXT-X-BYTERANGE
+        # spans of packed fMP4 rungs) with 206 partial content
+        mimetype = _HLS_MIMETYPES.get(os.path.splitext(asset)[1].lower())
+        resp = send_from_directory(base_dir, asset, conditional=True, etag=True, mimetype=mimetype)
+        resp.headers.pop("Expires", None)
+    if not versioned:
+        resp.headers["Cache-Control"] = "no-cache"
+    elif asset.startswith("keys/") and not public:
+        # Keys stay out of shared caches; encrypted segments may live there
+        resp.headers["Cache-Control"] = f"private, max-age={HLS_IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        resp.headers["Cache-Control"] = f"public, max-age={HLS_IMMUTABLE_MAX_AGE}, immutable"
+    return resp
 
 @video_bp.route("/hls/<string:video_id>/<path:asset>", methods=["GET"])
-@jwt_required()
 def hls_assets(video_id, asset):
     """
     Optional helper to serve HLS segments/keys under the same folder as master.m3u8
     Example: /hls/<id>/segments/segment_000.ts or /hls/<id>/keys/key.key
+    Signed paths (/hls/<id>/_s<token>/...) are authorized by their token, the
+    rest by JWT.
     """
-    video = Video.query.filter_by(uuid=video_id).first_or_404()
-    try:
-        audit_log('video_stream_segment', target_user_id=get_jwt_identity(), detail=f'video={video_id};asset={asset}')
-    except Exception:
-        pass
-    return _serve_hls_asset(video, asset)
+    signed = _signed_hls_asset(video_id, asset)
+    if signed is not None:
+        return signed
+    verify_jwt_in_request()
+    location = _video_location(video_id)
+    if _audit_hls_asset(asset):
+        try:
+            audit_log('video_stream_segment', target_user_id=get_jwt_identity(), detail=f'video={video_id};asset={asset}')
+        except Exception:
+            pass
+    return _serve_hls_asset(location.base_dir, asset)
 
 # ---------------- Public Playback (Optional) -----------------
 @video_bp.route("/public/hls/<string:video_id>/master.m3u8", methods=["GET"])
 def public_hls_master(video_id):
     if not current_app.config.get("ALLOW_PUBLIC_PLAYBACK"):
         abort(404)
-    video = Video.query.filter_by(uuid=video_id).first_or_404()
+    location = _video_location(video_id)
     # Only allow published videos publicly
-    if video.status not in [VideoStatus.PUBLISHED, VideoStatus.PROCESSED]:
+    if not location.published:
         abort(403)
     try:
         audit_log('public_video_stream_master', detail=f'video={video_id}')
     except Exception:
         pass
-    return _build_master_response(video)
+    return _build_master_response(video_id, location, public=True)
 
 @video_bp.route("/public/hls/<string:video_id>/<path:asset>", methods=["GET"])
 def public_hls_assets(video_id, asset):
     if not current_app.config.get("ALLOW_PUBLIC_PLAYBACK"):
         abort(404)
-    video = Video.query.filter_by(uuid=video_id).first_or_404()
-    if video.status not in [VideoStatus.PUBLISHED, VideoStatus.PROCESSED]:
+    # Checked for signed paths too: a token outlives an unpublish
+    location = _video_location(video_id)
+    if not location.published:
         abort(403)
-    try:
-        audit_log('public_video_stream_segment', detail=f'video={video_id};asset={asset}')
-    except Exception:
-        pass
-    return _serve_hls_asset(video, asset)
+    signed = _signed_hls_asset(video_id, asset, public=True)
+    if signed is not None:
+        return signed
+    if _audit_hls_asset(asset):
+        try:
+            audit_log('public_video_stream_segment', detail=f'video={video_id};asset={asset}')
+        except Exception:
+            pass
+    return _serve_hls_asset(location.base_dir, asset, public=True)
 
 
 
@@ -618,24 +817,11 @@ def _parse_uuid(s: str):
         return None
 
 
-def get_video_duration(path):
+def get_video_duration(path, md5=None):
     try:
-        # Resolve ffprobe path once per call to avoid import-time failures
-        ffprobe_bin = os.environ.get('FFPROBE_BIN') or shutil.which('ffprobe')
-        if not ffprobe_bin:
-            raise RuntimeError("ffprobe not found. Install ffmpeg or set FFPROBE_BIN to its path.")
-
-        result = subprocess.run([
-            ffprobe_bin, '-v', 'error', '-show_entries',
-            'format=duration', '-of',
-            'default=noprint_wrappers=1:nokey=1', path
-        ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-        output = result.stdout.decode().strip()
-        return float(output) if output.replace('.', '', 1).isdigit() else None
-
+        return probe_media(path, md5=md5).get("duration")
     except Exception as e:
-        print(f"Error reading duration: {e}")
+        current_app.logger.warning("Error reading duration: %s", e)
         return None
 
 def get_md5(file_path):
@@ -688,7 +874,6 @@ def upload_video():
         # Save file directly
         file.save(path)
 
-        duration = get_video_duration(path)
         md5 = get_md5(path)
         
         video = Video.query.filter_by(md5=md5).first()
@@ -696,6 +881,8 @@ def upload_video():
             current_app.logger.info(f"Video with MD5 {md5} already exists: {video.uuid}")
             os.remove(path)
             return jsonify({"uuid": video.uuid, "status": video.status.value}), 200
+
+        duration = get_video_duration(path, md5=md5)
         
         # Create Video instance
         video = Video(
@@ -718,8 +905,8 @@ def upload_video():
         except Exception:
             pass
 
+        # Poster and trickplay sprites come out of the transcode's own decode
         enqueue_transcode(video.uuid)
-        extract_thumbnail_ffmpeg(path, video_uuid, output_dir=THUMBNAILS_DIR)
         try:
             audit_log('video_upload', actor_id=user_uuid, detail=f'video={video.uuid};size={size}')
         except Exception:
@@ -843,7 +1030,6 @@ def _process_final_video(path: str, filename: str, user_uuid: str):
     except Exception:
         pass
 
-    duration = get_video_duration(path)
     md5 = get_md5(path)
     existing = Video.query.filter_by(md5=md5).first()
     if existing:
@@ -851,6 +1037,7 @@ def _process_final_video(path: str, filename: str, user_uuid: str):
         try: os.remove(path)
         except Exception: pass
         return existing
+    duration = get_video_duration(path, md5=md5)
 
     video_uuid = str(uuid.uuid4())
     new_name = f"{video_uuid}_{filename}"
@@ -872,10 +1059,6 @@ def _process_final_video(path: str, filename: str, user_uuid: str):
     db.session.add(video)
     db.session.commit()
     enqueue_transcode(video.uuid)
-    try:
-        extract_thumbnail_ffmpeg(final_path, video_uuid, output_dir=THUMBNAILS_DIR)
-    except Exception:
-        current_app.logger.warning("Thumbnail extraction failed for chunked upload", exc_info=True)
     return video
 
 def _sha256_file(path: str) -> str:
@@ -1143,6 +1326,42 @@ def upload_status():
     return jsonify(payload), 200
 
 
+@video_bp.route("/<string:video_id>/transcode-status", methods=["GET"])
+@jwt_required()
+def transcode_status(video_id):
+    """Latest transcode job for a video with live ffmpeg progress and ETA.
+    Response: { video_id, video_status, job: {status, attempts, queue_position, queue_eta_seconds,
+    progress: {...}} | null }
+    Visible to the uploader and admins; only admins get the job's lease, params
+    and raw error (see TranscodeJob.to_dict).
+    """
+    user_uuid = coerce_uuid(get_jwt_identity())
+    video = Video.query.filter_by(uuid=video_id).first_or_404()
+    from flask_jwt_extended import get_jwt
+    roles_claim = get_jwt().get('roles', [])
+    is_admin = any(r in roles_claim for r in [Role.ADMIN.value, Role.SUPERADMIN.value])
+    if video.user_id != user_uuid and not is_admin:
+        return jsonify({"error": "Not owner"}), 403
+
+    job = (TranscodeJob.query.filter_by(video_uuid=video_id)
+           .order_by(TranscodeJob.id.desc()).first())
+    payload = {"video_id": video_id, "video_status": video.status.value, "job": None}
+    if job:
+        data = job.to_dict(include_sensitive=is_admin)
+        data["queue_position"] = None
+        if job.status == TranscodeJobStatus.QUEUED:
+            # Shared by every queued job's status polls for a few seconds
+            forecast = queue_forecast(
+                default_speed=current_app.config.get('TRANSCODE_DEFAULT_SPEED', 4.0),
+                stale_after_seconds=3 * current_app.config.get('HLS_WORKER_HEARTBEAT_SECONDS', 30),
+                cache_seconds=current_app.config.get('TRANSCODE_FORECAST_CACHE_SECONDS', 5))
+            item = next((i for i in forecast["items"] if i["job_id"] == job.id), None)
+            data["queue_position"] = item["queue_position"] if item else None
+            data["queue_eta_seconds"] = item["eta_seconds"] if item else None
+        payload["job"] = data
+    return jsonify(payload), 200
+
+
 @video_bp.route("/", methods=["POST"])
 @jwt_required()
 @require_roles(Role.UPLOADER.value, Role.ADMIN.value)
@@ -1271,6 +1490,7 @@ def update_video(video_id):
         video.surgeons = surg
 
     db.session.commit()
+    video_location_cache.invalidate(video_id)
     try:
         audit_log('video_update', actor_id=editor_id, detail=f'video={video_id}')
     except Exception:
@@ -1291,6 +1511,9 @@ def delete_video(video_id):
         return jsonify({"error": "Not owner"}), 403
     db.session.delete(video)
     db.session.commit()
+    video_location_cache.invalidate(video_id)
+    # Its output must not be linked into new uploads with the same content
+    forget_renditions(video_id)
     try:
         metrics_cache.invalidate()
     except Exception:
@@ -2171,15 +2394,8 @@ def serve_thumbnail(video_id):
 @jwt_required()
 def add_view(video_id):
     user_id = get_jwt_identity()
-    video = Video.query.filter_by(uuid=video_id).first_or_404()
-    video.views = (video.views or 0) + 1
-    evt = VideoViewEvent(user_id=user_id, video_id=video.uuid)
-    try:
-        db.session.add(evt)
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-        current_app.logger.warning('add_view_persist_failed', exc_info=True)
+    _video_location(video_id)    # 404 for unknown videos
+    view_buffer.record(video_id, coerce_uuid(user_id))
     try:
         audit_log('video_view_event', actor_id=user_id, detail=f'video={video_id}')
     except Exception:
@@ -1,29 +1,38 @@
 # app/tasks.py
-from typing import Tuple, List, Dict
+from typing import Callable, Dict, List, Optional, Tuple
+import contextvars
+import functools
+import hashlib
+import heapq
 import json
+import math
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import traceback
 import glob
-import uuid
-import sys
 import re
 import os
 import logging
+import socket
 import threading
 import time
-from typing import Optional, Dict
+from datetime import datetime, timedelta, timezone
 import subprocess
 import secrets
 import shutil
+import tempfile
 
+from cryptography.hazmat.primitives import padding as crypto_padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from flask import current_app
 from app.extensions import db
-from app.models import Video
-from sqlalchemy import text, inspect as sa_inspect
-from app.models.enumerations import VideoStatus
+from app.models import Video, TranscodeJob, TranscodeWorker, MediaProbe, RenditionSet
+from sqlalchemy import text, inspect as sa_inspect, update, and_, or_, func, case
+from sqlalchemy.exc import IntegrityError
+from app.models.enumerations import VideoStatus, TranscodeJobStatus, TranscodeJobKind
+from app.models.utils import utcnow as _utcnow
+from app.utils import hls_iframes, hls_playlists, video_location_cache
+from app.utils.media_probe import probe_media, content_hash
+from app.utils.resource_governor import ResourceGovernor
 
-_queue = []
-_lock = threading.Lock()
 logger = logging.getLogger('tasks')
 
 
@@ -51,80 +60,1122 @@ except Exception as _bin_err:
     FFPROBE_BIN = "ffprobe"
 
 
-def extract_thumbnail_ffmpeg(video_path, video_uuid, output_dir="thumbnails", time="00:00:01"):
-    os.makedirs(output_dir, exist_ok=True)
-    thumbnail_path = os.path.join(output_dir, f"{video_uuid}.jpg")
+# -------------------- Durable Transcode Queue --------------------
+# Jobs live in the transcode_jobs table (see app.models.TranscodeJob) so they
+# survive restarts and are shared by every process pointing at the same DB.
+# Workers claim a job by flipping it to RUNNING under a lease, renew the lease
+# while ffmpeg runs, and a lapsed lease makes the job claimable again.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+NOTIFY_CHANNEL = "transcode_jobs"
+
+# Local wake-up for idle workers. _wake_seq is bumped on every notify so a
+# worker that checked the table just before the notify does not miss it.
+_wake = threading.Condition()
+_wake_seq = 0
+
+
+def _signal_workers() -> None:
+    global _wake_seq
+    with _wake:
+        _wake_seq += 1
+        _wake.notify_all()
+
+
+def _notify_workers() -> None:
+    """Wake idle workers in this process and (on PostgreSQL) in other processes."""
+    _signal_workers()
+    try:
+        if getattr(db.engine, "name", "").lower() == "postgresql":
+            with db.engine.begin() as conn:
+                conn.execute(text("SELECT pg_notify(:ch, '')"), {"ch": NOTIFY_CHANNEL})
+    except Exception:
+        logger.debug("pg_notify failed; workers will pick the job up on their next poll", exc_info=True)
+
+
+def _wait_for_work(seen_seq: int, timeout: float) -> None:
+    with _wake:
+        _wake.wait_for(lambda: _wake_seq != seen_seq, timeout=timeout)
+
+
+def _active_key(video_id: str, kind: TranscodeJobKind, params: Optional[Dict]) -> str:
+    if kind == TranscodeJobKind.BACKFILL:
+        return f"{video_id}:backfill:{'+'.join((params or {}).get('rungs') or [])}"
+    return video_id
+
+
+def _job_cost(video: Optional[Video], kind: TranscodeJobKind,
+              params: Optional[Dict]) -> Tuple[Optional[float], Optional[str]]:
+    """Expected work of a job and its throughput bucket.
+
+    Work is source seconds x megapixels of the rungs it encodes; the bucket is
+    the top rung plus the x264 preset. Uses the probe cached at upload; the
+    cost is None when duration or size is unknown.
+    """
+    if video is None:
+        return None, None
+    row = db.session.get(MediaProbe, video.md5) if video.md5 else None
+    probe = row.data if row else {}
+    duration = probe.get("duration") or video.duration
+    if not duration or not probe.get("width") or not probe.get("height"):
+        return None, None
+    variants = _select_variants(probe["width"], probe["height"])
+    names = (params or {}).get("rungs") or [r["name"] for r in (params or {}).get("ladder") or []]
+    if names:
+        variants = [v for v in variants if v["name"] in names] or variants
+    cost = round(duration * sum(v["width"] * v["height"] for v in variants) / 1e6, 3)
+    return cost, f"{variants[0]['name']}/{ENCODE_PRESET}"
+
+
+def add_to_queue(filepath: str, video_id: str, kind: TranscodeJobKind = TranscodeJobKind.FULL,
+                 priority: int = 0, params: Optional[Dict] = None) -> TranscodeJob:
+    """Persist a transcode job for ``video_id`` and wake the workers.
+
+    Deduplicated on the video (per rung for backfills): if a matching job is
+    already queued or running, that job is returned instead of creating a
+    second one. The job records the video's uploader and expected cost for
+    the scheduler.
+    """
+    active_key = _active_key(video_id, kind, params)
+    existing = TranscodeJob.query.filter_by(active_key=active_key).first()
+    if existing:
+        logger.info("Transcode already queued: key=%s job=%s (%s)", active_key, existing.id, existing.status.value)
+        return existing
+    video = Video.query.filter_by(uuid=video_id).first()
+    cost, speed_class = _job_cost(video, kind, params)
+    job = TranscodeJob(
+        video_uuid=video_id,
+        input_path=filepath,
+        active_key=active_key,
+        kind=kind,
+        priority=priority,
+        params=params,
+        owner_id=str(video.user_id) if video is not None and video.user_id else None,
+        cost_estimate=cost,
+        speed_class=speed_class,
+        max_attempts=current_app.config.get("TRANSCODE_MAX_ATTEMPTS", 3),
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Lost a race with another process enqueueing the same video
+        db.session.rollback()
+        return TranscodeJob.query.filter_by(active_key=active_key).first()
+    _notify_workers()
+    return job
+
+
+# Claimable jobs ranked per claim (highest priority, then oldest, first)
+SCHEDULE_WINDOW = 500
+
+
+def _claimable_clause(now: datetime):
+    return or_(
+        and_(TranscodeJob.status == TranscodeJobStatus.QUEUED, TranscodeJob.available_at <= now),
+        and_(TranscodeJob.status == TranscodeJobStatus.RUNNING, TranscodeJob.lease_expires_at < now),
+    )
+
+
+def schedule_jobs(jobs: List[TranscodeJob], limit: Optional[int] = None) -> List[TranscodeJob]:
+    """Order jobs the way workers claim them.
+
+    Highest priority first. Within a priority, uploaders take turns: the one
+    with the fewest jobs running (then the one served least recently) goes
+    next, so a bulk upload cannot hold back someone else's single clip. Ties
+    go to the shortest expected job (cost_estimate; unknown last), then the
+    oldest. Each pick counts as served, so the result interleaves uploaders.
+
+    Each uploader's jobs sit in a heap and a second heap ranks the uploaders by
+    their next job, so ordering n jobs is O(n log n).
+    """
+    owners = {j.owner_id for j in jobs}
+    now = _utcnow()
+    running = dict(
+        db.session.query(TranscodeJob.owner_id, func.count(TranscodeJob.id))
+        .filter(TranscodeJob.status == TranscodeJobStatus.RUNNING, TranscodeJob.lease_expires_at >= now,
+                TranscodeJob.owner_id.in_([o for o in owners if o is not None]))
+        .group_by(TranscodeJob.owner_id).all())
+    last_start = dict(
+        db.session.query(TranscodeJob.owner_id, func.max(TranscodeJob.started_at))
+        .filter(TranscodeJob.owner_id.in_([o for o in owners if o is not None]))
+        .group_by(TranscodeJob.owner_id).all())
+    served = {o: running.get(o, 0) for o in owners}
+    # (0, real start) sorts before (1, n): picks made here count as most recent
+    recent = {o: (0, last_start.get(o) or datetime.min) for o in owners}
+
+    queues: Dict[object, list] = {o: [] for o in owners}
+    for j in jobs:
+        queues[j.owner_id].append((-j.priority, j.cost_estimate is None, j.cost_estimate or 0.0, j.id, j))
+    for q in queues.values():
+        heapq.heapify(q)
+
+    def rank(owner):
+        # An uploader competes with its next job; only its own picks change its rank
+        prio, unknown, cost, job_id, _ = queues[owner][0]
+        return (prio, served[owner], recent[owner], unknown, cost, job_id, owner)
+    ready = [rank(o) for o in owners]
+    heapq.heapify(ready)
+
+    order: List[TranscodeJob] = []
+    while ready and (limit is None or len(order) < limit):
+        owner = heapq.heappop(ready)[-1]
+        order.append(heapq.heappop(queues[owner])[-1])
+        served[owner] += 1
+        recent[owner] = (1, len(order))
+        if queues[owner]:
+            heapq.heappush(ready, rank(owner))
+    return order
+
+
+def queue_order(limit: Optional[int] = None) -> List[TranscodeJob]:
+    """The first ``limit`` (default SCHEDULE_WINDOW) queued jobs in claim
+    order; jobs still backing off follow, soonest first. Like claim_next_job,
+    only that many ready jobs (priority, then age) are ordered, so deep queues
+    stay cheap."""
+    limit = limit or SCHEDULE_WINDOW
+    now = _utcnow()
+    queued = TranscodeJob.query.filter(TranscodeJob.status == TranscodeJobStatus.QUEUED)
+    ready = (queued.filter(TranscodeJob.available_at <= now)
+             .order_by(TranscodeJob.priority.desc(), TranscodeJob.available_at.asc(), TranscodeJob.id.asc())
+             .limit(limit).all())
+    order = schedule_jobs(ready, limit=limit)
+    if len(order) < limit:
+        order += (queued.filter(TranscodeJob.available_at > now)
+                  .order_by(TranscodeJob.available_at.asc(), TranscodeJob.id.asc())
+                  .limit(limit - len(order)).all())
+    return order
+
+
+def queued_count() -> int:
+    return TranscodeJob.query.filter(TranscodeJob.status == TranscodeJobStatus.QUEUED).count()
+
+
+def reprioritize_job(job: TranscodeJob, priority: Optional[int] = None, action: Optional[str] = None) -> int:
+    """Set a queued job's priority: an explicit value, or ``bump`` above /
+    ``demote`` below every other queued job. Returns the new priority."""
+    if action in ("bump", "demote"):
+        agg = func.max if action == "bump" else func.min
+        edge = (db.session.query(agg(TranscodeJob.priority))
+                .filter(TranscodeJob.status == TranscodeJobStatus.QUEUED, TranscodeJob.id != job.id).scalar())
+        if edge is None:
+            edge = job.priority
+        priority = edge + 1 if action == "bump" else edge - 1
+    elif priority is None:
+        raise ValueError("priority or action (bump|demote) required")
+    job.priority = int(priority)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return job.priority
+
+
+def claim_next_job(worker_id: str, lease_seconds: int) -> Optional[TranscodeJob]:
+    """Atomically claim the next runnable job (queued, or running with a lapsed lease).
+
+    Candidates are ranked by schedule_jobs. Uses a conditional UPDATE per
+    candidate rather than row locks so it behaves the same on SQLite and
+    PostgreSQL: only one worker's UPDATE can match.
+    """
+    now = _utcnow()
+    window = (
+        TranscodeJob.query
+        .filter(_claimable_clause(now))
+        .order_by(TranscodeJob.priority.desc(), TranscodeJob.available_at.asc(), TranscodeJob.id.asc())
+        .limit(SCHEDULE_WINDOW)
+        .all()
+    )
+    candidates = [j.id for j in schedule_jobs(window, limit=5)]
+    for job_id in candidates:
+        stmt = (
+            update(TranscodeJob)
+            .where(TranscodeJob.id == job_id, _claimable_clause(now))
+            .values(
+                status=TranscodeJobStatus.RUNNING,
+                lease_owner=worker_id,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=TranscodeJob.attempts + 1,
+                started_at=now,
+                updated_at=now,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            res = db.session.execute(stmt)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if res.rowcount == 1:
+            return db.session.get(TranscodeJob, job_id)
+    return None
+
+
+def renew_lease(job_id: int, worker_id: str, lease_seconds: int) -> bool:
+    """Extend the lease on a running job; False means the lease was lost."""
+    now = _utcnow()
+    stmt = (
+        update(TranscodeJob)
+        .where(TranscodeJob.id == job_id, TranscodeJob.lease_owner == worker_id,
+               TranscodeJob.status == TranscodeJobStatus.RUNNING)
+        .values(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        res = db.session.execute(stmt)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return res.rowcount == 1
+
+
+def complete_job(job_id: int, worker_id: str) -> bool:
+    """Mark a job succeeded and record how long the attempt took.
+    Returns False if this worker no longer owns it."""
+    now = _utcnow()
+    started = db.session.query(TranscodeJob.started_at).filter(TranscodeJob.id == job_id).scalar()
+    stmt = (
+        update(TranscodeJob)
+        .where(TranscodeJob.id == job_id, TranscodeJob.lease_owner == worker_id,
+               TranscodeJob.status == TranscodeJobStatus.RUNNING)
+        .values(status=TranscodeJobStatus.SUCCEEDED, active_key=None, lease_owner=None,
+                lease_expires_at=None, last_error=None, finished_at=now, updated_at=now,
+                progress_pct=100.0, progress_speed=None, progress_updated_at=now,
+                encode_seconds=(now - started).total_seconds() if started else None)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        res = db.session.execute(stmt)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return res.rowcount == 1
+
+
+def fail_job(job_id: int, worker_id: str, error: Optional[str] = None) -> bool:
+    """Record a failed attempt.
+
+    Requeues with exponential backoff while attempts remain; otherwise marks the
+    job FAILED. Returns True when the failure is final.
+    """
+    job = db.session.get(TranscodeJob, job_id)
+    if not job or job.lease_owner != worker_id:
+        return False
+    now = _utcnow()
+    job.last_error = (error or "")[:4000] or None
+    job.lease_owner = None
+    job.lease_expires_at = None
+    final = job.attempts >= job.max_attempts
+    if final:
+        job.status = TranscodeJobStatus.FAILED
+        job.active_key = None
+        job.finished_at = now
+    else:
+        base = current_app.config.get("TRANSCODE_RETRY_BACKOFF_SECONDS", 60)
+        job.status = TranscodeJobStatus.QUEUED
+        job.available_at = now + timedelta(seconds=base * (2 ** max(0, job.attempts - 1)))
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return final
+
+
+# -------------------- Capacity Planning --------------------
+# Throughput (cost_estimate units per wall second) is learned per speed_class
+# from recent successful jobs. The forecast replays the claim order over the
+# live worker slots to give every queued job an ETA.
+SPEED_SAMPLE_JOBS = 200
+
+
+def encode_speeds(sample: int = SPEED_SAMPLE_JOBS) -> Tuple[Dict[str, float], Optional[float]]:
+    """Measured throughput per speed_class ("*" = all classes) from the last
+    ``sample`` successful jobs, and their mean wall time per job."""
+    rows = (
+        db.session.query(TranscodeJob.speed_class, TranscodeJob.cost_estimate, TranscodeJob.encode_seconds)
+        .filter(TranscodeJob.status == TranscodeJobStatus.SUCCEEDED, TranscodeJob.encode_seconds > 0)
+        .order_by(TranscodeJob.finished_at.desc())
+        .limit(sample)
+        .all()
+    )
+    totals: Dict[str, List[float]] = {}
+    for speed_class, cost, seconds in rows:
+        if not cost:
+            continue
+        for key in {speed_class or "*", "*"}:
+            acc = totals.setdefault(key, [0.0, 0.0])
+            acc[0] += cost
+            acc[1] += seconds
+    speeds = {key: round(cost / seconds, 4) for key, (cost, seconds) in totals.items()}
+    mean_seconds = sum(r[2] for r in rows) / len(rows) if rows else None
+    return speeds, mean_seconds
+
+
+def estimate_encode_seconds(cost: Optional[float], speed_class: Optional[str], speeds: Dict[str, float],
+                            mean_seconds: Optional[float], default_speed: float = 4.0) -> Optional[float]:
+    """Wall seconds one slot needs for a job of ``cost`` (see encode_speeds)."""
+    if cost:
+        return cost / (speeds.get(speed_class) or speeds.get("*") or default_speed)
+    return mean_seconds
+
+
+def live_worker_slots(stale_after_seconds: int = 90) -> int:
+    """Encode slots of the workers that heartbeated recently."""
+    return sum(w.slots for w in TranscodeWorker.query.all() if w.is_alive(stale_after_seconds))
+
+
+def _estimated_work(speeds: Dict[str, float], mean_seconds: Optional[float], default_speed: float,
+                    *criteria) -> Tuple[int, float]:
+    """(jobs, estimated encode seconds) of the jobs matching ``criteria``,
+    summed per speed_class in SQL rather than loading every row."""
+    rows = (db.session.query(TranscodeJob.speed_class, func.count(TranscodeJob.id),
+                             func.sum(TranscodeJob.cost_estimate),
+                             func.sum(case((TranscodeJob.cost_estimate > 0, 0), else_=1)))
+            .filter(*criteria).group_by(TranscodeJob.speed_class).all())
+    jobs, seconds = 0, 0.0
+    for speed_class, count, cost, uncosted in rows:
+        jobs += count
+        seconds += estimate_encode_seconds(cost, speed_class, speeds, None, default_speed) or 0.0
+        seconds += (uncosted or 0) * (mean_seconds or 0.0)
+    return jobs, seconds
+
+
+# (args) -> (monotonic time, forecast); see queue_forecast(cache_seconds=...)
+_forecast_cache: Dict[tuple, Tuple[float, Dict]] = {}
+_forecast_lock = threading.Lock()
+
+
+def queue_forecast(default_speed: float = 4.0, stale_after_seconds: int = 90,
+                   window_hours: float = 24.0, cache_seconds: float = 0) -> Dict:
+    """Queue depth, per-job ETA, drain time and demand vs. capacity.
+
+    Each job's encode time is its cost_estimate over the measured speed of its
+    speed_class (falling back to all classes, then ``default_speed``); jobs
+    without a cost take the mean wall time of recent jobs. Running jobs hold
+    their slot for their remaining time, then queued jobs are handed to the
+    earliest free slot in claim order. Only the first SCHEDULE_WINDOW queued
+    jobs get items; the rest add their estimated time, spread over the slots,
+    to the drain time. ``over_capacity`` is set when the work enqueued over the
+    last ``window_hours`` needs more slot time than the live workers have in
+    that window.
+
+    With ``cache_seconds``, a forecast computed that recently for the same
+    arguments is returned instead (status polls of many queued jobs).
+    """
+    key = (default_speed, stale_after_seconds, window_hours)
+    if cache_seconds > 0:
+        with _forecast_lock:
+            hit = _forecast_cache.get(key)
+        if hit and time.monotonic() - hit[0] < cache_seconds:
+            return hit[1]
+    forecast = _queue_forecast(default_speed, stale_after_seconds, window_hours)
+    if cache_seconds > 0:
+        with _forecast_lock:
+            _forecast_cache[key] = (time.monotonic(), forecast)
+    return forecast
+
+
+def _queue_forecast(default_speed: float, stale_after_seconds: int, window_hours: float) -> Dict:
+    now = _utcnow()
+    speeds, mean_seconds = encode_speeds()
+
+    def estimate(job: TranscodeJob) -> Optional[float]:
+        return estimate_encode_seconds(job.cost_estimate, job.speed_class, speeds, mean_seconds, default_speed)
+
+    live_slots = live_worker_slots(stale_after_seconds)
+    running = TranscodeJob.query.filter(TranscodeJob.status == TranscodeJobStatus.RUNNING,
+                                        TranscodeJob.lease_expires_at >= now).all()
+    slots = max(1, live_slots, len(running))
+    free: List[float] = []
+    for job in running:
+        remaining = job.eta_seconds()
+        if remaining is None:
+            est = estimate(job)
+            elapsed = (now - job.started_at).total_seconds() if job.started_at else 0.0
+            remaining = max(0.0, est - elapsed) if est is not None else 0.0
+        free.append(remaining)
+    free += [0.0] * (slots - len(free))
+    heapq.heapify(free)
+
+    items = []
+    windowed = 0.0
+    for position, job in enumerate(queue_order(), start=1):
+        est = estimate(job)
+        windowed += est or 0.0
+        start = max(heapq.heappop(free), (job.available_at - now).total_seconds())
+        finish = start + (est or 0.0)
+        heapq.heappush(free, finish)
+        items.append({
+            "job_id": job.id, "video_uuid": job.video_uuid, "kind": job.kind.value,
+            "priority": job.priority, "queue_position": position,
+            "estimated_seconds": round(est, 1) if est is not None else None,
+            "start_in_seconds": round(start, 1), "eta_seconds": round(finish, 1),
+            "eta_at": (now + timedelta(seconds=finish)).isoformat(),
+        })
+
+    depth = len(items)
+    drain = max(free) if items or running else 0.0
+    if depth >= SCHEDULE_WINDOW:
+        depth, queued_seconds = _estimated_work(speeds, mean_seconds, default_speed,
+                                                TranscodeJob.status == TranscodeJobStatus.QUEUED)
+        drain += max(0.0, queued_seconds - windowed) / slots
+
+    since = now - timedelta(hours=window_hours)
+    incoming, demand = _estimated_work(speeds, mean_seconds, default_speed, TranscodeJob.created_at >= since)
+    capacity = max(1, live_slots) * window_hours * 3600
+    return {
+        "queue_depth": depth,
+        "running": len(running),
+        "slots": live_slots,
+        "estimated_drain_seconds": round(drain, 1),
+        "speeds": speeds,
+        "items": items,
+        "capacity": {
+            "window_hours": window_hours,
+            "incoming_jobs": incoming,
+            "incoming_encode_seconds": round(demand, 1),
+            "capacity_seconds": capacity,
+            "utilization": round(demand / capacity, 3),
+            "over_capacity": demand > capacity,
+        },
+    }
+
+
+class LeaseLostError(RuntimeError):
+    """The running job's lease passed to another worker."""
+
+
+class _JobProcs:
+    """ffmpeg processes started for one job, so losing its lease stops that
+    job's encodes only (_active_procs holds every job's, for draining)."""
+
+    def __init__(self):
+        self.procs: set = set()
+        self.lost = threading.Event()
+
+    def terminate(self) -> None:
+        self.lost.set()
+        with _procs_lock:
+            procs = list(self.procs)
+        for proc in procs:
+            try:
+                proc.terminate()
+            except Exception:
+                pass
 
-    command = [
-        FFMPEG_BIN,
-        "-ss", time,  # Time offset to grab the frame (e.g., 1s)
-        "-i", video_path,
-        "-frames:v", "1",  # Extract only one frame
-        "-q:v", "2",       # Quality (lower is better, 1-31)
-        thumbnail_path
-    ]
 
-    subprocess.run(command, check=True)
-    return thumbnail_path
+# The job the current thread works for; chunk threads run in a copy of the
+# submitting context (see _convert_to_hls_chunked).
+_current_job: "contextvars.ContextVar[Optional[_JobProcs]]" = contextvars.ContextVar("transcode_job", default=None)
 
 
-def add_to_queue(filepath: str, video_id: str):
-    with _lock:
-        _queue.append((filepath, video_id))
+def _check_lease() -> None:
+    """Raise LeaseLostError if the current job's lease was lost; called before
+    anything is written to the published output."""
+    job = _current_job.get()
+    if job is not None and job.lost.is_set():
+        raise LeaseLostError("lease now held by another worker")
+
+
+class _LeaseKeeper:
+    """Background heartbeat that renews a job lease while it is being encoded.
+
+    Within the block, ffmpeg processes are registered with the job; if a
+    renewal finds the lease taken they are terminated, and _run_ffmpeg /
+    _check_lease raise LeaseLostError so nothing gets published.
+    """
+
+    def __init__(self, app, job_id: int, worker_id: str, lease_seconds: int):
+        self.app = app
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.job = _JobProcs()
+        self._token = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def lost(self) -> bool:
+        return self.job.lost.is_set()
+
+    def _run(self):
+        interval = max(1.0, self.lease_seconds / 3.0)
+        while not self._stop.wait(interval):
+            try:
+                with self.app.app_context():
+                    if not renew_lease(self.job_id, self.worker_id, self.lease_seconds):
+                        logger.warning("Lost lease on transcode job %s; stopping its ffmpeg", self.job_id)
+                        self.job.terminate()
+                        return
+            except Exception:
+                logger.warning("Lease renewal failed for job %s", self.job_id, exc_info=True)
+
+    def __enter__(self):
+        self._token = _current_job.set(self.job)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        _current_job.reset(self._token)
+        return False
+
+
+def release_job(job_id: int, worker_id: str) -> bool:
+    """Hand a running job back to the queue without counting the attempt
+    (used when a worker shuts down mid-encode)."""
+    job = db.session.get(TranscodeJob, job_id)
+    if not job or job.lease_owner != worker_id or job.status != TranscodeJobStatus.RUNNING:
+        return False
+    job.status = TranscodeJobStatus.QUEUED
+    job.attempts = max(0, (job.attempts or 0) - 1)
+    job.lease_owner = None
+    job.lease_expires_at = None
+    job.available_at = _utcnow()
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return True
+
+
+# -------------------- Worker Process / Slots --------------------
+# _stop is set when the worker process is asked to shut down; slots stop
+# claiming new jobs. _terminated is set once the drain deadline passed and
+# running ffmpeg processes were stopped, so interrupted jobs are released
+# rather than counted as failures.
+_stop = threading.Event()
+_terminated = threading.Event()
+_active_procs: set = set()
+_procs_lock = threading.Lock()
+_busy_slots = 0
+_slots = 1    # encode slots this process runs; each job's thread budget is a 1/_slots share
+# Priority, affinity and thread budget of every ffmpeg this process starts;
+# replaced from app config when a worker starts.
+_governor = ResourceGovernor()
+GOVERNOR_RECHECK_SECONDS = 15
+
+
+def _run_ffmpeg(cmd: List[str], on_progress: Optional[Callable[[Dict], None]] = None,
+                capture: bool = False) -> Optional[str]:
+    """subprocess.run(cmd, check=True), but tracked so a draining worker can stop it.
+
+    With ``on_progress``, ffmpeg writes ``-progress`` key=value blocks to stdout
+    and each completed block is passed to the callback as it arrives. With
+    ``capture``, stdout is returned (stderr goes on the CalledProcessError).
+
+    Inside a _LeaseKeeper block the process is also registered with its job
+    and LeaseLostError is raised once that job's lease is lost.
+    """
+    if on_progress is not None:
+        cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + cmd[1:]
+    job = _current_job.get()
+    _check_lease()
+    proc = subprocess.Popen(_governor.wrap(cmd), stdout=subprocess.PIPE if on_progress or capture else None,
+                            stderr=subprocess.PIPE if capture else None,
+                            text=on_progress is not None or capture)
+    with _procs_lock:
+        _active_procs.add(proc)
+        if job is not None:
+            job.procs.add(proc)
+    if job is not None and job.lost.is_set():
+        # Lost between the check and registering: terminate() missed it
+        proc.terminate()
+    out = err = None
+    try:
+        if capture:
+            out, err = proc.communicate()
+        elif on_progress is not None:
+            _read_progress(proc.stdout, on_progress)
+        rc = proc.wait()
+    finally:
+        with _procs_lock:
+            _active_procs.discard(proc)
+            if job is not None:
+                job.procs.discard(proc)
+    _check_lease()
+    if rc != 0:
+        raise subprocess.CalledProcessError(rc, cmd, out, err)
+    return out
+
+
+def _parse_progress_block(block: Dict[str, str]) -> Dict:
+    def num(v):
+        try:
+            return float(str(v).rstrip("x"))
+        except (TypeError, ValueError):
+            return None  # "N/A" before the first frame
+    out_us = num(block.get("out_time_us", block.get("out_time_ms")))
+    return {
+        "out_time": out_us / 1_000_000 if out_us is not None else None,
+        "fps": num(block.get("fps")),
+        "speed": num(block.get("speed")),
+        "done": block.get("progress") == "end",
+    }
+
+
+def _read_progress(stream, on_progress: Callable[[Dict], None]) -> None:
+    block: Dict[str, str] = {}
+    for raw in stream:
+        key, sep, value = raw.strip().partition("=")
+        if not sep:
+            continue
+        block[key] = value
+        if key == "progress":
+            try:
+                on_progress(_parse_progress_block(block))
+            except Exception:
+                logger.debug("Progress callback failed", exc_info=True)
+            block = {}
+
+
+class _ProgressReporter:
+    """Aggregates ffmpeg progress (one stream per chunk in chunked mode) and
+    writes it to the job row at most every ``interval`` seconds."""
+
+    def __init__(self, app, job_id: int, duration: Optional[float], interval: float):
+        self.app = app
+        self.job_id = job_id
+        self.duration = duration
+        self.interval = max(0.5, float(interval))
+        self._streams: Dict[object, Dict] = {}
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    def __call__(self, key, progress: Dict) -> None:
+        job = _current_job.get()
+        if job is not None and job.lost.is_set():
+            return    # the row belongs to the worker that took the lease
+        with self._lock:
+            self._streams[key] = progress
+            now = time.monotonic()
+            if now - self._last_write < self.interval and not progress.get("done"):
+                return
+            self._last_write = now
+            live = [p for p in self._streams.values() if not p.get("done")]
+            out_time = sum(p.get("out_time") or 0.0 for p in self._streams.values())
+            fps = sum(p.get("fps") or 0.0 for p in live) or None
+            speed = sum(p.get("speed") or 0.0 for p in live) or None
+        pct = min(99.9, 100.0 * out_time / self.duration) if self.duration else None
+        values = dict(progress_out_time=round(out_time, 3), progress_pct=pct, progress_fps=fps,
+                      progress_speed=speed, progress_updated_at=_utcnow())
+        try:
+            with self.app.app_context():
+                db.session.execute(
+                    update(TranscodeJob).where(TranscodeJob.id == self.job_id).values(**values)
+                    .execution_options(synchronize_session=False))
+                db.session.commit()
+        except Exception:
+            logger.debug("Progress write failed for job %s", self.job_id, exc_info=True)
+
+
+def _terminate_active_procs() -> None:
+    _terminated.set()
+    with _procs_lock:
+        procs = list(_active_procs)
+    for proc in procs:
+        try:
+            proc.terminate()
+        except Exception:
+            pass
+
+
+def _record_heartbeat(slots: int, status: str = "running") -> None:
+    now = _utcnow()
+    row = db.session.get(TranscodeWorker, WORKER_ID)
+    if not row:
+        row = TranscodeWorker(worker_id=WORKER_ID, hostname=socket.gethostname(), pid=os.getpid(), started_at=now)
+        db.session.add(row)
+    row.slots = slots
+    row.busy_slots = _busy_slots
+    row.status = status
+    row.heartbeat_at = now
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _heartbeat_loop(app, slots: int):
+    interval = max(1, app.config.get("HLS_WORKER_HEARTBEAT_SECONDS", 30))
+    while True:
+        try:
+            with app.app_context():
+                _record_heartbeat(slots, "draining" if _stop.is_set() else "running")
+        except Exception:
+            logger.warning("Worker heartbeat failed", exc_info=True)
+        if _stop.wait(interval):
+            return
+
+
+def _configure_governor(app, slots: int) -> None:
+    global _governor, _slots
+    _governor = ResourceGovernor.from_config(app.config)
+    _slots = slots
+    logger.info("Transcode governor: %d usable core(s), nice %d, ionice %s, affinity %s, max load %.2f/core",
+                _governor.usable_cpus, _governor.nice, _governor.ionice_class or "off",
+                _governor.cpus or "all", _governor.max_load)
+
+
+def _start_support_threads(app, slots: int) -> None:
+    threading.Thread(target=_heartbeat_loop, args=(app, slots), name="hls-heartbeat", daemon=True).start()
+    with app.app_context():
+        if getattr(db.engine, "name", "").lower() == "postgresql":
+            threading.Thread(target=_listen_for_jobs, args=(app,), name="hls-listen", daemon=True).start()
+    # Start nightly aggregation thread (lightweight)
+    threading.Thread(target=_nightly_rollup_loop, args=(app,), name="view-rollup", daemon=True).start()
 
 
 def start_hls_worker(app):
     """
     Call this once during app startup (e.g., in create_app()).
+
+    Starts a single embedded encode slot inside the web process unless
+    HLS_WORKER_EMBEDDED is false, in which case encoding (and the view rollup)
+    is left to a separate ``flask hls-worker`` process. Never started under
+    the flask CLI: ``hls-worker`` runs its own slots, and short-lived commands
+    (``hls-batch``, ``db upgrade``) would exit mid-encode and orphan ffmpeg.
     """
-    t = threading.Thread(target=_worker_loop, args=(app,), daemon=True)
+    if app.config.get("TESTING"):
+        # Unit tests drive the queue functions directly
+        return None
+    if os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+        return None
+    if not app.config.get("HLS_WORKER_EMBEDDED", True):
+        app.logger.info("Embedded HLS worker disabled; run `flask hls-worker` to process transcodes")
+        return None
+    _configure_governor(app, 1)
+    t = threading.Thread(target=_worker_loop, args=(app, f"{WORKER_ID}:0"), name="hls-slot-0", daemon=True)
     t.start()
-    # Start nightly aggregation thread (lightweight)
-    a = threading.Thread(target=_nightly_rollup_loop, args=(app,), daemon=True)
-    a.start()
+    _start_support_threads(app, 1)
     return t
 
 
-def _worker_loop(app):
-    while True:
-        filepath, video_id = None, None
-        with _lock:
-            if _queue:
-                filepath, video_id = _queue.pop(0)
+def run_hls_worker(app, slots: int = 1, drain_seconds: Optional[int] = None) -> None:
+    """Blocking entry point for the standalone worker daemon.
 
-        if not filepath:
-            time.sleep(0.5)
+    Runs ``slots`` encode threads that claim jobs independently, heartbeats the
+    worker's capacity into transcode_workers, and on SIGTERM/SIGINT stops
+    claiming, lets in-flight encodes finish for up to ``drain_seconds``, then
+    stops ffmpeg and releases any unfinished jobs back to the queue.
+    """
+    import signal
+
+    slots = max(1, int(slots))
+    if drain_seconds is None:
+        drain_seconds = app.config.get("HLS_WORKER_DRAIN_SECONDS", 300)
+    _stop.clear()
+    _terminated.clear()
+
+    def _on_signal(signum, frame):
+        logger.info("Worker %s received signal %s; draining", WORKER_ID, signum)
+        _stop.set()
+        _signal_workers()
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+    _configure_governor(app, slots)
+
+    threads = []
+    for i in range(slots):
+        t = threading.Thread(target=_worker_loop, args=(app, f"{WORKER_ID}:{i}"), name=f"hls-slot-{i}", daemon=True)
+        t.start()
+        threads.append(t)
+    _start_support_threads(app, slots)
+    logger.info("HLS worker %s started with %d slot(s)", WORKER_ID, slots)
+
+    # Short waits keep the main thread responsive to signals
+    while not _stop.wait(1.0):
+        pass
+
+    deadline = time.monotonic() + max(0, drain_seconds)
+    for t in threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+    if any(t.is_alive() for t in threads):
+        logger.warning("Drain timeout reached; stopping ffmpeg and releasing in-flight jobs")
+        _terminate_active_procs()
+        for t in threads:
+            t.join(30)
+
+    with app.app_context():
+        try:
+            _record_heartbeat(slots, "stopped")
+        except Exception:
+            logger.warning("Final worker heartbeat failed", exc_info=True)
+    logger.info("HLS worker %s stopped", WORKER_ID)
+
+
+def _listen_for_jobs(app):
+    """Bridge PostgreSQL NOTIFY on NOTIFY_CHANNEL into the local wake condition,
+    so workers in other processes start within milliseconds of an enqueue."""
+    import select
+    while not _stop.is_set():
+        raw = None
+        try:
+            with app.app_context():
+                raw = db.engine.raw_connection()
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            while not _stop.is_set():
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    _signal_workers()
+        except Exception:
+            logger.warning("Transcode LISTEN connection failed; retrying", exc_info=True)
+            time.sleep(5)
+        finally:
+            if raw is not None:
+                try:
+                    raw.close()
+                except Exception:
+                    pass
+
+
+def _worker_loop(app, worker_id: str = WORKER_ID):
+    lease_seconds = app.config.get("TRANSCODE_LEASE_SECONDS", 120)
+    idle_wait = app.config.get("TRANSCODE_IDLE_WAIT_SECONDS", 30)
+    while not _stop.is_set():
+        seen_seq = _wake_seq
+        if _governor.overloaded(_busy_slots):
+            # Host is saturated: let the running encodes (and the web tier) have it
+            _stop.wait(GOVERNOR_RECHECK_SECONDS)
             continue
-
+        claimed = None
         try:
-            logger.info(f"Converting: %s -> video_id=%s", filepath, video_id)
             with app.app_context():
-                _mark_status(video_id, VideoStatus.PENDING)
+                job = claim_next_job(worker_id, lease_seconds)
+                if job:
+                    claimed = dict(job_id=job.id, video_id=job.video_uuid, filepath=job.input_path,
+                                   attempts=job.attempts, max_attempts=job.max_attempts,
+                                   kind=job.kind, params=job.params)
+        except Exception:
+            logger.exception("Failed to claim transcode job")
+
+        if not claimed:
+            _wait_for_work(seen_seq, idle_wait)
+            continue
 
-            # Validate required binaries before processing
-            for name, bin_path, env_var in (
-                ("ffmpeg", FFMPEG_BIN, "FFMPEG_BIN"),
-                ("ffprobe", FFPROBE_BIN, "FFPROBE_BIN"),
-            ):
-                resolved = shutil.which(bin_path) if os.sep not in bin_path else (bin_path if os.path.exists(bin_path) else None)
-                if not resolved:
-                    raise RuntimeError(
-                        f"Missing dependency: {name} not found (looked for '{bin_path}'). Install ffmpeg (includes ffprobe) or set {env_var}."
-                    )
+        _process_job(app, worker_id=worker_id, lease_seconds=lease_seconds, **claimed)
 
-            master_path = convert_to_hls(filepath, video_id)
 
-            with app.app_context():
-                _on_success(video_id, master_path)
-                logger.info("Done: %s -> %s", video_id, master_path)
+def _process_job(app, job_id: int, video_id: str, filepath: str, attempts: int, max_attempts: int,
+                 worker_id: str, lease_seconds: int, kind: TranscodeJobKind = TranscodeJobKind.FULL,
+                 params: Optional[Dict] = None):
+    global _busy_slots
+    with _procs_lock:
+        _busy_slots += 1
+    try:
+        _run_job(app, job_id, video_id, filepath, attempts, max_attempts, worker_id, lease_seconds,
+                 kind=kind, params=params)
+    finally:
+        with _procs_lock:
+            _busy_slots -= 1
+
+
+def _hls_options(config) -> Dict:
+    """convert_to_hls keyword arguments derived from app config."""
+    return {
+        "segment_time": int(config.get("TRANSCODE_SEGMENT_SECONDS", 4)),
+        "startup_segment_time": float(config.get("TRANSCODE_STARTUP_SEGMENT_SECONDS", 0)) or None,
+        "startup_seconds": float(config.get("TRANSCODE_STARTUP_SECONDS", 6)),
+        "chunked": bool(config.get("TRANSCODE_CHUNKED", False)),
+        "chunk_seconds": int(config.get("TRANSCODE_CHUNK_SECONDS", 120)),
+        "parallelism": int(config.get("TRANSCODE_CHUNK_PARALLELISM", 0)) or None,
+        "audio_bitrates": _audio_bitrates(config),
+        "stream_copy": bool(config.get("TRANSCODE_STREAM_COPY", True)),
+        "segment_format": str(config.get("TRANSCODE_SEGMENT_FORMAT", "ts")).strip().lower(),
+        "iframe_playlists": str(config.get("TRANSCODE_IFRAME_PLAYLISTS", "lowest")).strip().lower(),
+        "poster": True,
+        "trickplay_interval": (float(config.get("TRANSCODE_TRICKPLAY_INTERVAL_SECONDS", 10))
+                               if config.get("TRANSCODE_TRICKPLAY", True) else None),
+    }
+
+
+def _audio_bitrates(config) -> Optional[List[int]]:
+    """Shared audio rendition bitrates (kbps), or None for per-variant audio."""
+    if not config.get("TRANSCODE_AUDIO_GROUP", False):
+        return None
+    raw = str(config.get("TRANSCODE_AUDIO_BITRATES", "128"))
+    kbps = sorted({int(x) for x in raw.replace(" ", "").split(",") if x.isdigit() and int(x) > 0})
+    return kbps[:2] or [128]
+
+
+def _fast_start_split(variants: List[Dict], max_height: int) -> Tuple[str, List[str]]:
+    """Pick the rung published first (largest at or below ``max_height``, else the
+    smallest) and return it with the remaining rungs, cheapest first."""
+    fits = [v for v in variants if v["height"] <= max_height]
+    first = fits[0] if fits else variants[-1]
+    return first["name"], [v["name"] for v in reversed(variants) if v is not first]
+
+
+def _run_job(app, job_id: int, video_id: str, filepath: str, attempts: int, max_attempts: int,
+             worker_id: str, lease_seconds: int, kind: TranscodeJobKind = TranscodeJobKind.FULL,
+             params: Optional[Dict] = None):
+    # Backfills only add rungs to an already playable video: they never touch
+    # the video status, and their failure leaves the published rungs in place.
+    # Neither does a re-encode of a video that is already served: the new
+    # output is built aside and swapped in (see _publish_output).
+    backfill = kind == TranscodeJobKind.BACKFILL
+    with app.app_context():
+        keep_status = backfill or _has_live_output(video_id)
+    if attempts > max_attempts:
+        # Reclaimed after its lease lapsed too many times (worker kept dying)
+        with app.app_context():
+            fail_job(job_id, worker_id, error="lease expired on every attempt")
+            if not keep_status:
+                _on_fail(video_id, error="lease expired on every attempt")
+        return
+
+    keeper = None
+    try:
+        logger.info("Converting: %s -> video_id=%s (job=%s %s attempt=%s/%s)",
+                    filepath, video_id, job_id, getattr(kind, "value", kind), attempts, max_attempts)
+        with app.app_context():
+            if not keep_status:
+                _mark_status(video_id, VideoStatus.PENDING)
+            hls_options = _hls_options(app.config)
+            fast_start = bool(app.config.get("TRANSCODE_FAST_START", False))
+            fast_start_height = int(app.config.get("TRANSCODE_FAST_START_MAX_HEIGHT", 720))
+            content_aware = bool(app.config.get("TRANSCODE_CONTENT_AWARE", False))
+            analysis = (int(app.config.get("TRANSCODE_ANALYSIS_CLIPS", 3)),
+                        float(app.config.get("TRANSCODE_ANALYSIS_CLIP_SECONDS", 4)))
+            backfill_priority = int(app.config.get("TRANSCODE_BACKFILL_PRIORITY", -10))
+            dedup = bool(app.config.get("TRANSCODE_DEDUP", True))
+            fingerprint = output_fingerprint(app.config)
+
+        # Validate required binaries before processing
+        for name, bin_path, env_var in (
+            ("ffmpeg", FFMPEG_BIN, "FFMPEG_BIN"),
+            ("ffprobe", FFPROBE_BIN, "FFPROBE_BIN"),
+        ):
+            resolved = shutil.which(bin_path) if os.sep not in bin_path else (bin_path if os.path.exists(bin_path) else None)
+            if not resolved:
+                raise RuntimeError(
+                    f"Missing dependency: {name} not found (looked for '{bin_path}'). Install ffmpeg (includes ffprobe) or set {env_var}."
+                )
+
+        # One ffprobe per source content; re-transcodes hit media_probes
+        with app.app_context():
+            md5 = db.session.query(Video.md5).filter(Video.uuid == video_id).scalar()
+            hls_options["probe"] = probe_media(filepath, md5=md5)
+            duration = hls_options["probe"].get("duration")
+            db.session.execute(
+                update(TranscodeJob).where(TranscodeJob.id == job_id)
+                .values(duration_seconds=duration, progress_pct=0.0, progress_out_time=0.0,
+                        progress_fps=None, progress_speed=None, progress_updated_at=_utcnow())
+                .execution_options(synchronize_session=False))
+            db.session.commit()
+            hls_options["on_progress"] = _ProgressReporter(
+                app, job_id, duration, app.config.get("TRANSCODE_PROGRESS_INTERVAL_SECONDS", 5))
+
+        params = dict(params or {})
+        pending_rungs: List[str] = []
+        hls_options["threads"] = _governor.thread_budget(_slots)
+        master_path = None
+        keeper = _LeaseKeeper(app, job_id, worker_id, lease_seconds)
+        with keeper:
+            if dedup and not backfill:
+                # Same content already encoded with the same settings: link it
+                with app.app_context():
+                    try:
+                        # Demuxes the whole source: run it like the encode
+                        params["content_hash"] = content_hash(
+                            filepath, md5=md5, runner=functools.partial(_run_ffmpeg, capture=True))
+                    except RuntimeError:
+                        if _terminated.is_set() or keeper.lost:
+                            raise
+                        logger.warning("Content hash failed for %s; encoding without dedup", video_id, exc_info=True)
+                    if params.get("content_hash"):
+                        params["rendition_key"] = _rendition_key(
+                            params["content_hash"], hls_options, analysis if content_aware else None)
+                        if not params.get("force"):
+                            _check_lease()
+                            master_path = reuse_renditions(params["rendition_key"], video_id)
+                    if master_path is None:
+                        forget_renditions(video_id)
+            reused = master_path is not None
+            if not reused:
+                if content_aware and not backfill and "ladder" not in params:
+                    # Chosen once per job and kept on it, so retries and backfills agree
+                    params["ladder"] = analyse_ladder(filepath, hls_options["probe"], *analysis,
+                                                      threads=hls_options["threads"])
+                    _check_lease()
+                    with app.app_context():
+                        db.session.execute(
+                            update(TranscodeJob).where(TranscodeJob.id == job_id)
+                            .values(params=params).execution_options(synchronize_session=False))
+                        db.session.commit()
+                if params.get("ladder"):
+                    hls_options["ladder"] = params["ladder"]
+
+                if backfill:
+                    hls_options.update(rungs=list(params.get("rungs") or []), reuse_key=True,
+                                       poster=False, trickplay_interval=None)
+                elif fast_start:
+                    probe = hls_options["probe"]
+                    variants = _select_variants(probe.get("width") or 1920, probe.get("height") or 1080)
+                    if params.get("ladder"):
+                        names = {r["name"] for r in params["ladder"]}
+                        variants = [v for v in variants if v["name"] in names]
+                    if len(variants) > 1:
+                        first, pending_rungs = _fast_start_split(variants, fast_start_height)
+                        hls_options["rungs"] = [first]
+
+                master_path = convert_to_hls(filepath, video_id, **hls_options)
+
+        with app.app_context():
+            if keeper.lost or not complete_job(job_id, worker_id):
+                logger.warning("Discarding result of job %s: lease now held by another worker", job_id)
+                return
+            # The output is complete once no rung is still queued or running
+            complete = not pending_rungs and not TranscodeJob.query.filter(
+                TranscodeJob.video_uuid == video_id, TranscodeJob.active_key.isnot(None)).count()
+            if complete:
+                _write_output_fingerprint(video_id, fingerprint)
+            if complete and params.get("rendition_key") and not reused:
+                register_renditions(params["rendition_key"], params["content_hash"], video_id)
+            if backfill:
+                logger.info("Backfilled %s for %s", hls_options["rungs"], video_id)
+                return
+            _on_success(video_id, master_path,
+                        VideoStatus.PUBLISHED if params.get("republish") else VideoStatus.PROCESSED)
+            logger.info("Done: %s -> %s", video_id, master_path)
+            for rung in pending_rungs:
+                backfill_params = {"rungs": [rung]}
+                for key in ("ladder", "content_hash", "rendition_key"):
+                    if params.get(key):
+                        backfill_params[key] = params[key]
+                add_to_queue(filepath, video_id, kind=TranscodeJobKind.BACKFILL,
+                             priority=backfill_priority, params=backfill_params)
 
-        except Exception as e:
-            logger.exception("Error converting %s: %s", video_id, e)
+    except Exception as e:
+        if isinstance(e, LeaseLostError) or (keeper is not None and keeper.lost):
+            # The new owner encodes and reports this job; write nothing
+            logger.warning("Abandoned job %s for video %s: lease now held by another worker", job_id, video_id)
+            return
+        if _terminated.is_set():
+            logger.info("Releasing job %s for video %s: worker shutting down", job_id, video_id)
             with app.app_context():
+                release_job(job_id, worker_id)
+            return
+        logger.exception("Error converting %s: %s", video_id, e)
+        with app.app_context():
+            if fail_job(job_id, worker_id, error=str(e)) and not keep_status:
                 _on_fail(video_id, error=str(e))
 
-        time.sleep(0.5)
-
 
 # -------------------- View Event Aggregation --------------------
 ROLLUP_INTERVAL_HOURS = 24
@@ -204,9 +1255,12 @@ def _rollup_video_views():
     current_app.logger.info("Video view rollup complete")
 
 
-def enqueue_transcode(video_uuid: str) -> None:
+def enqueue_transcode(video_uuid: str, priority: Optional[int] = None) -> None:
     """
     Call this from your request handler (there's already an app/request context).
+
+    Without ``priority`` a first transcode runs as an interactive upload (0)
+    and a repeat one at TRANSCODE_REENCODE_PRIORITY.
     """
     # we are in request context here, so DB access is fine
     video = Video.query.filter_by(uuid=video_uuid).first()
@@ -218,10 +1272,52 @@ def enqueue_transcode(video_uuid: str) -> None:
         raise ValueError(
             f"Raw file path missing or not found for {video_uuid}: {raw_path}")
 
+    if priority is None:
+        reencode = TranscodeJob.query.filter_by(video_uuid=video_uuid).first() is not None
+        priority = int(current_app.config.get("TRANSCODE_REENCODE_PRIORITY", -5)) if reencode else 0
+
     video.status = VideoStatus.PENDING
     db.session.commit()
+    video_location_cache.invalidate(video_uuid)
+
+    add_to_queue(raw_path, video_uuid, priority=priority)
+
+
+def batch_source(video: Video) -> Optional[str]:
+    """The uploaded source of ``video`` (file_path points at the HLS master once encoded)."""
+    for path in (video.original_file_path, video.file_path):
+        if path and not path.endswith(".m3u8") and os.path.exists(path):
+            return path
+    return None
+
+
+def batch_candidates(fingerprint: str, only_failed: bool = False, since: Optional[datetime] = None,
+                     force: bool = False) -> Tuple[List[Video], int]:
+    """Videos a bulk re-encode should queue, oldest first, and how many were
+    skipped because their output already carries ``fingerprint``."""
+    query = Video.query.filter(Video.status != VideoStatus.DELETED)
+    if only_failed:
+        query = query.filter(Video.status == VideoStatus.FAILED)
+    if since is not None:
+        query = query.filter(Video.created_at >= since)
+    todo, current = [], 0
+    for video in query.order_by(Video.created_at, Video.uuid).all():
+        if not force and read_output_fingerprint(video.uuid) == fingerprint:
+            current += 1
+        else:
+            todo.append(video)
+    return todo, current
+
 
-    add_to_queue(raw_path, video_uuid)
+def enqueue_batch(video: Video, source: str, priority: int, force: bool = False) -> TranscodeJob:
+    """Queue a bulk re-encode of ``video``; a published video is republished
+    when it finishes. ``force`` also bypasses rendition dedup."""
+    params = {}
+    if video.status == VideoStatus.PUBLISHED:
+        params["republish"] = True
+    if force:
+        params["force"] = True
+    return add_to_queue(source, video.uuid, priority=priority, params=params or None)
 
 
 def _mark_status(video_id: str, status: VideoStatus):
@@ -231,18 +1327,29 @@ def _mark_status(video_id: str, status: VideoStatus):
         stmt = update(Video).where(Video.uuid == video_id).values(status=status)
         db.session.execute(stmt)
         db.session.commit()
+        video_location_cache.invalidate(video_id)
     except Exception:
         db.session.rollback()
         raise
 
 
-def _on_success(video_id: str, master_path: str):
-    """Set processed status and update file path via single UPDATE."""
+def _has_live_output(video_id: str) -> bool:
+    """Whether ``video_id`` is processed or published and served from an
+    encoded output on disk."""
+    video = db.session.get(Video, video_id)
+    return bool(video and video.status in (VideoStatus.PROCESSED, VideoStatus.PUBLISHED)
+                and video.file_path and video.file_path.endswith(".m3u8")
+                and os.path.exists(video.file_path))
+
+
+def _on_success(video_id: str, master_path: str, status: VideoStatus = VideoStatus.PROCESSED):
+    """Set processed (or the given) status and update file path via single UPDATE."""
     try:
         from sqlalchemy import update
-        stmt = update(Video).where(Video.uuid == video_id).values(file_path=master_path, status=VideoStatus.PROCESSED)
+        stmt = update(Video).where(Video.uuid == video_id).values(file_path=master_path, status=status)
         db.session.execute(stmt)
         db.session.commit()
+        video_location_cache.invalidate(video_id)
     except Exception:
         db.session.rollback()
         raise
@@ -255,6 +1362,7 @@ def _on_fail(video_id: str, error: Optional[str] = None):
         stmt = update(Video).where(Video.uuid == video_id).values(status=VideoStatus.FAILED)
         db.session.execute(stmt)
         db.session.commit()
+        video_location_cache.invalidate(video_id)
     except Exception:
         db.session.rollback()
         raise
@@ -262,122 +1370,237 @@ def _on_fail(video_id: str, error: Optional[str] = None):
 
 def get_video_resolution(path):
     try:
-        result = subprocess.run([
-            FFPROBE_BIN, "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=width,height",
-            "-of", "csv=p=0"
-        ] + [path], capture_output=True, text=True, check=True)
-
-        width, height = map(int, result.stdout.strip().split(','))
-        return width, height
+        info = probe_media(path)
+        return int(info["width"]), int(info["height"])
     except Exception as e:
         raise RuntimeError(f"Failed to get resolution: {e}")
 
-def _probe_fps(input_file: str) -> float:
-    try:
-        out = subprocess.check_output(
-            [FFPROBE_BIN, "-v", "error", "-select_streams", "v:0",
-             "-show_entries", "stream=r_frame_rate", "-of", "default=nk=1:nw=1", input_file],
-            text=True
-        ).strip()
-        if "/" in out:
-            n, d = out.split("/")
-            return float(n) / float(d)
-        return float(out)
-    except Exception:
-        return 25.0
 
+# Default ladder; convert_to_hls keeps only rungs <= source resolution.
+# x264 preset of the ladder encode (and the CRF analysis); part of speed_class
+ENCODE_PRESET = "veryfast"
+
+HLS_LADDER: List[Dict] = [
+    {"name": "4k",    "width": 3840, "height": 2160,
+        "bitrate": 12000, "audio_bitrate": 192},
+    {"name": "1440p", "width": 2560, "height": 1440,
+        "bitrate":  8000, "audio_bitrate": 160},
+    {"name": "1080p", "width": 1920, "height": 1080,
+        "bitrate":  5000, "audio_bitrate": 128},
+    {"name": "720p",  "width": 1280, "height":  720,
+        "bitrate":  3000, "audio_bitrate":  96},
+    {"name": "480p",  "width":  854, "height":  480,
+        "bitrate":  1500, "audio_bitrate":  96},
+    {"name": "360p",  "width":  640, "height":  360,
+        "bitrate":   800, "audio_bitrate":  64},
+]
+H264_CODECS = "avc1.640029"
+AAC_CODECS = "mp4a.40.2"
+KEY_URI = "../keys/enc.key"
+# No IV attribute: each segment is encrypted with its media sequence number as
+# IV (see _segment_iv), so no two segments of a rung share one
+KEY_LINE = f'#EXT-X-KEY:METHOD=AES-128,URI="{KEY_URI}"'
+# "ts": one MPEG-TS file per segment. "fmp4": CMAF fragments packed into one
+# <rung>.mp4 per rung and addressed with #EXT-X-BYTERANGE (see _pack_fmp4).
+SEGMENT_FORMATS = ("ts", "fmp4")
+# Per-rung sidecar for rungs that differ from their HLS_LADDER entry
+RUNG_META = "variant.json"
+# Freshly keyed outputs are built in <video_id><BUILD_SUFFIX> (see _publish_output)
+BUILD_SUFFIX = ".next"
+
+# Poster + trickplay (scrub preview) images, produced by the ladder encode's decode
+THUMBNAILS_DIR = os.path.join("app", "static", "thumbnails")
+TRICKPLAY_DIR = "trickplay"
+TRICKPLAY_VTT = "thumbnails.vtt"
+TRICKPLAY_TILE_WIDTH = 160
+TRICKPLAY_GRID = (10, 10)               # columns x rows per sprite sheet
+
+# Content-aware ladder: CRF probe encodes of a few clips sampled from the source
+ANALYSIS_CRF = 23
+ANALYSIS_HEADROOM = 1.2                 # target bitrate over the measured CRF rate
+ANALYSIS_MIN_FACTOR = 0.3               # per-title bitrate clamp, relative to HLS_LADDER
+ANALYSIS_MAX_FACTOR = 1.25
+RUNG_MIN_GAIN = 1.3                     # a rung must need this many times the bits of the rung below
+
+
+def _select_variants(orig_w: int, orig_h: int) -> List[Dict]:
+    variants = [v for v in HLS_LADDER if v["width"]
+                <= orig_w and v["height"] <= orig_h]
+    if not variants:
+        variants = [HLS_LADDER[-1]]
+    return variants
+
+
+def _write_hls_key(output_dir: str) -> str:
+    """Write a fresh AES-128 key and ffmpeg keyinfo file; returns the keyinfo path.
+
+    The key is replaced, never rewritten in place: a deduplicated video may
+    share the old key file through a hardlink.
+    """
+    keys_dir = os.path.join(output_dir, "keys")
+    os.makedirs(keys_dir, exist_ok=True)
+    key_path = os.path.join(keys_dir, "enc.key")
+    with open(key_path + ".tmp", "wb") as f:
+        f.write(secrets.token_bytes(16))
+    os.replace(key_path + ".tmp", key_path)
+    return _write_keyinfo(output_dir)
 
-def _probe_video_resolution(input_file: str) -> Tuple[int, int]:
+
+def _write_keyinfo(output_dir: str) -> str:
+    key_info_path = os.path.join(output_dir, "enc.keyinfo")
+    key_path = os.path.join(output_dir, "keys", "enc.key")
+    # key URI is relative to variant playlists (../keys/enc.key from <variant>/name.m3u8).
+    # No IV line: with periodic_rekey (see _hls_flags) ffmpeg encrypts every
+    # segment under its own sequence number.
+    hls_playlists.write_atomic(key_info_path, KEY_URI + "\n" + os.path.abspath(key_path) + "\n")
+    return key_info_path
+
+
+def _read_hls_key(output_dir: str) -> Optional[bytes]:
     try:
-        meta = json.loads(subprocess.check_output(
-            [FFPROBE_BIN, "-v", "error", "-select_streams", "v:0",
-             "-show_entries", "stream=width,height", "-of", "json", input_file],
-            text=True
-        ))
-        w = int(meta["streams"][0]["width"])
-        h = int(meta["streams"][0]["height"])
-        return w, h
-    except Exception:
-        return 1920, 1080
+        with open(os.path.join(output_dir, "keys", "enc.key"), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
 
 
-def _probe_has_audio(input_file: str) -> bool:
+def _write_rung_meta(rung_dir: str, variant: Dict) -> None:
+    """Record a rung's actual bitrate when it deviates from its HLS_LADDER entry
+    (stream copy, content-aware ladder), and a copied stream's H.264 level."""
+    base = next((v for v in HLS_LADDER if v["name"] == variant["name"]), None)
+    if base is not None and variant["bitrate"] == base["bitrate"] and not variant.get("copy"):
+        return
+    meta = {"bitrate": variant["bitrate"], "copy": bool(variant.get("copy"))}
+    if variant.get("level"):
+        meta["level"] = variant["level"]
+    with open(os.path.join(rung_dir, RUNG_META), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def _rung_info(output_dir: str, variant: Dict) -> Dict:
+    """Ladder entry for a rung on disk, overlaid with its RUNG_META sidecar if any."""
     try:
-        out = subprocess.check_output(
-            [FFPROBE_BIN, "-v", "error", "-select_streams", "a",
-             "-show_entries", "stream=index", "-of", "csv=p=0", input_file],
-            text=True
-        ).strip()
-        return bool(out)
-    except Exception:
-        return False
+        with open(os.path.join(output_dir, variant["name"], RUNG_META), encoding="utf-8") as f:
+            return {**variant, **json.load(f)}
+    except (OSError, ValueError):
+        return variant
+
+
+def _publish_master(output_dir: str, has_audio: bool, frame_rate: Optional[float] = None) -> str:
+    """Atomically rewrite master.m3u8 to list every ladder rung present on disk,
+    with bitrates measured from its segments (see _measured_stream_info)."""
+    _check_lease()
+    present = [_rung_info(output_dir, v) for v in HLS_LADDER
+               if os.path.exists(os.path.join(output_dir, v["name"], f"{v['name']}.m3u8"))]
+    audio_kbps = _present_audio(output_dir) if has_audio else []
+    iframes = [info for info in (_iframe_stream_info(output_dir, v) for v in present) if info]
+    master_path = os.path.join(output_dir, "master.m3u8")
+    hls_playlists.write_atomic(master_path, hls_playlists.render_master_playlist(
+        _measured_stream_info(output_dir, present, has_audio, audio_kbps or None, frame_rate),
+        media=_audio_media(audio_kbps), iframes=iframes))
+    return os.path.abspath(master_path)
 
 
-def convert_to_hls(input_file: str, video_id: str, segment_time: int = 4) -> str:
+def _publish_rungs(work_dir: str, output_dir: str, names: List[str], has_audio: bool,
+                   key_bytes: Optional[bytes], frame_rate: Optional[float] = None) -> str:
+    """Move staged rungs into ``output_dir`` and republish the master.
+
+    Serialised with a lock file so concurrent backfills of the same video never
+    drop each other's rung from the master. If the video was re-keyed while this
+    rung encoded (a newer transcode started), the staged output is discarded.
     """
-    Create HLS (AES-128, MPEG-TS) at:
-      app/static/hls_output/<video_id>/master.m3u8
-    Variant folders/playlists keep your names:
-      4k/4k.m3u8, 1440p/1440p.m3u8, 1080p/1080p.m3u8, 720p/720p.m3u8, 480p/480p.m3u8, 360p/360p.m3u8
+    import fcntl
+    try:
+        with open(os.path.join(output_dir, ".master.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            _check_lease()
+            if _read_hls_key(output_dir) != key_bytes:
+                raise RuntimeError("HLS key changed during encode; staged rungs discarded")
+            for name in names:
+                src = os.path.join(work_dir, name)
+                dst = os.path.join(output_dir, name)
+                old = f"{dst}.old"
+                shutil.rmtree(old, ignore_errors=True)
+                if os.path.exists(dst):
+                    os.rename(dst, old)
+                os.rename(src, dst)
+                shutil.rmtree(old, ignore_errors=True)
+            return _publish_master(output_dir, has_audio, frame_rate)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _publish_output(build_dir: str, output_dir: str, has_audio: bool,
+                    frame_rate: Optional[float] = None) -> str:
+    """Write the master of a freshly keyed output built in ``build_dir`` and
+    swap the whole directory in for ``output_dir``.
+
+    The published output keeps playing with its own key until the rename; its
+    segments are never re-keyed in place. Backfills still running against the
+    old output find a different key under the lock and discard their rungs.
     """
-    user_variants: List[Dict] = [
-        {"name": "4k",    "width": 3840, "height": 2160,
-            "bitrate": 12000, "audio_bitrate": 192},
-        {"name": "1440p", "width": 2560, "height": 1440,
-            "bitrate":  8000, "audio_bitrate": 160},
-        {"name": "1080p", "width": 1920, "height": 1080,
-            "bitrate":  5000, "audio_bitrate": 128},
-        {"name": "720p",  "width": 1280, "height":  720,
-            "bitrate":  3000, "audio_bitrate":  96},
-        {"name": "480p",  "width":  854, "height":  480,
-            "bitrate":  1500, "audio_bitrate":  96},
-        {"name": "360p",  "width":  640, "height":  360,
-            "bitrate":   800, "audio_bitrate":  64},
-    ]
-
-    orig_w, orig_h = _probe_video_resolution(input_file)
-    has_audio = _probe_has_audio(input_file)
-
-    variants = [v for v in user_variants if v["width"]
-                <= orig_w and v["height"] <= orig_h]
-    if not variants:
-        variants = [user_variants[-1]]
-
-    output_dir = os.path.join("app", "static", "hls_output", video_id)
+    import fcntl
+    _publish_master(build_dir, has_audio, frame_rate)
     os.makedirs(output_dir, exist_ok=True)
+    old = f"{output_dir}.old"
+    with open(os.path.join(output_dir, ".master.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _check_lease()
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(output_dir, old)
+        os.rename(build_dir, output_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    # The keyinfo names the key by absolute path, for later backfills
+    _write_keyinfo(output_dir)
+    return os.path.abspath(os.path.join(output_dir, "master.m3u8"))
+
+
+def _thread_args(threads: Optional[int]) -> List[str]:
+    """Global/input thread caps (filter graph, decoder) for a job's thread budget."""
+    if not threads:
+        return []
+    return ["-filter_complex_threads", str(threads), "-threads", str(threads)]
+
+
+def _scale_pad(variant: Dict) -> str:
+    """Filter chain fitting the source into the rung's exact size."""
+    w, h = variant["width"], variant["height"]
+    return (f"scale=w={w}:h={h}:force_original_aspect_ratio=decrease:flags=bicubic,"
+            f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2:color=black,"
+            f"setsar=1")
 
-    # AES-128 key (one key for all variants)
-    keys_dir = os.path.join(output_dir, "keys")
-    os.makedirs(keys_dir, exist_ok=True)
-    key_path = os.path.join(keys_dir, "enc.key")
-    with open(key_path, "wb") as f:
-        f.write(secrets.token_bytes(16))
-    key_info_path = os.path.join(output_dir, "enc.keyinfo")
-    # key URI is relative to variant playlists (../keys/enc.key from <variant>/name.m3u8)
-    with open(key_info_path, "w") as f:
-        f.write("../keys/enc.key\n" + os.path.abspath(key_path) + "\n")
 
-    # Filters: split -> scale (AR keep) -> pad to exact WxH (even) -> setsar=1
-    fps = _probe_fps(input_file)
-    gop = max(1, int(round(segment_time * fps)))
+def _ladder_encode_args(variants: List[Dict], has_audio: bool, gop: int,
+                        audio_kbps: Optional[List[int]] = None,
+                        extra_filters: Optional[List[str]] = None,
+                        keyframes: Optional[List[float]] = None) -> Tuple[List[str], List[str]]:
+    """Build the filter_complex + per-variant encoder args shared by every encode path.
 
-    split_labels = [f"v{i}" for i in range(len(variants))]
-    filters = [f"[0:v]split={len(variants)}" +
-               "".join(f"[{lbl}]" for lbl in split_labels)]
-    for i, v in enumerate(variants):
-        w, h = v["width"], v["height"]
-        filters.append(
-            f"[{split_labels[i]}]"
-            f"scale=w={w}:h={h}:force_original_aspect_ratio=decrease:flags=bicubic,"
-            f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2:color=black,"
-            f"setsar=1[v{i}s]"
-        )
-    filter_complex = ";".join(filters)
+    With ``audio_kbps`` (shared audio group) the variants are video-only and one
+    AAC output per listed bitrate follows them in the var_stream_map; otherwise
+    each variant muxes its own AAC track.
 
-    cmd = [FFMPEG_BIN, "-y", "-i", input_file,
-           "-filter_complex", filter_complex]
+    A variant flagged ``copy`` (see _stream_copy_rung) maps the source video
+    stream unchanged and takes no branch of the filter graph.
+
+    ``extra_filters`` are appended to the graph (preview outputs that read the
+    same decoded frames, see _preview_args).
+
+    ``keyframes`` are extra keyframe times (seconds into the run) forced on
+    every transcoded rung on top of the fixed GOP (startup segments, see
+    _startup_plan).
+
+    Returns (args, var_stream_map parts).
+    """
+    # Filters: split -> scale (AR keep) -> pad to exact WxH (even) -> setsar=1
+    encoded = [i for i, v in enumerate(variants) if not v.get("copy")]
+    split_labels = [f"v{i}" for i in encoded]
+    filters = [f"[0:v]split={len(encoded)}" +
+               "".join(f"[{lbl}]" for lbl in split_labels)] if encoded else []
+    for i in encoded:
+        filters.append(f"[v{i}]{_scale_pad(variants[i])}[v{i}s]")
+    filters += extra_filters or []
+    args = ["-filter_complex", ";".join(filters)] if filters else []
 
     var_map_parts: List[str] = []
     for i, v in enumerate(variants):
@@ -386,23 +1609,28 @@ def convert_to_hls(input_file: str, video_id: str, segment_time: int = 4) -> str
         maxrate = int(vb * 1.4)
         bufsize = int(vb * 1.5)
 
-        cmd += [
-            "-map", f"[v{i}s]",
-            f"-c:v:{i}", "libx264",
-            f"-profile:v:{i}", "high",
-            f"-level:v:{i}", "4.1",
-            f"-preset:v:{i}", "veryfast",
-            f"-x264-params:v:{i}", f"scenecut=0:open_gop=0:min-keyint={gop}:keyint={gop}",
-            f"-g:v:{i}", str(gop),
-            f"-keyint_min:v:{i}", str(gop),
-            f"-b:v:{i}", f"{vb}k",
-            f"-maxrate:v:{i}", f"{maxrate}k",
-            f"-bufsize:v:{i}", f"{bufsize}k",
-            f"-pix_fmt:v:{i}", "yuv420p",
-        ]
-
-        if has_audio:
-            cmd += [
+        if v.get("copy"):
+            args += ["-map", "0:v:0", f"-c:v:{i}", "copy"]
+        else:
+            args += [
+                "-map", f"[v{i}s]",
+                f"-c:v:{i}", "libx264",
+                f"-profile:v:{i}", "high",
+                f"-level:v:{i}", "4.1",
+                f"-preset:v:{i}", ENCODE_PRESET,
+                f"-x264-params:v:{i}", f"scenecut=0:open_gop=0:min-keyint={gop}:keyint={gop}",
+                f"-g:v:{i}", str(gop),
+                f"-keyint_min:v:{i}", str(gop),
+                f"-b:v:{i}", f"{vb}k",
+                f"-maxrate:v:{i}", f"{maxrate}k",
+                f"-bufsize:v:{i}", f"{bufsize}k",
+                f"-pix_fmt:v:{i}", "yuv420p",
+            ]
+            if keyframes:
+                args += [f"-force_key_frames:v:{i}", ",".join(f"{t:.3f}" for t in keyframes)]
+
+        if has_audio and audio_kbps is None:
+            args += [
                 "-map", "0:a:0?",
                 f"-c:a:{i}", "aac",
                 f"-b:a:{i}", f"{ab}k",
@@ -412,32 +1640,1029 @@ def convert_to_hls(input_file: str, video_id: str, segment_time: int = 4) -> str
         else:
             var_map_parts.append(f"v:{i}")
 
+    if has_audio and audio_kbps:
+        for j, kbps in enumerate(audio_kbps):
+            args += [
+                "-map", "0:a:0",
+                f"-c:a:{j}", "aac",
+                f"-b:a:{j}", f"{kbps}k",
+                f"-ac:a:{j}", "2",
+            ]
+            var_map_parts.append(f"a:{j}")
+    return args, var_map_parts
+
+
+def _audio_name(kbps: int) -> str:
+    return f"audio_{kbps}k"
+
+
+def _present_audio(output_dir: str) -> List[int]:
+    """Bitrates of shared audio renditions published under ``output_dir``."""
+    found = []
+    try:
+        entries = os.listdir(output_dir)
+    except OSError:
+        return found
+    for d in entries:
+        m = re.fullmatch(r"audio_(\d+)k", d)
+        if m and os.path.exists(os.path.join(output_dir, d, f"{d}.m3u8")):
+            found.append(int(m.group(1)))
+    return sorted(found)
+
+
+def _audio_group_for(variant: Dict, audio_kbps: List[int]) -> int:
+    """Shared rendition closest to the rung's nominal audio bitrate (ties go up)."""
+    return min(audio_kbps, key=lambda k: (abs(k - variant["audio_bitrate"]), -k))
+
+
+def _audio_media(audio_kbps: List[int]) -> List[Dict]:
+    return [{
+        "type": "AUDIO",
+        "group_id": f"aud{k}",
+        "name": _audio_name(k),
+        "uri": f"{_audio_name(k)}/{_audio_name(k)}.m3u8",
+        "default": True,
+        "autoselect": True,
+        "channels": 2,
+    } for k in audio_kbps]
+
+
+def _nominal_stream_info(variants: List[Dict], has_audio: bool,
+                         audio_kbps: Optional[List[int]] = None) -> List[Dict]:
+    """Master playlist entries from ladder targets (what ffmpeg itself would declare).
+
+    With shared audio renditions each stream names its audio group and its
+    BANDWIDTH includes that rendition's bitrate.
+    """
+    streams = []
+    for v in variants:
+        group = _audio_group_for(v, audio_kbps) if audio_kbps else None
+        audio = group if group else (v["audio_bitrate"] if has_audio else 0)
+        kbps = int(v["bitrate"] * 1.4) + audio
+        streams.append({
+            "uri": f"{v['name']}/{v['name']}.m3u8",
+            "bandwidth": int(kbps * 1000 * 1.1),
+            "resolution": f"{v['width']}x{v['height']}",
+            "codecs": f"{H264_CODECS},{AAC_CODECS}" if has_audio else H264_CODECS,
+            "audio": f"aud{group}" if group else None,
+        })
+    return streams
+
+
+def _playlist_bitrates(playlist: str) -> Optional[Tuple[int, int]]:
+    """(peak, average) bits/s of a media playlist's segments, None if it lists none."""
+    try:
+        durations = [d for d, _ in hls_playlists.parse_media_playlist(playlist)]
+        sizes = hls_playlists.parse_segment_sizes(playlist)
+    except OSError:
+        return None
+    pairs = [(size, d) for size, d in zip(sizes, durations) if d > 0]
+    if not pairs:
+        return None
+    peak = max(size * 8 / d for size, d in pairs)
+    average = sum(size for size, _ in pairs) * 8 / sum(d for _, d in pairs)
+    return int(math.ceil(peak)), int(math.ceil(average))
+
+
+def _measured_stream_info(output_dir: str, variants: List[Dict], has_audio: bool,
+                          audio_kbps: Optional[List[int]] = None,
+                          frame_rate: Optional[float] = None) -> List[Dict]:
+    """_nominal_stream_info with what the encode actually produced.
+
+    BANDWIDTH is the rung's peak segment bitrate and AVERAGE-BANDWIDTH its
+    mean over the whole playlist, each plus its audio group's when audio is
+    shared; CODECS names a copied stream's real H.264 level and FRAME-RATE is
+    the source's (rungs keep the source frame rate). A rung without measurable
+    segments keeps its nominal figures.
+    """
+    streams = _nominal_stream_info(variants, has_audio, audio_kbps)
+    for v, stream in zip(variants, streams):
+        measured = _playlist_bitrates(os.path.join(output_dir, v["name"], f"{v['name']}.m3u8"))
+        if stream["audio"] and measured:
+            name = _audio_name(int(stream["audio"][len("aud"):]))
+            audio = _playlist_bitrates(os.path.join(output_dir, name, f"{name}.m3u8"))
+            measured = (measured[0] + audio[0], measured[1] + audio[1]) if audio else None
+        if measured:
+            stream["bandwidth"], stream["average_bandwidth"] = measured
+        if v.get("level"):
+            video = f"avc1.6400{int(v['level']):02x}"
+            stream["codecs"] = f"{video},{AAC_CODECS}" if has_audio else video
+        if frame_rate:
+            stream["frame_rate"] = frame_rate
+    return streams
+
+
+def _tile_size(probe: Dict) -> Tuple[int, int]:
+    """Trickplay tile size: TRICKPLAY_TILE_WIDTH wide, even height at the display aspect."""
+    w = probe.get("display_width") or probe.get("width") or 16
+    h = probe.get("display_height") or probe.get("height") or 9
+    return TRICKPLAY_TILE_WIDTH, max(2, int(round(TRICKPLAY_TILE_WIDTH * h / w / 2)) * 2)
+
+
+def _preview_args(previews: Dict, sprite_prefix: str, with_poster: bool) -> Tuple[List[str], List[str]]:
+    """(filter chains, output args) adding the poster and/or sprite sheets to an encode.
+
+    Both chains read ``[0:v]`` again, which ffmpeg feeds from the same decoder
+    as the ladder. The output args go after the HLS output in the command.
+    """
+    filters: List[str] = []
+    outputs: List[str] = []
+    if with_poster and previews.get("poster"):
+        filters.append(f"[0:v]trim=start={previews['poster_at']:.3f}[poster]")
+        outputs += ["-map", "[poster]", "-frames:v", "1", "-q:v", "2", "-update", "1",
+                    previews["poster"] + ".tmp.jpg"]
+    if previews.get("interval"):
+        (tw, th), (cols, rows) = previews["tile"], TRICKPLAY_GRID
+        filters.append(f"[0:v]fps=1/{previews['interval']},scale={tw}:{th},setsar=1,"
+                       f"tile={cols}x{rows}[sprite]")
+        outputs += ["-map", "[sprite]", "-q:v", "5", "-f", "image2", "-start_number", "0",
+                    os.path.join(previews["dir"], f"{sprite_prefix}%03d.jpg")]
+    return filters, outputs
+
+
+def _vtt_time(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+
+def _trickplay_vtt(windows: List[Tuple[float, float, str]], interval: float, tile: Tuple[int, int],
+                   available: Optional[set] = None) -> str:
+    """WebVTT thumbnail track: one cue per ``interval`` pointing at its sprite cell.
+
+    ``windows`` is [(start, length, sprite_prefix)], one per ffmpeg process
+    (the whole source, each chunk, or each resumed run); each process numbers
+    its own sheets. With ``available``, cues on sheets not in it (never
+    written by an interrupted run) are left out.
+    """
+    (tw, th), (cols, rows) = tile, TRICKPLAY_GRID
+    lines = ["WEBVTT", ""]
+    for start, length, prefix in windows:
+        for k in range(max(1, int(math.ceil(length / interval - 1e-6)))):
+            sheet, cell = divmod(k, cols * rows)
+            row, col = divmod(cell, cols)
+            t0 = start + k * interval
+            if available is not None and f"{prefix}{sheet:03d}.jpg" not in available:
+                continue
+            lines += [f"{_vtt_time(t0)} --> {_vtt_time(min(start + length, t0 + interval))}",
+                      f"{prefix}{sheet:03d}.jpg#xywh={col * tw},{row * th},{tw},{th}", ""]
+    return "\n".join(lines)
+
+
+def _finish_previews(previews: Dict, windows: List[Tuple[float, float, str]]) -> None:
+    """Move the poster into place and write the trickplay VTT once the encode succeeded."""
+    if previews.get("poster") and os.path.exists(previews["poster"] + ".tmp.jpg"):
+        os.replace(previews["poster"] + ".tmp.jpg", previews["poster"])
+    if previews.get("interval") and windows:
+        hls_playlists.write_atomic(os.path.join(previews["dir"], TRICKPLAY_VTT),
+                                   _trickplay_vtt(windows, previews["interval"], previews["tile"],
+                                                  set(os.listdir(previews["dir"]))))
+
+
+def _analysis_offsets(duration: Optional[float], clips: int, clip_seconds: float) -> List[float]:
+    """Start times of ``clips`` evenly spread sample clips (one clip at 0 for short sources)."""
+    if not duration or duration <= clips * clip_seconds:
+        return [0.0]
+    step = duration / (clips + 1)
+    return [round(step * (k + 1) - clip_seconds / 2, 3) for k in range(clips)]
+
+
+def _crf_probe(input_file: str, variants: List[Dict], start: float, seconds: float,
+               threads: Optional[int] = None) -> List[int]:
+    """Encode one clip at constant quality at every rung size (single decode);
+    returns the encoded bytes per rung."""
+    with tempfile.TemporaryDirectory(prefix="crf-probe-") as tmp:
+        graph = ";".join(
+            [f"[0:v]split={len(variants)}" + "".join(f"[v{i}]" for i in range(len(variants)))] +
+            [f"[v{i}]{_scale_pad(v)}[v{i}s]" for i, v in enumerate(variants)])
+        cmd = [FFMPEG_BIN, "-y", "-v", "error"] + _thread_args(threads)
+        cmd += ["-ss", f"{start:.3f}", "-t", f"{seconds:.3f}", "-i", input_file, "-filter_complex", graph]
+        paths = [os.path.join(tmp, f"{v['name']}.h264") for v in variants]
+        for i, path in enumerate(paths):
+            cmd += ["-map", f"[v{i}s]", "-an", "-c:v", "libx264", "-preset", ENCODE_PRESET,
+                    "-crf", str(ANALYSIS_CRF)]
+            if threads:
+                cmd += ["-threads", str(threads)]
+            cmd += ["-f", "h264", path]
+        _run_ffmpeg(cmd)
+        return [os.path.getsize(p) for p in paths]
+
+
+def _shape_ladder(variants: List[Dict], needed_kbps: List[int]) -> List[Dict]:
+    """Per-title ladder from the measured constant-quality bitrate of each rung.
+
+    Walking up from the smallest rung, a rung that needs less than
+    RUNG_MIN_GAIN times the bits of the last kept rung adds little detail and
+    is dropped. Kept rungs get the measured rate plus headroom, clamped to
+    ANALYSIS_MIN/MAX_FACTOR of their fixed-ladder bitrate.
+    """
+    kept: List[Tuple[Dict, int]] = []
+    for v, need in reversed(list(zip(variants, needed_kbps))):
+        if kept and need < kept[-1][1] * RUNG_MIN_GAIN:
+            continue
+        kept.append((v, need))
+    ladder = []
+    for v, need in reversed(kept):
+        kbps = min(max(need * ANALYSIS_HEADROOM, v["bitrate"] * ANALYSIS_MIN_FACTOR),
+                   v["bitrate"] * ANALYSIS_MAX_FACTOR)
+        ladder.append({**v, "bitrate": int(kbps)})
+    return ladder
+
+
+def analyse_ladder(input_file: str, probe: Dict, clips: int = 3, clip_seconds: float = 4,
+                   threads: Optional[int] = None) -> List[Dict]:
+    """Content-aware ladder for a source: [{"name", "bitrate"}, ...], largest first.
+
+    Samples ``clips`` short clips, CRF-encodes each at every rung size and
+    shapes the ladder from the average bitrate (see _shape_ladder). Static
+    footage ends up with fewer, cheaper rungs; high-motion footage may get up
+    to ANALYSIS_MAX_FACTOR of the fixed bitrates.
+    """
+    variants = _select_variants(probe.get("width") or 1920, probe.get("height") or 1080)
+    duration = probe.get("duration")
+    seconds = min(clip_seconds, duration) if duration else clip_seconds
+    totals = [0] * len(variants)
+    sampled = 0.0
+    for start in _analysis_offsets(duration, clips, clip_seconds):
+        totals = [a + b for a, b in zip(totals, _crf_probe(input_file, variants, start, seconds, threads))]
+        sampled += seconds
+    needed = [int(b * 8 / 1000 / sampled) for b in totals]
+    ladder = _shape_ladder(variants, needed)
+    logger.info("Content-aware ladder: measured %s kbps -> %s", dict(zip([v["name"] for v in variants], needed)),
+                {v["name"]: v["bitrate"] for v in ladder})
+    return [{"name": v["name"], "bitrate": v["bitrate"]} for v in ladder]
+
+
+# Source streams copied as a rung may run up to this multiple of its bitrate
+STREAM_COPY_MAX_BITRATE_RATIO = 2.0
+
+
+def _stream_copy_rung(probe: Dict, variants: List[Dict], segment_time: int) -> Optional[Dict]:
+    """The rung the source video can fill by stream copy, with copy=True and
+    the source bitrate; None if the source does not fit any rung as-is.
+
+    The source must look like our own encode of that rung: H.264 High at
+    level <= 4.1, yuv420p, the rung's exact size without rotation, and a fixed
+    keyframe interval dividing the segment length, so its segments cut at the
+    same times as the transcoded rungs.
+    """
+    if probe.get("video_codec") != "h264" or probe.get("video_profile") != "High":
+        return None
+    if not probe.get("video_level") or probe["video_level"] > 41 or probe.get("pix_fmt") != "yuv420p":
+        return None
+    if probe.get("rotation") or not probe.get("keyframe_regular"):
+        return None
+    interval = probe.get("keyframe_interval") or 0
+    if not 0 < interval <= segment_time:
+        return None
+    per_segment = segment_time / interval
+    if abs(per_segment - round(per_segment)) > 0.01:
+        return None
+    kbps = int((probe.get("video_bit_rate") or probe.get("bit_rate") or 0) / 1000)
+    for v in variants:
+        if (v["width"], v["height"]) == (probe.get("width"), probe.get("height")):
+            if 0 < kbps <= v["bitrate"] * STREAM_COPY_MAX_BITRATE_RATIO:
+                return {**v, "bitrate": kbps, "copy": True, "level": probe["video_level"]}
+            return None
+    return None
+
+
+# -------------------- Startup Segments --------------------
+# Short segments for the first seconds get the first frame on screen sooner;
+# the rest of the video keeps the longer steady-state length (fewer requests).
+def _startup_plan(segment_time: float, startup_segment_time: Optional[float],
+                  startup_seconds: Optional[float]) -> Optional[Tuple[float, int]]:
+    """(short segment length, count) covering the startup window, or None when off.
+
+    The window is rounded up to whole ``segment_time`` segments and split into
+    equal short segments, so every later boundary stays on the segment_time
+    grid that chunk windows and resume points already use.
+    """
+    if not startup_segment_time or not startup_seconds or startup_segment_time >= segment_time:
+        return None
+    window = math.ceil(startup_seconds / segment_time) * segment_time
+    count = max(1, int(round(window / startup_segment_time)))
+    return window / count, count
+
+
+def _startup_keyframes(plan: Optional[Tuple[float, int]], start: float) -> List[float]:
+    """Short-segment boundaries after ``start``, relative to it (ffmpeg compares
+    forced keyframe times with the run's own timestamps, before
+    -output_ts_offset). The window end is included so the fixed GOP restarts
+    there; empty once ``start`` is past the window."""
+    if not plan:
+        return []
+    length, count = plan
+    return [round(n * length - start, 6) for n in range(1, count + 1) if n * length > start + 1e-6]
+
+
+def _hls_time(segment_time: float, plan: Optional[Tuple[float, int]], keyframes: List[float]) -> str:
+    """-hls_time for a run: the short length while it still has startup boundaries
+    to cut (segments are cut at the first keyframe past it, so the fixed GOP
+    still gives segment_time segments after the window)."""
+    return f"{plan[0]:.3f}" if plan and keyframes else str(segment_time)
+
+
+# -------------------- Resumable encodes --------------------
+# A worker that dies mid-encode leaves its output behind; the retry resumes it
+# if nothing that shapes the output changed. The single-process path records
+# completion per segment (event playlists + temp_file segments), the chunked
+# path per slice (CHUNK_DONE marker).
+RESUME_FILE = ".resume.json"
+CHUNK_DONE = ".done"
+
+
+def _resume_fingerprint(input_file: str, *settings) -> str:
+    """Identify an encode by its source file and every setting that shapes the output."""
+    st = os.stat(input_file)
+    blob = json.dumps([st.st_size, int(st.st_mtime), *settings], sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def _load_checkpoint(work_dir: str, fingerprint: str, key_bytes: Optional[bytes]) -> Optional[Dict]:
+    """Checkpoint of an interrupted encode with the same fingerprint and key, else None."""
+    try:
+        with open(os.path.join(work_dir, RESUME_FILE), encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if key_bytes is None or state.get("fingerprint") != fingerprint \
+            or state.get("key") != hashlib.sha256(key_bytes).hexdigest():
+        return None
+    return state
+
+
+def _save_checkpoint(work_dir: str, state: Dict) -> None:
+    hls_playlists.write_atomic(os.path.join(work_dir, RESUME_FILE), json.dumps(state))
+
+
+def _consolidate_runs(work_dir: str, n_outputs: int, segment_format: str = "ts") -> Tuple[int, float]:
+    """Validate the segments written so far and fold resumed runs into ``<i>/``.
+
+    ffmpeg only lists a segment in its event playlist once the segment file is
+    complete, so each output keeps the unbroken sequence its playlists list
+    (the base run, then each ``.resume-*`` run). All outputs are cut back to the
+    shortest, leftover and partial files are deleted, and ``<i>/index.m3u8`` is
+    rewritten as a VOD playlist. fMP4 init sections move into ``segments/`` as
+    ``init_<first segment>.mp4``, one per run. Returns (segments kept, media
+    seconds covered).
+    """
+    ext = _segment_ext(segment_format)
+    runs = sorted(glob.glob(os.path.join(work_dir, ".resume-*")))
+    kept: List[Tuple[List[Tuple[float, str]], Dict[int, str]]] = []
+    for i in range(n_outputs):
+        seg_dir = os.path.join(work_dir, str(i), "segments")
+        os.makedirs(seg_dir, exist_ok=True)
+        entries: List[Tuple[float, str]] = []
+        maps: Dict[int, str] = {}
+        for run in [work_dir] + runs:
+            pl = os.path.join(run, str(i), "index.m3u8")
+            listed = hls_playlists.parse_media_playlist(pl) if os.path.exists(pl) else []
+            run_maps = hls_playlists.parse_media_maps(pl) if listed else {}
+            broken = False
+            for n, (dur, uri) in enumerate(listed):
+                if n in run_maps:
+                    init = f"init_{len(entries):06d}.mp4"
+                    src = os.path.join(run, str(i), run_maps[n])
+                    if not os.path.exists(src):
+                        broken = True
+                        break
+                    os.replace(src, os.path.join(seg_dir, init))
+                    maps[len(entries)] = f"segments/{init}"
+                name = f"segment_{len(entries):06d}.{ext}"
+                src = os.path.join(run, str(i), "segments", name)
+                if os.path.basename(uri) != name or not os.path.exists(src):
+                    broken = True
+                    break
+                if run != work_dir:
+                    os.replace(src, os.path.join(seg_dir, name))
+                entries.append((dur, f"segments/{name}"))
+            if broken:
+                break
+        kept.append((entries, maps))
+
+    count = min((len(e) for e, _ in kept), default=0)
+    for i, (entries, maps) in enumerate(kept):
+        seg_dir = os.path.join(work_dir, str(i), "segments")
+        maps = {n: uri for n, uri in maps.items() if n < count}
+        keep = {os.path.basename(uri) for _, uri in entries[:count]} | \
+            {os.path.basename(uri) for uri in maps.values()}
+        for name in os.listdir(seg_dir):
+            if name not in keep:
+                os.remove(os.path.join(seg_dir, name))
+        hls_playlists.write_atomic(os.path.join(work_dir, str(i), "index.m3u8"),
+                                   hls_playlists.render_media_playlist(
+                                       entries[:count], _work_key_line(segment_format), maps=maps))
+    for run in runs:
+        shutil.rmtree(run, ignore_errors=True)
+    return count, round(sum(d for d, _ in kept[0][0][:count]), 6) if kept else 0.0
+
+
+# -------------------- Segment Formats --------------------
+def _segment_ext(segment_format: str) -> str:
+    return "m4s" if segment_format == "fmp4" else "ts"
+
+
+def _work_key_line(segment_format: str) -> Optional[str]:
+    """Key line of a playlist straight out of ffmpeg: fMP4 fragments are
+    written in the clear and only encrypted by _pack_fmp4."""
+    return None if segment_format == "fmp4" else KEY_LINE
+
+
+def _hls_flags(segment_format: str, *flags: str) -> List[str]:
+    """-hls_flags with ``flags``. TS runs add periodic_rekey, which makes ffmpeg
+    re-read the keyinfo per segment and so use each segment's sequence number
+    as IV (without it the first segment's IV is kept for the whole run)."""
+    if segment_format != "fmp4":
+        flags += ("periodic_rekey",)
+    return ["-hls_flags", "+".join(flags)]
+
+
+def _segment_iv(sequence: int) -> bytes:
+    """AES-128 IV of the segment with media sequence number ``sequence``."""
+    return sequence.to_bytes(16, "big")
+
+
+def _segment_index_at(t: float, segment_time: int, plan: Optional[Tuple[float, int]]) -> int:
+    """Sequence number of the segment starting at boundary ``t`` (startup
+    window first, then the segment_time grid)."""
+    if plan:
+        length, count = plan
+        if t <= length * count:
+            return int(round(t / length))
+        return count + int(round((t - length * count) / segment_time))
+    return int(round(t / segment_time))
+
+
+def _segment_args(segment_format: str, segment_pattern: str, key_info_path: str) -> List[str]:
+    """hls muxer arguments writing ``segment_pattern`` + extension.
+
+    ffmpeg cannot encrypt fMP4 output itself, so fMP4 runs get no keyinfo.
+    frag_discont makes each fragment's decode time (tfdt) carry the
+    -output_ts_offset of chunks and resumed runs instead of restarting at 0
+    behind an edit list, so their fragments line up on one timeline.
+    """
+    if segment_format == "fmp4":
+        return ["-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4",
+                "-hls_segment_options", "movflags=+frag_discont",
+                "-hls_segment_filename", f"{segment_pattern}.m4s"]
+    return ["-hls_segment_filename", f"{segment_pattern}.ts", "-hls_key_info_file", key_info_path]
+
+
+def _aes128_encrypt(key_bytes: bytes, data: bytes, iv: bytes) -> bytes:
+    """AES-128-CBC with PKCS7 padding, as HLS METHOD=AES-128 specifies."""
+    padder = crypto_padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(key_bytes), modes.CBC(iv)).encryptor()
+    return encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+
+
+def _aes128_decrypt(key_bytes: bytes, data: bytes, iv: bytes) -> bytes:
+    decryptor = Cipher(algorithms.AES(key_bytes), modes.CBC(iv)).decryptor()
+    unpadder = crypto_padding.PKCS7(128).unpadder()
+    return unpadder.update(decryptor.update(data) + decryptor.finalize()) + unpadder.finalize()
+
+
+def _sample_descriptions(init: bytes) -> List[bytes]:
+    """The stsd boxes of an fMP4 init section, in track order."""
+    found: List[bytes] = []
+
+    def walk(data: bytes) -> None:
+        pos = 0
+        while pos + 8 <= len(data):
+            size = int.from_bytes(data[pos:pos + 4], "big")
+            kind = data[pos + 4:pos + 8]
+            header = 8
+            if size == 1:
+                size, header = int.from_bytes(data[pos + 8:pos + 16], "big"), 16
+            elif size == 0:
+                size = len(data) - pos
+            if size < header:
+                return
+            body = data[pos + header:pos + size]
+            if kind in (b"moov", b"trak", b"mdia", b"minf", b"stbl"):
+                walk(body)
+            elif kind == b"stsd":
+                found.append(body)
+            pos += size
+
+    walk(init)
+    return found
+
+
+def _pack_fmp4(rung_dir: str, name: str, key_bytes: bytes) -> None:
+    """Pack a rung's init sections and fragments into one ``<name>.mp4``.
+
+    Every piece is encrypted on its own, so each #EXT-X-MAP and
+    #EXT-X-BYTERANGE span decrypts independently: segment n under IV n (its
+    sequence number, the playlist's key line has no IV), init sections under a
+    random IV declared by a key line ahead of their #EXT-X-MAP, as RFC 8216
+    requires for encrypted init sections. Resumed runs and chunks each bring an init section; one that
+    only differs from the previous in durations (same sample descriptions)
+    is dropped, so a normal rung ends up with a single #EXT-X-MAP. The rung's
+    I-frame playlist, if any, is packed into the same file and shares its
+    init sections. ``segments/`` is removed afterwards.
+    """
+    media = f"{name}.mp4"
+    offset = 0
+    packed_inits: Dict[str, Tuple[Tuple[int, int], bytes]] = {}
+    with open(os.path.join(rung_dir, media + ".tmp"), "wb") as out:
+        def append(uri: str, iv: bytes) -> Tuple[int, int]:
+            nonlocal offset
+            with open(os.path.join(rung_dir, uri), "rb") as f:
+                data = _aes128_encrypt(key_bytes, f.read(), iv)
+            out.write(data)
+            span = (len(data), offset)
+            offset += len(data)
+            return span
+
+        for playlist_name in (f"{name}.m3u8", IFRAME_PLAYLIST):
+            playlist = os.path.join(rung_dir, playlist_name)
+            if not os.path.exists(playlist):
+                continue
+            entries = hls_playlists.parse_media_playlist(playlist)
+            maps = hls_playlists.parse_media_maps(playlist)
+            packed_entries: List[Tuple[float, str, Tuple[int, int]]] = []
+            packed_maps: Dict[int, Tuple[str, Tuple[int, int]]] = {}
+            map_keys: Dict[int, str] = {}
+            current = None
+            for n, (dur, uri) in enumerate(entries):
+                if n in maps:
+                    with open(os.path.join(rung_dir, maps[n]), "rb") as f:
+                        signature = _sample_descriptions(f.read())
+                    if not signature or signature != current:
+                        current = signature
+                        if maps[n] not in packed_inits:
+                            iv = secrets.token_bytes(16)
+                            packed_inits[maps[n]] = (append(maps[n], iv), iv)
+                        span, iv = packed_inits[maps[n]]
+                        packed_maps[n] = (media, span)
+                        map_keys[n] = f"{KEY_LINE},IV=0x{iv.hex()}"
+                packed_entries.append((dur, media, append(uri, _segment_iv(n))))
+            packed_text = hls_playlists.render_media_playlist(
+                packed_entries, KEY_LINE, maps=packed_maps, map_keys=map_keys,
+                iframes_only=playlist_name == IFRAME_PLAYLIST)
+            hls_playlists.write_atomic(playlist + ".packed", packed_text)
+    os.replace(os.path.join(rung_dir, media + ".tmp"), os.path.join(rung_dir, media))
+    for playlist_name in (f"{name}.m3u8", IFRAME_PLAYLIST):
+        playlist = os.path.join(rung_dir, playlist_name)
+        if os.path.exists(playlist + ".packed"):
+            os.replace(playlist + ".packed", playlist)
+    shutil.rmtree(os.path.join(rung_dir, "segments"), ignore_errors=True)
+
+
+# -------------------- I-Frame Playlists --------------------
+# A trick-play / seek player fetches only the leading IDR frame of each
+# segment, listed in <rung>/iframes.m3u8 (#EXT-X-I-FRAMES-ONLY) and referenced
+# from the master with #EXT-X-I-FRAME-STREAM-INF.
+IFRAME_PLAYLIST = "iframes.m3u8"
+IFRAME_RUNGS = ("none", "lowest", "all")
+
+
+def _iframe_rungs(variants: List[Dict], which: Optional[str]) -> List[str]:
+    """Rungs of the full ladder that get an I-frame playlist."""
+    if which == "all":
+        return [v["name"] for v in variants]
+    if which == "lowest" and variants:
+        return [min(variants, key=lambda v: (v["height"], v["bitrate"]))["name"]]
+    return []
+
+
+def _write_iframe_playlist(rung_dir: str, name: str, segment_format: str, key_bytes: bytes) -> bool:
+    """Write ``iframes.m3u8`` for a finished rung (before fMP4 packing).
+
+    Each segment's leading I-frame is cut into ``segments/iframe_NNNNNN``: TS
+    pieces are encrypted like the segments, fMP4 ones are left for _pack_fmp4.
+    Returns False (and writes nothing) if a segment has no leading I-frame.
+    """
+    playlist = os.path.join(rung_dir, f"{name}.m3u8")
+    entries = hls_playlists.parse_media_playlist(playlist)
+    maps = hls_playlists.parse_media_maps(playlist)
+    written: List[str] = []
+    frames: List[Tuple[float, str]] = []
+    track_id = None
+    for n, (dur, uri) in enumerate(entries):
+        with open(os.path.join(rung_dir, uri), "rb") as f:
+            data = f.read()
+        if segment_format == "fmp4":
+            if n in maps:
+                with open(os.path.join(rung_dir, maps[n]), "rb") as f:
+                    track_id = hls_iframes.video_track_id(f.read())
+            frame = hls_iframes.fmp4_iframe(data, track_id) if track_id else None
+        else:
+            # The I-frame playlist numbers its pieces like the segments
+            frame = hls_iframes.ts_iframe(_aes128_decrypt(key_bytes, data, _segment_iv(n)))
+            frame = _aes128_encrypt(key_bytes, frame, _segment_iv(n)) if frame else None
+        if frame is None:
+            logger.warning("No leading I-frame in %s/%s; skipping its I-frame playlist", name, uri)
+            for path in written:
+                os.remove(path)
+            return False
+        out = f"segments/iframe_{n:06d}.{_segment_ext(segment_format)}"
+        written.append(os.path.join(rung_dir, out))
+        with open(written[-1], "wb") as f:
+            f.write(frame)
+        frames.append((dur, out))
+    hls_playlists.write_atomic(os.path.join(rung_dir, IFRAME_PLAYLIST), hls_playlists.render_media_playlist(
+        frames, _work_key_line(segment_format), maps=maps, iframes_only=True))
+    return True
+
+
+def _iframe_stream_info(output_dir: str, variant: Dict) -> Optional[Dict]:
+    """#EXT-X-I-FRAME-STREAM-INF entry for a rung with an I-frame playlist;
+    BANDWIDTH is the peak of I-frame bytes over the time each one covers."""
+    playlist = os.path.join(output_dir, variant["name"], IFRAME_PLAYLIST)
+    measured = _playlist_bitrates(playlist) if os.path.exists(playlist) else None
+    if measured is None:
+        return None
+    return {"uri": f"{variant['name']}/{IFRAME_PLAYLIST}", "bandwidth": measured[0],
+            "resolution": f"{variant['width']}x{variant['height']}", "codecs": H264_CODECS}
+
+
+# -------------------- Rendition Dedup --------------------
+# A complete output is registered under its source's content hash plus the
+# settings that shaped it; a later job with the same key links it instead of
+# encoding. Outputs are only ever replaced (new files, renames), never
+# rewritten in place, so hardlinked copies stay intact.
+def _output_settings(hls_options: Dict, analysis: Optional[Tuple] = None) -> Dict:
+    settings = {
+        "segment_time": hls_options.get("segment_time", 4),
+        "audio_bitrates": hls_options.get("audio_bitrates"),
+        "stream_copy": hls_options.get("stream_copy"),
+        "trickplay_interval": hls_options.get("trickplay_interval"),
+        "analysis": list(analysis) if analysis else None,
+        "ladder": HLS_LADDER,
+        "preset": ENCODE_PRESET,
+    }
+    # Only named when not the default, so existing TS outputs keep their keys
+    if hls_options.get("segment_format", "ts") != "ts":
+        settings["segment_format"] = hls_options["segment_format"]
+    plan = _startup_plan(settings["segment_time"], hls_options.get("startup_segment_time"),
+                         hls_options.get("startup_seconds"))
+    if plan:
+        settings["startup"] = list(plan)
+    if hls_options.get("iframe_playlists", "none") != "none":
+        settings["iframe_playlists"] = hls_options["iframe_playlists"]
+    return settings
+
+
+def _rendition_key(content: str, hls_options: Dict, analysis: Optional[Tuple] = None) -> str:
+    blob = json.dumps([content, _output_settings(hls_options, analysis)], sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def _link_file(src: str, dst: str) -> None:
+    """Hardlink ``src`` to ``dst`` (copy across filesystems), replacing ``dst``."""
+    tmp = dst + ".tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _link_tree(src_dir: str, dst_dir: str) -> None:
+    """Replace ``dst_dir`` with a hardlinked copy of a published output.
+
+    Work files (dot-prefixed) and the keyinfo, which names the source's key
+    path, are skipped; ``dst_dir`` gets its own keyinfo for later backfills.
+    """
+    tmp_dir = dst_dir + ".dedup"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for root, dirs, files in os.walk(src_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        out = os.path.join(tmp_dir, os.path.relpath(root, src_dir))
+        os.makedirs(out, exist_ok=True)
+        for name in files:
+            if not name.startswith(".") and name != "enc.keyinfo":
+                _link_file(os.path.join(root, name), os.path.join(out, name))
+    old_dir = dst_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(dst_dir):
+        os.replace(dst_dir, old_dir)
+    os.replace(tmp_dir, dst_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    _write_keyinfo(dst_dir)
+
+
+def reuse_renditions(key: str, video_id: str) -> Optional[str]:
+    """Publish the registered output for ``key`` as ``video_id``'s output.
+
+    Returns the master playlist path, or None when nothing usable is
+    registered. The video's own registered output is reused as is.
+    """
+    row = db.session.get(RenditionSet, key)
+    if row is None:
+        return None
+    if not os.path.exists(os.path.join(row.output_dir, "master.m3u8")):
+        db.session.delete(row)
+        db.session.commit()
+        return None
+    output_dir = os.path.join("app", "static", "hls_output", video_id)
+    if os.path.abspath(row.output_dir) != os.path.abspath(output_dir):
+        _link_tree(row.output_dir, output_dir)
+        poster = os.path.join(THUMBNAILS_DIR, f"{row.video_uuid}.jpg")
+        if os.path.exists(poster):
+            os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+            _link_file(poster, os.path.join(THUMBNAILS_DIR, f"{video_id}.jpg"))
+    row.reuse_count = (row.reuse_count or 0) + 1
+    row.last_used_at = _utcnow()
+    db.session.commit()
+    logger.info("Reused renditions of %s for %s (key %s)", row.video_uuid, video_id, key[:12])
+    return os.path.abspath(os.path.join(output_dir, "master.m3u8"))
+
+
+def register_renditions(key: str, content: str, video_id: str) -> None:
+    """Record ``video_id``'s now-complete output under ``key``."""
+    output_dir = os.path.abspath(os.path.join("app", "static", "hls_output", video_id))
+    try:
+        RenditionSet.query.filter(RenditionSet.video_uuid == video_id, RenditionSet.key != key).delete()
+        db.session.merge(RenditionSet(key=key, content_hash=content, video_uuid=video_id, output_dir=output_dir))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.warning("Could not register renditions of %s", video_id, exc_info=True)
+
+
+def forget_renditions(video_id: str) -> None:
+    """Drop registry rows for a video whose output is about to change or go away."""
+    try:
+        RenditionSet.query.filter(RenditionSet.video_uuid == video_id).delete()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.warning("Could not drop rendition registry rows of %s", video_id, exc_info=True)
+
+
+# The settings half of the key (ladder, preset and every option that shapes
+# the output) is written next to a complete output's master playlist, so a
+# bulk re-encode can skip videos already encoded with the current settings.
+OUTPUT_FINGERPRINT = ".fingerprint"
+
+
+def output_fingerprint(config) -> str:
+    """Fingerprint of the output settings ``config`` encodes with."""
+    analysis = None
+    if config.get("TRANSCODE_CONTENT_AWARE", False):
+        analysis = (int(config.get("TRANSCODE_ANALYSIS_CLIPS", 3)),
+                    float(config.get("TRANSCODE_ANALYSIS_CLIP_SECONDS", 4)))
+    blob = json.dumps(_output_settings(_hls_options(config), analysis), sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def read_output_fingerprint(video_id: str) -> Optional[str]:
+    """Fingerprint recorded for ``video_id``'s published output, if any."""
+    output_dir = os.path.join("app", "static", "hls_output", video_id)
+    if not os.path.exists(os.path.join(output_dir, "master.m3u8")):
+        return None
+    try:
+        with open(os.path.join(output_dir, OUTPUT_FINGERPRINT), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_output_fingerprint(video_id: str, fingerprint: Optional[str]) -> None:
+    """Record ``fingerprint`` for ``video_id``'s output; None drops it."""
+    path = os.path.join("app", "static", "hls_output", video_id, OUTPUT_FINGERPRINT)
+    if fingerprint is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    hls_playlists.write_atomic(path, fingerprint + "\n")
+
+
+def convert_to_hls(input_file: str, video_id: str, segment_time: int = 4,
+                   chunked: bool = False, chunk_seconds: int = 120,
+                   parallelism: Optional[int] = None, probe: Optional[Dict] = None,
+                   on_progress: Optional[Callable[[object, Dict], None]] = None,
+                   rungs: Optional[List[str]] = None, reuse_key: bool = False,
+                   audio_bitrates: Optional[List[int]] = None,
+                   stream_copy: bool = False, ladder: Optional[List[Dict]] = None,
+                   poster: bool = False, trickplay_interval: Optional[float] = None,
+                   threads: Optional[int] = None, segment_format: str = "ts",
+                   startup_segment_time: Optional[float] = None,
+                   startup_seconds: Optional[float] = None,
+                   iframe_playlists: Optional[str] = None) -> str:
+    """
+    Create HLS (AES-128, MPEG-TS or fMP4) at:
+      app/static/hls_output/<video_id>/master.m3u8
+    Variant folders/playlists keep your names:
+      4k/4k.m3u8, 1440p/1440p.m3u8, 1080p/1080p.m3u8, 720p/720p.m3u8, 480p/480p.m3u8, 360p/360p.m3u8
+
+    With chunked=True and a source longer than two chunks, the source is cut
+    into GOP-aligned time slices encoded by parallel ffmpeg processes and the
+    per-slice segments are stitched into the same layout.
+
+    ``probe`` is a probe_media() result; pass it to skip probing the source.
+    ``on_progress(key, progress)`` receives parsed ffmpeg -progress updates;
+    ``key`` identifies the ffmpeg process (the chunk index in chunked mode).
+
+    Every encode that is not a ``reuse_key`` backfill gets a fresh key and is
+    built in ``<video_id>.next/`` beside the published output, which keeps
+    playing (with its own key) until _publish_output swaps the finished
+    output, key and master in at once.
+
+    ``rungs`` restricts the encode to those ladder names (fast-start and
+    backfill). ``reuse_key`` keeps the video's existing key so a backfilled
+    rung plays under the same master as the rungs already published: it is
+    staged in a private directory, moved into place, and master.m3u8 is
+    atomically rewritten to list every rung now on disk.
+
+    ``audio_bitrates`` switches to a shared audio group: video-only variant
+    streams plus one AAC rendition per bitrate (``audio_<kbps>k/``), referenced
+    from the master with #EXT-X-MEDIA. Backfills follow whatever audio layout
+    the video already has on disk.
+
+    ``stream_copy`` lets a source that already matches a rung (see
+    _stream_copy_rung) be remuxed into that rung with ``-c:v copy``; only the
+    other rungs are transcoded. Not used in chunked mode.
+
+    ``ladder`` ([{"name", "bitrate"}], see analyse_ladder) replaces the fixed
+    ladder: only the listed rungs are produced, at the listed bitrates.
+
+    ``poster`` writes app/static/thumbnails/<video_id>.jpg and
+    ``trickplay_interval`` writes sprite sheets plus ``trickplay/thumbnails.vtt``
+    (one tile per interval), both from the ladder encode's own decode.
+
+    An earlier attempt that died part-way (same source, settings and key) is
+    resumed: the single-process path restarts after the last segment every
+    output completed, the chunked path re-runs only unfinished slices.
+
+    ``threads`` is the job's thread budget (see ResourceGovernor); in chunked
+    mode it is shared by the parallel slices. None leaves ffmpeg's defaults.
+
+    ``segment_format="fmp4"`` writes CMAF fragments instead of MPEG-TS and packs
+    each rung into a single ``<name>/<name>.mp4`` addressed by byte ranges
+    (see _pack_fmp4), instead of one file per segment.
+
+    ``startup_segment_time`` cuts the first ``startup_seconds`` (rounded up to
+    whole segments) into short segments with forced keyframes, so playback
+    starts after a small first download; ``segment_time`` applies afterwards.
+    Not combined with a shared audio group (audio-only streams would keep the
+    short length throughout) or a stream-copied rung (its keyframes are fixed).
+
+    ``iframe_playlists`` ("lowest" or "all" rungs of the video's ladder) adds
+    an #EXT-X-I-FRAMES-ONLY playlist of each segment's leading I-frame to
+    those rungs, listed in the master for trick play and seeking.
+    """
+    if segment_format not in SEGMENT_FORMATS:
+        raise ValueError(f"segment_format must be one of {SEGMENT_FORMATS}, got {segment_format!r}")
+    if iframe_playlists is not None and iframe_playlists not in IFRAME_RUNGS:
+        raise ValueError(f"iframe_playlists must be one of {IFRAME_RUNGS}, got {iframe_playlists!r}")
+    probe = probe or probe_media(input_file)
+    orig_w, orig_h = probe.get("width") or 1920, probe.get("height") or 1080
+    has_audio = bool(probe.get("has_audio"))
+    variants = _select_variants(orig_w, orig_h)
+    if ladder is not None:
+        chosen = {r["name"]: int(r["bitrate"]) for r in ladder}
+        variants = [{**v, "bitrate": chosen[v["name"]]} for v in variants if v["name"] in chosen]
+    iframe_names = _iframe_rungs(variants, iframe_playlists)
+    if rungs is not None:
+        variants = [v for v in variants if v["name"] in rungs]
+        if not variants:
+            raise ValueError(f"No ladder rung in {rungs} fits a {orig_w}x{orig_h} source")
+
+    output_dir = os.path.join("app", "static", "hls_output", video_id)
+
+    # AES-128 key (one key for all variants). A new key means a new output,
+    # built in build_dir; a backfill adds to the published one.
+    reusing = reuse_key and os.path.exists(os.path.join(output_dir, "enc.keyinfo"))
+    build_dir = output_dir if reusing else output_dir + BUILD_SUFFIX
+    key_info_path = os.path.join(build_dir, "enc.keyinfo")
+    if reusing:
+        audio_bitrates = [] if _present_audio(output_dir) else None
+    audio_kbps = sorted(set(audio_bitrates)) if (has_audio and audio_bitrates is not None) else None
+    outputs = [v["name"] for v in variants] + [_audio_name(k) for k in audio_kbps or []]
+
+    fps = probe.get("fps") or 25.0
+    gop = max(1, int(round(segment_time * fps)))
+    plan = _startup_plan(segment_time, startup_segment_time, startup_seconds) if audio_kbps is None else None
+
+    duration = probe.get("duration")
+    use_chunks = False
+    if chunked:
+        chunk_seconds = max(segment_time, int(math.ceil(chunk_seconds / segment_time)) * segment_time)
+        use_chunks = bool(duration and duration >= 2 * chunk_seconds)
+
+    copy_rung = (_stream_copy_rung(probe, variants, segment_time)
+                 if stream_copy and not use_chunks and not plan else None)
+    if copy_rung:
+        logger.info("Stream-copying source as %s for %s", copy_rung["name"], video_id)
+        variants = [copy_rung if v["name"] == copy_rung["name"] else v for v in variants]
+
+    staged = reusing
+    work_dir = os.path.join(output_dir, ".stage-" + "-".join(outputs)) if staged else build_dir
+    fingerprint = _resume_fingerprint(input_file, variants, audio_kbps, segment_time, gop,
+                                      chunk_seconds if use_chunks else None, poster, trickplay_interval,
+                                      segment_format, plan, "iv=sequence")
+    checkpoint = _load_checkpoint(work_dir, fingerprint, _read_hls_key(build_dir))
+    resume = checkpoint is not None
+    if not reusing and not resume:
+        # Whatever an earlier attempt left is encrypted with its key
+        shutil.rmtree(build_dir, ignore_errors=True)
+        os.makedirs(build_dir)
+        key_info_path = _write_hls_key(build_dir)
+    key_bytes = _read_hls_key(build_dir)
+    if resume:
+        logger.info("Resuming interrupted encode of %s", video_id)
+    else:
+        if staged:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        # Half-written %v dirs of an attempt that cannot be resumed
+        for path in [os.path.join(work_dir, str(i)) for i in range(len(outputs))] + \
+                glob.glob(os.path.join(work_dir, ".resume-*")):
+            shutil.rmtree(path, ignore_errors=True)
+        checkpoint = {"fingerprint": fingerprint, "key": hashlib.sha256(key_bytes).hexdigest(),
+                      "windows": []}
+    os.makedirs(work_dir, exist_ok=True)
+    _save_checkpoint(work_dir, checkpoint)
+
+    previews = {"poster": os.path.join(THUMBNAILS_DIR, f"{video_id}.jpg") if poster else None,
+                "poster_at": min(1.0, duration / 2) if duration else 0.0,
+                "interval": trickplay_interval if duration else None,
+                "tile": _tile_size(probe), "dir": os.path.join(build_dir, TRICKPLAY_DIR)}
+    if previews["poster"]:
+        os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+        if not resume and os.path.exists(previews["poster"] + ".tmp.jpg"):
+            os.remove(previews["poster"] + ".tmp.jpg")
+    if previews["interval"]:
+        if not resume:
+            shutil.rmtree(previews["dir"], ignore_errors=True)
+        os.makedirs(previews["dir"], exist_ok=True)
+
+    if use_chunks:
+        _convert_to_hls_chunked(input_file, work_dir, variants, has_audio, gop,
+                                segment_time, key_info_path, duration,
+                                chunk_seconds, parallelism, on_progress, audio_kbps,
+                                previews, resume, threads, segment_format, key_bytes, plan,
+                                iframe_names)
+        os.remove(os.path.join(work_dir, RESUME_FILE))
+        if staged:
+            return _publish_rungs(work_dir, output_dir, outputs, has_audio, key_bytes, probe.get("fps"))
+        return _publish_output(build_dir, output_dir, has_audio, probe.get("fps"))
+
+    # Resume after the last segment every output completed; sprite sheets of
+    # each run get their own prefix and are stitched in the VTT like chunks.
+    start_number, resume_at = _consolidate_runs(work_dir, len(outputs), segment_format) if resume else (0, 0.0)
+    windows = [(start, prefix) for start, prefix in checkpoint["windows"] if start < resume_at]
+    prefix = f"sprite_{start_number:06d}_" if start_number else "sprite_"
+    windows.append((resume_at, prefix))
+    checkpoint["windows"] = windows
+    _save_checkpoint(work_dir, checkpoint)
+    run_dir = os.path.join(work_dir, f".resume-{start_number:06d}") if start_number else work_dir
+    if start_number:
+        logger.info("Resuming %s at segment %d (%.1fs)", video_id, start_number, resume_at)
+        if on_progress:
+            on_progress("resumed", {"out_time": resume_at, "done": True})
+
+    poster_pending = bool(previews["poster"]) and not os.path.exists(previews["poster"] + ".tmp.jpg")
+    run_previews = {**previews, "poster_at": max(0.0, previews["poster_at"] - resume_at)}
+    preview_filters, preview_outputs = _preview_args(run_previews, prefix, with_poster=poster_pending)
+    keyframes = _startup_keyframes(plan, resume_at)
+    encode_args, var_map_parts = _ladder_encode_args(variants, has_audio, gop, audio_kbps,
+                                                     preview_filters, keyframes)
+    cmd = [FFMPEG_BIN, "-y"] + _thread_args(threads)
+    if start_number:
+        cmd += ["-ss", f"{resume_at:.3f}"]
+    cmd += ["-i", input_file] + encode_args
+
     # Prepare %v working dirs
-    for i in range(len(variants)):
-        os.makedirs(os.path.join(output_dir, str(i),
+    for i in range(len(outputs)):
+        os.makedirs(os.path.join(run_dir, str(i),
                     "segments"), exist_ok=True)
 
-    # HLS (TS) muxing – write segments into "<...>/%v/segments/segment_*.ts"
+    # HLS muxing – write segments into "<...>/%v/segments/segment_*.ts" (or .m4s).
+    # Event playlists + temp_file: a playlist only lists finished segments,
+    # which is what a resumed attempt trusts.
+    if start_number:
+        cmd += ["-output_ts_offset", f"{resume_at:.3f}", "-start_number", str(start_number)]
+    if threads:
+        cmd += ["-threads", str(threads)]
     cmd += [
         "-f", "hls",
-        "-hls_time", str(segment_time),
-        "-hls_playlist_type", "vod",
-        "-hls_flags", "independent_segments+append_list",
-        "-hls_segment_filename", os.path.join(output_dir,
-                                              "%v", "segments", "segment_%06d.ts"),
-        "-hls_key_info_file", key_info_path,
-        "-master_pl_name", "master.m3u8",
+        "-hls_time", _hls_time(segment_time, plan, keyframes),
+        "-hls_playlist_type", "event",
+    ] + _hls_flags(segment_format, "independent_segments", "temp_file") + _segment_args(segment_format, os.path.join(run_dir, "%v", "segments", "segment_%06d"), key_info_path) + [
         "-var_stream_map", " ".join(var_map_parts),
-        os.path.join(output_dir, "%v", "index.m3u8"),
-    ]
-
-    subprocess.run(cmd, check=True)
+        os.path.join(run_dir, "%v", "index.m3u8"),
+    ] + preview_outputs
+
+    _run_ffmpeg(cmd, on_progress=functools.partial(on_progress, 0) if on_progress else None)
+    _check_lease()
+    _consolidate_runs(work_dir, len(outputs), segment_format)
+    if duration:
+        starts = [start for start, _ in windows] + [duration]
+        _finish_previews(previews, [(start, starts[n + 1] - start, prefix)
+                                    for n, (start, prefix) in enumerate(windows)])
+    os.remove(os.path.join(work_dir, RESUME_FILE))
 
     # Rename "%v" → friendly names and "index.m3u8" → "<name>.m3u8"
-    idx_to_name = {str(i): variants[i]["name"] for i in range(len(variants))}
+    idx_to_name = {str(i): name for i, name in enumerate(outputs)}
     for idx, friendly in idx_to_name.items():
-        src = os.path.join(output_dir, idx)
-        dst = os.path.join(output_dir, friendly)
+        src = os.path.join(work_dir, idx)
+        dst = os.path.join(work_dir, friendly)
         if os.path.isdir(src):
             if os.path.exists(dst):
                 shutil.rmtree(dst)
@@ -446,45 +2671,173 @@ def convert_to_hls(input_file: str, video_id: str, segment_time: int = 4) -> str
             new_pl = os.path.join(dst, f"{friendly}.m3u8")
             if os.path.exists(old_pl):
                 os.replace(old_pl, new_pl)
-
-    # Fix master URIs: "0/index.m3u8" → "<name>/<name>.m3u8"
-    master_path = os.path.join(output_dir, "master.m3u8")
-    with open(master_path, "r", encoding="utf-8") as f:
-        master_txt = f.read()
-
-    def _swap_uri(match: re.Match) -> str:
-        path = match.group(1)  # e.g. "0/index.m3u8"
-        first, _, _ = path.partition("/")
-        friendly = idx_to_name.get(first, first)
-        return f"{friendly}/{friendly}.m3u8"
-
-    master_txt = re.sub(r"^(\d+/index\.m3u8)\s*$", _swap_uri,
-                        master_txt, flags=re.MULTILINE)
-
-    with open(master_path, "w", encoding="utf-8") as f:
-        f.write(master_txt)
-
-    # >>> NEW: ensure each VARIANT playlist points to "segments/segment_*.ts"
-    for friendly in idx_to_name.values():
-        pl_path = os.path.join(output_dir, friendly, f"{friendly}.m3u8")
-        if not os.path.exists(pl_path):
-            continue
-        with open(pl_path, "r", encoding="utf-8") as f:
-            lines = f.read().splitlines()
-
-        fixed_lines = []
-        for line in lines:
-            if line.startswith("#"):
-                fixed_lines.append(line)
-                continue
-            # If it's a media segment line and doesn't already include a slash, prefix with "segments/"
-            # (covers names like "segment_000000.ts" → "segments/segment_000000.ts")
-            if line and (line.endswith(".ts") or ".ts?" in line) and ("/" not in line.split("?")[0]):
-                fixed_lines.append(f"segments/{line}")
-            else:
-                fixed_lines.append(line)
-
-        with open(pl_path, "w", encoding="utf-8") as f:
-            f.write("\n".join(fixed_lines) + "\n")
-
-    return os.path.abspath(master_path)
+            if friendly in iframe_names:
+                _write_iframe_playlist(dst, friendly, segment_format, key_bytes)
+            if segment_format == "fmp4":
+                _pack_fmp4(dst, friendly, key_bytes)
+    for v in variants:
+        _write_rung_meta(os.path.join(work_dir, v["name"]), v)
+
+    # The master is written from the rungs on disk with measured bitrates
+    # (ffmpeg's declares the -b:v targets and lists audio outputs as variants)
+    if staged:
+        return _publish_rungs(work_dir, output_dir, outputs, has_audio, key_bytes, probe.get("fps"))
+    return _publish_output(build_dir, output_dir, has_audio, probe.get("fps"))
+
+
+def _chunk_windows(duration: float, chunk_seconds: int) -> List[Tuple[float, float]]:
+    """[(start, length), ...] covering the source; starts are multiples of
+    chunk_seconds (itself a multiple of the segment length), so every chunk
+    begins on an output GOP / segment boundary."""
+    windows = []
+    start = 0.0
+    while start < duration:
+        windows.append((start, min(chunk_seconds, duration - start)))
+        start += chunk_seconds
+    # Fold a tiny tail into the previous chunk instead of encoding a sliver
+    if len(windows) > 1 and windows[-1][1] < chunk_seconds / 4:
+        tail = windows.pop()
+        prev_start, prev_len = windows.pop()
+        windows.append((prev_start, prev_len + tail[1]))
+    return windows
+
+
+def _run_chunk(cmd: List[str], chunk_dir: str, on_progress: Optional[Callable[[Dict], None]]) -> None:
+    _run_ffmpeg(cmd, on_progress)
+    open(os.path.join(chunk_dir, CHUNK_DONE), "w").close()
+
+
+def _convert_to_hls_chunked(input_file: str, output_dir: str, variants: List[Dict], has_audio: bool,
+                            gop: int, segment_time: int, key_info_path: str, duration: float,
+                            chunk_seconds: int, parallelism: Optional[int],
+                            on_progress: Optional[Callable[[object, Dict], None]] = None,
+                            audio_kbps: Optional[List[int]] = None,
+                            previews: Optional[Dict] = None, resume: bool = False,
+                            threads: Optional[int] = None, segment_format: str = "ts",
+                            key_bytes: Optional[bytes] = None,
+                            plan: Optional[Tuple[float, int]] = None,
+                            iframe_names: Optional[List[str]] = None) -> None:
+    """Segment-parallel encode: one ffmpeg per time slice, then stitch the
+    rungs into ``output_dir`` (the caller publishes the master).
+
+    Each slice is input-seeked (frame accurate when transcoding), encodes the
+    whole ladder with the same fixed GOP, and keeps source timestamps via
+    -output_ts_offset so the stitched playlists need no discontinuities. All
+    slices share the key and number their segments from their place in the
+    rung, so each segment is already encrypted under its stitched sequence
+    number and stitching is a rename plus a rewritten playlist.
+
+    The first slice also writes the poster; each slice writes its own sprite
+    sheets (``sprite_<slice>_NNN.jpg``) and the VTT stitches their cues.
+
+    With ``resume``, slices that finished in an earlier attempt (CHUNK_DONE
+    marker) are kept and only the others are encoded again.
+
+    ``threads`` (default: every core) is split over the parallel slices.
+
+    fMP4 slices each bring their own init section, kept as an #EXT-X-MAP at
+    the slice's first segment; ``key_bytes`` then encrypts the packed rung.
+
+    Slices overlapping the startup window (``plan``, see _startup_plan) force
+    keyframes at its short-segment boundaries. Rungs in ``iframe_names`` get
+    an I-frame playlist once stitched.
+    """
+    previews = previews or {}
+    budget = threads or os.cpu_count() or 1
+    workers = parallelism or max(1, budget // 4)
+    threads = max(1, budget // workers)
+    windows = _chunk_windows(duration, chunk_seconds)
+    work_dir = os.path.join(output_dir, ".chunks")
+    if not resume:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    outputs = [v["name"] for v in variants] + [_audio_name(k) for k in audio_kbps or []]
+    jobs = []
+    for n, (start, length) in enumerate(windows):
+        chunk_dir = os.path.join(work_dir, f"{n:05d}")
+        done = resume and os.path.exists(os.path.join(chunk_dir, CHUNK_DONE))
+        if not done:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+        for i in range(len(outputs)):
+            os.makedirs(os.path.join(chunk_dir, str(i)), exist_ok=True)
+        preview_filters, preview_outputs = _preview_args(previews, f"sprite_{n:03d}_", with_poster=n == 0)
+        keyframes = _startup_keyframes(plan, start)
+        encode_args, var_map_parts = _ladder_encode_args(variants, has_audio, gop, audio_kbps,
+                                                         preview_filters, keyframes)
+        cmd = [FFMPEG_BIN, "-y"] + _thread_args(threads)
+        cmd += ["-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", input_file]
+        cmd += encode_args
+        cmd += [
+            "-threads", str(threads),
+            "-output_ts_offset", f"{start:.3f}",
+            "-f", "hls",
+            "-hls_time", _hls_time(segment_time, plan, keyframes),
+            "-hls_playlist_type", "vod",
+            # numbered from the slice's place in the rung: the IVs are then
+            # already those of the stitched playlist
+            "-start_number", str(_segment_index_at(start, segment_time, plan)),
+        ] + _hls_flags(segment_format, "independent_segments") + _segment_args(segment_format, os.path.join(chunk_dir, "%v", "seg_%06d"), key_info_path) + [
+            "-var_stream_map", " ".join(var_map_parts),
+            os.path.join(chunk_dir, "%v", "index.m3u8"),
+        ] + preview_outputs
+        jobs.append((chunk_dir, cmd, done))
+
+    logger.info("Chunked encode: %d slice(s) of %ss (%d already done), %d parallel x %d thread(s)",
+                len(jobs), chunk_seconds, sum(done for _, _, done in jobs), workers, threads)
+    if on_progress:
+        for n, (_, _, done) in enumerate(jobs):
+            if done:
+                on_progress(n, {"out_time": windows[n][1], "done": True})
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        # Each slice runs in a copy of this context so its ffmpeg is
+        # registered with the job (see _LeaseKeeper)
+        futs = [ex.submit(contextvars.copy_context().run, _run_chunk, cmd, chunk_dir,
+                          functools.partial(on_progress, n) if on_progress else None)
+                for n, (chunk_dir, cmd, done) in enumerate(jobs) if not done]
+        try:
+            for fut in as_completed(futs):
+                fut.result()
+        except Exception:
+            for f in futs:
+                f.cancel()
+            raise
+
+    _check_lease()
+    for i, name in enumerate(outputs):
+        seg_dir = os.path.join(output_dir, name, "segments")
+        shutil.rmtree(os.path.join(output_dir, name), ignore_errors=True)
+        os.makedirs(seg_dir, exist_ok=True)
+        entries: List[Tuple[float, str]] = []
+        maps: Dict[int, str] = {}
+        for chunk_dir, _, _ in jobs:
+            src_dir = os.path.join(chunk_dir, str(i))
+            playlist = os.path.join(src_dir, "index.m3u8")
+            chunk_maps = hls_playlists.parse_media_maps(playlist)
+            for n, (dur, uri) in enumerate(hls_playlists.parse_media_playlist(playlist)):
+                if n in chunk_maps:
+                    init = f"init_{len(entries):06d}.mp4"
+                    os.replace(os.path.join(src_dir, chunk_maps[n]), os.path.join(seg_dir, init))
+                    maps[len(entries)] = f"segments/{init}"
+                dst = f"segment_{len(entries):06d}.{_segment_ext(segment_format)}"
+                encrypted_as = int(re.search(r"(\d+)\.\w+$", uri).group(1))
+                if segment_format != "fmp4" and encrypted_as != len(entries):
+                    # The slice cut a different number of segments than its
+                    # window predicts: move these onto their stitched IV
+                    with open(os.path.join(src_dir, uri), "rb") as f:
+                        data = _aes128_decrypt(key_bytes, f.read(), _segment_iv(encrypted_as))
+                    with open(os.path.join(src_dir, uri), "wb") as f:
+                        f.write(_aes128_encrypt(key_bytes, data, _segment_iv(len(entries))))
+                os.replace(os.path.join(src_dir, uri), os.path.join(seg_dir, dst))
+                entries.append((dur, f"segments/{dst}"))
+        hls_playlists.write_atomic(os.path.join(output_dir, name, f"{name}.m3u8"),
+                                   hls_playlists.render_media_playlist(
+                                       entries, _work_key_line(segment_format), maps=maps))
+        if name in (iframe_names or []):
+            _write_iframe_playlist(os.path.join(output_dir, name), name, segment_format, key_bytes)
+        if segment_format == "fmp4":
+            _pack_fmp4(os.path.join(output_dir, name), name, key_bytes)
+    for v in variants:
+        _write_rung_meta(os.path.join(output_dir, v["name"]), v)
+    _finish_previews(previews, [(start, length, f"sprite_{n:03d}_") for n, (start, length) in enumerate(windows)])
+
+    shutil.rmtree(work_dir, ignore_errors=True)
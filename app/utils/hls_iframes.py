@@ -0,0 +1,201 @@
+"""Cut the leading I-frame out of an HLS media segment, for I-frame playlists.
+
+Every segment the pipeline writes starts on an IDR frame (fixed, closed GOP),
+so a segment's first video access unit is the frame a trick-play player
+needs. Both helpers take cleartext segment bytes:
+
+- MPEG-TS: the segment's PAT and PMT plus the video packets of its first PES.
+- fMP4: a new moof + mdat holding only the video track's first sample.
+
+They return None when the segment does not look like that (no video track,
+first frame not a sync sample) and the caller skips the I-frame playlist.
+"""
+import struct
+from typing import Iterator, Optional, Tuple
+
+TS_PACKET = 188
+VIDEO_STREAM_TYPES = {0x1B, 0x24}    # H.264, HEVC
+
+TFHD_BASE_DATA_OFFSET = 0x1
+TFHD_DEFAULT_BASE_IS_MOOF = 0x20000
+TRUN_DATA_OFFSET = 0x1
+TRUN_FIRST_SAMPLE_FLAGS = 0x4
+SAMPLE_IS_NON_SYNC = 0x10000
+
+
+# -------------------- MPEG-TS --------------------
+def _ts_payload(pkt: bytes) -> bytes:
+    control = (pkt[3] >> 4) & 0x3
+    if control == 2:
+        return b""
+    return pkt[5 + pkt[4]:] if control == 3 else pkt[4:]
+
+
+def _psi_section(pkt: bytes) -> bytes:
+    payload = _ts_payload(pkt)
+    if not payload:
+        return b""
+    section = payload[1 + payload[0]:]
+    length = ((section[1] & 0x0F) << 8) | section[2] if len(section) >= 3 else 0
+    return section[:3 + length]
+
+
+def _pat_pmt_pid(pkt: bytes) -> Optional[int]:
+    section = _psi_section(pkt)
+    for pos in range(8, len(section) - 4 - 3, 4):
+        program, pid = struct.unpack_from(">HH", section, pos)
+        if program:
+            return pid & 0x1FFF
+    return None
+
+
+def _pmt_video_pid(pkt: bytes) -> Optional[int]:
+    section = _psi_section(pkt)
+    if len(section) < 12:
+        return None
+    pos = 12 + (struct.unpack_from(">H", section, 10)[0] & 0x0FFF)
+    while pos + 5 <= len(section) - 4:
+        stream_type = section[pos]
+        pid, info = struct.unpack_from(">HH", section, pos + 1)
+        if stream_type in VIDEO_STREAM_TYPES:
+            return pid & 0x1FFF
+        pos += 5 + (info & 0x0FFF)
+    return None
+
+
+def ts_iframe(data: bytes) -> Optional[bytes]:
+    """PAT + PMT + the first video PES of an MPEG-TS segment, if it is a keyframe."""
+    pat = pmt = None
+    pmt_pid = video_pid = None
+    frame = []
+    for pos in range(0, len(data) - TS_PACKET + 1, TS_PACKET):
+        pkt = data[pos:pos + TS_PACKET]
+        if pkt[0] != 0x47:
+            return None
+        start = bool(pkt[1] & 0x40)
+        pid = ((pkt[1] & 0x1F) << 8) | pkt[2]
+        if pid == 0 and pat is None and start:
+            pat, pmt_pid = pkt, _pat_pmt_pid(pkt)
+        elif pid == pmt_pid and pmt is None and start:
+            pmt, video_pid = pkt, _pmt_video_pid(pkt)
+        elif pid == video_pid and video_pid is not None:
+            if start and frame:
+                break
+            if start:
+                # random_access_indicator: ffmpeg flags every keyframe PES
+                keyframe = (pkt[3] >> 4) & 0x2 and pkt[4] and pkt[5] & 0x40
+                if not keyframe:
+                    return None
+            if frame or start:
+                frame.append(pkt)
+    if pat is None or pmt is None or not frame:
+        return None
+    return pat + pmt + b"".join(frame)
+
+
+# -------------------- fMP4 --------------------
+def _boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int, int]]:
+    """(type, box start, payload start, box end) for each box in data[start:end]."""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            size, header = struct.unpack_from(">Q", data, pos + 8)[0], 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield kind, pos, pos + header, pos + size
+        pos += size
+
+
+def _child(data: bytes, start: int, end: int, kind: bytes) -> Optional[Tuple[int, int, int]]:
+    return next(((s, b, e) for k, s, b, e in _boxes(data, start, end) if k == kind), None)
+
+
+def _box(kind: bytes, body: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(body), kind) + body
+
+
+def video_track_id(init: bytes) -> Optional[int]:
+    """track_ID of the first video track in an fMP4 init section."""
+    moov = _child(init, 0, len(init), b"moov")
+    if moov is None:
+        return None
+    for kind, _, body, end in _boxes(init, moov[1], moov[2]):
+        if kind != b"trak":
+            continue
+        tkhd, mdia = _child(init, body, end, b"tkhd"), _child(init, body, end, b"mdia")
+        hdlr = _child(init, mdia[1], mdia[2], b"hdlr") if mdia else None
+        if tkhd and hdlr and init[hdlr[1] + 8:hdlr[1] + 12] == b"vide":
+            return struct.unpack_from(">I", init, tkhd[1] + (20 if init[tkhd[1]] == 1 else 12))[0]
+    return None
+
+
+def fmp4_iframe(segment: bytes, track_id: int) -> Optional[bytes]:
+    """A moof + mdat holding only the first sample of ``track_id``'s first
+    fragment in ``segment``, if that sample is a sync sample."""
+    moof = _child(segment, 0, len(segment), b"moof")
+    if moof is None:
+        return None
+    moof_start, moof_body, moof_end = moof
+    mfhd = _child(segment, moof_body, moof_end, b"mfhd")
+    for kind, _, body, end in _boxes(segment, moof_body, moof_end):
+        tfhd = _child(segment, body, end, b"tfhd") if kind == b"traf" else None
+        if tfhd is None or struct.unpack_from(">I", segment, tfhd[1] + 4)[0] != track_id:
+            continue
+        tfdt, trun = _child(segment, body, end, b"tfdt"), _child(segment, body, end, b"trun")
+        if mfhd is None or tfdt is None or trun is None:
+            return None
+
+        # tfhd: flags, track_ID, then the optional fields its flags name
+        tf_flags = int.from_bytes(segment[tfhd[1] + 1:tfhd[1] + 4], "big")
+        pos, fields = tfhd[1] + 8, {}
+        for flag, width in ((0x1, 8), (0x2, 4), (0x8, 4), (0x10, 4), (0x20, 4)):
+            if tf_flags & flag:
+                fields[flag] = segment[pos:pos + width]
+                pos += width
+        base = int.from_bytes(fields[0x1], "big") if TFHD_BASE_DATA_OFFSET in fields else moof_start
+
+        # trun: first sample only
+        version, tr_flags = segment[trun[1]], int.from_bytes(segment[trun[1] + 1:trun[1] + 4], "big")
+        if struct.unpack_from(">I", segment, trun[1] + 4)[0] < 1:
+            return None
+        pos = trun[1] + 8
+        data_offset = 0
+        if tr_flags & TRUN_DATA_OFFSET:
+            data_offset = struct.unpack_from(">i", segment, pos)[0]
+            pos += 4
+        first_flags = None
+        if tr_flags & TRUN_FIRST_SAMPLE_FLAGS:
+            first_flags = segment[pos:pos + 4]
+            pos += 4
+        sample, sample_fields = {}, b""
+        for flag in (0x100, 0x200, 0x400, 0x800):
+            if tr_flags & flag:
+                sample[flag] = segment[pos:pos + 4]
+                sample_fields += sample[flag]
+                pos += 4
+        size = sample.get(0x200) or fields.get(0x10)
+        flags = first_flags or sample.get(0x400) or fields.get(0x20)
+        if size is None or (flags is not None and int.from_bytes(flags, "big") & SAMPLE_IS_NON_SYNC):
+            return None
+        start = base + data_offset
+        payload = segment[start:start + int.from_bytes(size, "big")]
+
+        new_tfhd = _box(b"tfhd", bytes([segment[tfhd[1]]]) +
+                        ((tf_flags & ~TFHD_BASE_DATA_OFFSET) | TFHD_DEFAULT_BASE_IS_MOOF).to_bytes(3, "big") +
+                        segment[tfhd[1] + 4:tfhd[1] + 8] +
+                        b"".join(v for k, v in fields.items() if k != TFHD_BASE_DATA_OFFSET))
+
+        def build(offset: int) -> bytes:
+            trun_body = bytes([version]) + (tr_flags | TRUN_DATA_OFFSET).to_bytes(3, "big") + \
+                struct.pack(">Ii", 1, offset) + (first_flags or b"") + sample_fields
+            traf = _box(b"traf", new_tfhd + segment[tfdt[0]:tfdt[2]] + _box(b"trun", trun_body))
+            return _box(b"moof", segment[mfhd[0]:mfhd[2]] + traf)
+
+        new_moof = build(0)
+        return build(len(new_moof) + 8) + _box(b"mdat", payload)
+    return None
@@ -0,0 +1,174 @@
+"""Small helpers for reading and writing HLS playlists.
+
+Only covers what the transcode pipeline produces: VOD media playlists with a
+single AES-128 key line (fMP4 ones also with #EXT-X-MAP init sections and
+#EXT-X-BYTERANGE segments), their I-frame-only counterparts, and master
+playlists listing variant and I-frame streams.
+Writes go through a temp file + os.replace so players never see a
+half-written file.
+"""
+from __future__ import annotations
+
+import math
+import os
+import re
+from typing import Dict, List, Optional, Tuple, Union
+
+
+def write_atomic(path: str, text: str) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def parse_media_playlist(path: str) -> List[Tuple[float, str]]:
+    """Return [(duration, uri), ...] for each media segment in a playlist."""
+    entries: List[Tuple[float, str]] = []
+    pending: Optional[float] = None
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.strip()
+            if not line:
+                continue
+            if line.startswith("#EXTINF:"):
+                try:
+                    pending = float(line[len("#EXTINF:"):].split(",", 1)[0])
+                except ValueError:
+                    pending = 0.0
+                continue
+            if line.startswith("#"):
+                continue
+            entries.append((pending or 0.0, line))
+            pending = None
+    return entries
+
+
+def parse_media_maps(path: str) -> Dict[int, str]:
+    """Return {segment index: init section uri} for each #EXT-X-MAP in a playlist."""
+    maps: Dict[int, str] = {}
+    count = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.strip()
+            if line.startswith("#EXT-X-MAP:"):
+                m = re.search(r'URI="([^"]*)"', line)
+                if m:
+                    maps[count] = m.group(1)
+            elif line and not line.startswith("#"):
+                count += 1
+    return maps
+
+
+def parse_segment_sizes(path: str) -> List[int]:
+    """Bytes of each media segment: its #EXT-X-BYTERANGE length, else the size
+    of the file it names (relative to the playlist)."""
+    base = os.path.dirname(path)
+    sizes: List[int] = []
+    pending: Optional[int] = None
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.strip()
+            if line.startswith("#EXT-X-BYTERANGE:"):
+                pending = int(line[len("#EXT-X-BYTERANGE:"):].split("@", 1)[0])
+            elif line and not line.startswith("#"):
+                sizes.append(pending if pending is not None else os.path.getsize(os.path.join(base, line)))
+                pending = None
+    return sizes
+
+
+def _byterange(span: Tuple[int, int]) -> str:
+    length, offset = span
+    return f"{int(length)}@{int(offset)}"
+
+
+def render_media_playlist(entries: List[Tuple], key_line: Optional[str] = None, version: int = 6,
+                          maps: Optional[Dict[int, Union[str, Tuple[str, Tuple[int, int]]]]] = None,
+                          iframes_only: bool = False, map_keys: Optional[Dict[int, str]] = None) -> str:
+    """entries: [(duration, uri)] or, for byte-range segments, [(duration, uri, (length, offset))].
+
+    maps: {segment index: init uri or (uri, (length, offset))}; each #EXT-X-MAP
+    is written before the segment it starts applying to.
+
+    map_keys: {segment index: key line} for encrypted init sections; the line
+    is written ahead of that #EXT-X-MAP and ``key_line`` again after it, so
+    the segments keep the playlist's key.
+
+    iframes_only: tag the playlist #EXT-X-I-FRAMES-ONLY (each entry is one
+    I-frame, its duration the time until the next one).
+    """
+    target = max([int(math.ceil(e[0])) for e in entries] or [1])
+    lines = [
+        "#EXTM3U",
+        f"#EXT-X-VERSION:{version}",
+        f"#EXT-X-TARGETDURATION:{target}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+    ]
+    if iframes_only:
+        lines.append("#EXT-X-I-FRAMES-ONLY")
+    if key_line:
+        lines.append(key_line)
+    for n, entry in enumerate(entries):
+        init = (maps or {}).get(n)
+        map_key = (map_keys or {}).get(n) if init else None
+        if map_key:
+            lines.append(map_key)
+        if isinstance(init, str):
+            lines.append(f'#EXT-X-MAP:URI="{init}"')
+        elif init:
+            lines.append(f'#EXT-X-MAP:URI="{init[0]}",BYTERANGE="{_byterange(init[1])}"')
+        if map_key and key_line:
+            lines.append(key_line)
+        lines.append(f"#EXTINF:{entry[0]:.6f},")
+        if len(entry) > 2:
+            lines.append(f"#EXT-X-BYTERANGE:{_byterange(entry[2])}")
+        lines.append(entry[1])
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def render_master_playlist(streams: List[Dict], version: int = 6,
+                           media: Optional[List[Dict]] = None,
+                           iframes: Optional[List[Dict]] = None) -> str:
+    """streams: [{"uri", "bandwidth", "resolution", "codecs", "audio", ...}] in ladder order.
+
+    media: optional #EXT-X-MEDIA renditions [{"type", "group_id", "name", "uri",
+    "default", "autoselect", "channels"}]; a stream joins a group via "audio".
+
+    iframes: optional #EXT-X-I-FRAME-STREAM-INF entries [{"uri", "bandwidth",
+    "resolution", "codecs"}].
+    """
+    lines = ["#EXTM3U", f"#EXT-X-VERSION:{version}"]
+    for m in media or []:
+        attrs = [f"TYPE={m.get('type', 'AUDIO')}", f'GROUP-ID="{m["group_id"]}"', f'NAME="{m["name"]}"',
+                 f"DEFAULT={'YES' if m.get('default') else 'NO'}",
+                 f"AUTOSELECT={'YES' if m.get('autoselect') else 'NO'}"]
+        if m.get("channels"):
+            attrs.append(f'CHANNELS="{m["channels"]}"')
+        attrs.append(f'URI="{m["uri"]}"')
+        lines.append("#EXT-X-MEDIA:" + ",".join(attrs))
+    for s in streams:
+        attrs = [f"BANDWIDTH={int(s['bandwidth'])}"]
+        if s.get("average_bandwidth"):
+            attrs.append(f"AVERAGE-BANDWIDTH={int(s['average_bandwidth'])}")
+        if s.get("resolution"):
+            attrs.append(f"RESOLUTION={s['resolution']}")
+        if s.get("frame_rate"):
+            attrs.append(f"FRAME-RATE={float(s['frame_rate']):.3f}")
+        if s.get("codecs"):
+            attrs.append(f'CODECS="{s["codecs"]}"')
+        if s.get("audio"):
+            attrs.append(f'AUDIO="{s["audio"]}"')
+        lines.append("#EXT-X-STREAM-INF:" + ",".join(attrs))
+        lines.append(s["uri"])
+    for s in iframes or []:
+        attrs = [f"BANDWIDTH={int(s['bandwidth'])}"]
+        if s.get("resolution"):
+            attrs.append(f"RESOLUTION={s['resolution']}")
+        if s.get("codecs"):
+            attrs.append(f'CODECS="{s["codecs"]}"')
+        attrs.append(f'URI="{s["uri"]}"')
+        lines.append("#EXT-X-I-FRAME-STREAM-INF:" + ",".join(attrs))
+    return "\n".join(lines) + "\n"
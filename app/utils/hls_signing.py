@@ -0,0 +1,66 @@
+"""Signed, expiring HLS asset paths.
+
+The master response prefixes every URI with one path segment,
+``_s<expires>.<user>.<signature>``; players resolve the variant playlists'
+relative segment and key URIs under it, so the static playlists need no
+rewriting. The signature is an HMAC-SHA256 (truncated to 128 bits) over the
+scope, the video id, the user id and the expiry, checked in constant time with
+no database access. The scope is the route family the master was served on
+("jwt" or "public"), so a token from one is refused by the other.
+"""
+import base64
+import hashlib
+import hmac
+import time
+from typing import Optional, Tuple
+
+TOKEN_PREFIX = "_s"
+SCOPES = ("jwt", "public")
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(secret: str, scope: str, video_id: str, user: str, expires: int) -> str:
+    if scope not in SCOPES:
+        raise ValueError(f"scope must be one of {SCOPES}, got {scope!r}")
+    msg = f"{scope}\n{video_id}\n{user}\n{expires}".encode("utf-8")
+    return _b64(hmac.new(secret.encode("utf-8"), msg, hashlib.sha256).digest()[:16])
+
+
+def sign(secret: str, scope: str, video_id: str, user: Optional[str], expires: int) -> str:
+    """Path segment granting ``user`` ("" for anonymous playback) access to
+    ``video_id``'s HLS assets on the ``scope`` routes until ``expires``
+    (epoch seconds)."""
+    user = user or ""
+    return (f"{TOKEN_PREFIX}{expires}.{_b64(user.encode('utf-8'))}."
+            f"{_signature(secret, scope, video_id, user, expires)}")
+
+
+def split(asset: str) -> Tuple[Optional[str], str]:
+    """(token, rest of the path) for a signed asset path, else (None, asset)."""
+    if not asset.startswith(TOKEN_PREFIX):
+        return None, asset
+    token, _, rest = asset.partition("/")
+    return token, rest
+
+
+def verify(secret: str, scope: str, token: str, video_id: str, now: Optional[float] = None) -> Optional[str]:
+    """The user id a valid, unexpired token for ``scope`` was issued to ("" for
+    anonymous playback), or None."""
+    try:
+        expires, user, sig = token[len(TOKEN_PREFIX):].split(".")
+        expires = int(expires)
+        user = _unb64(user).decode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not hmac.compare_digest(sig, _signature(secret, scope, video_id, user, expires)):
+        return None
+    if expires < (time.time() if now is None else now):
+        return None
+    return user
@@ -0,0 +1,260 @@
+"""Single-pass ffprobe wrapper with a content-hash keyed cache.
+
+``probe_media()`` runs one ``ffprobe -show_streams -show_format`` (plus the
+keyframe flags of the first minute of packets) and returns a flat,
+JSON-serialisable summary (duration, resolution, rotation, fps, codecs,
+profile/level, bitrates, keyframe interval, stream list). When the caller knows the file's MD5 the
+result is memoised in-process and persisted in ``media_probes`` (inside an
+app context), so the same content is never probed twice.
+
+``content_hash()`` hashes the packets of the first video and audio stream
+(stream copy, no decode), so a remux into another container hashes the same.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask import has_app_context
+
+_MEMO_MAX = 256
+_memo: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _ffprobe_bin() -> str:
+    return os.environ.get("FFPROBE_BIN") or shutil.which("ffprobe") or "ffprobe"
+
+
+def _ffmpeg_bin() -> str:
+    return os.environ.get("FFMPEG_BIN") or shutil.which("ffmpeg") or "ffmpeg"
+
+
+def _to_float(v) -> Optional[float]:
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return f if f == f else None  # drop NaN
+
+
+def _to_int(v) -> Optional[int]:
+    f = _to_float(v)
+    return int(f) if f is not None else None
+
+
+def _rate(v) -> Optional[float]:
+    """ffprobe frame rates come as "30000/1001"; "0/0" means unknown."""
+    if not v:
+        return None
+    if "/" in str(v):
+        n, d = str(v).split("/", 1)
+        n, d = _to_float(n), _to_float(d)
+        return n / d if n and d else None
+    return _to_float(v) or None
+
+
+def _rotation(stream: Dict) -> int:
+    for sd in stream.get("side_data_list") or []:
+        if "rotation" in sd:
+            return int(round(_to_float(sd["rotation"]) or 0)) % 360
+    return int(round(_to_float((stream.get("tags") or {}).get("rotate")) or 0)) % 360
+
+
+# Keyframe sample window for GOP regularity (keeps the packet list small)
+KEYFRAME_SAMPLE_SECONDS = 60
+
+
+def _keyframe_stats(packets: List[Dict], stream_index, fps: Optional[float]) -> Tuple[Optional[float], bool]:
+    """(median keyframe interval in seconds, whether every interval is within a frame of it)."""
+    times = sorted(t for t in (_to_float(p.get("pts_time")) for p in packets
+                               if p.get("stream_index") == stream_index and "K" in (p.get("flags") or ""))
+                   if t is not None)
+    gaps = [b - a for a, b in zip(times, times[1:]) if b > a]
+    if not gaps:
+        return None, False
+    median = sorted(gaps)[len(gaps) // 2]
+    tolerance = (1.0 / fps) if fps else 0.05
+    # The last gap may be cut short by the sample window
+    body = gaps[:-1] or gaps
+    return round(median, 6), all(abs(g - median) <= tolerance for g in body)
+
+
+def _summarise(meta: Dict) -> Dict[str, Any]:
+    fmt = meta.get("format") or {}
+    streams = []
+    for s in meta.get("streams") or []:
+        streams.append({
+            "index": s.get("index"),
+            "codec_type": s.get("codec_type"),
+            "codec_name": s.get("codec_name"),
+            "profile": s.get("profile"),
+            "level": s.get("level"),
+            "pix_fmt": s.get("pix_fmt"),
+            "width": s.get("width"),
+            "height": s.get("height"),
+            "fps": _rate(s.get("r_frame_rate")) or _rate(s.get("avg_frame_rate")),
+            "bit_rate": _to_int(s.get("bit_rate")),
+            "channels": s.get("channels"),
+            "sample_rate": _to_int(s.get("sample_rate")),
+            "rotation": _rotation(s) if s.get("codec_type") == "video" else 0,
+        })
+    raw = {s.get("index"): s for s in meta.get("streams") or []}
+    video = next((s for s in streams if s["codec_type"] == "video"
+                  and not (raw.get(s["index"], {}).get("disposition") or {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s["codec_type"] == "audio"), None)
+
+    width = video["width"] if video else None
+    height = video["height"] if video else None
+    rotation = video["rotation"] if video else 0
+    swap = rotation in (90, 270)
+    keyframe_interval, keyframe_regular = (
+        _keyframe_stats(meta.get("packets") or [], video["index"], video["fps"]) if video else (None, False))
+    return {
+        "duration": _to_float(fmt.get("duration")),
+        "bit_rate": _to_int(fmt.get("bit_rate")),
+        "size": _to_int(fmt.get("size")),
+        "format_name": fmt.get("format_name"),
+        # Coded frame size; display_* accounts for rotation metadata
+        "width": width,
+        "height": height,
+        "display_width": height if swap else width,
+        "display_height": width if swap else height,
+        "rotation": rotation,
+        "fps": video["fps"] if video else None,
+        "video_codec": video["codec_name"] if video else None,
+        "video_profile": video["profile"] if video else None,
+        "video_level": video["level"] if video else None,
+        "pix_fmt": video["pix_fmt"] if video else None,
+        "keyframe_interval": keyframe_interval,
+        "keyframe_regular": keyframe_regular,
+        "video_bit_rate": video["bit_rate"] if video else None,
+        "has_audio": audio is not None,
+        "audio_codec": audio["codec_name"] if audio else None,
+        "audio_channels": audio["channels"] if audio else None,
+        "audio_sample_rate": audio["sample_rate"] if audio else None,
+        "audio_bit_rate": audio["bit_rate"] if audio else None,
+        "streams": streams,
+    }
+
+
+def _run_ffprobe(path: str) -> Dict[str, Any]:
+    try:
+        out = subprocess.check_output(
+            [_ffprobe_bin(), "-v", "error", "-show_streams", "-show_format",
+             "-show_entries", "packet=stream_index,pts_time,flags",
+             "-read_intervals", f"%+{KEYFRAME_SAMPLE_SECONDS}", "-of", "json", path],
+            stderr=subprocess.PIPE, text=True,
+        )
+        return _summarise(json.loads(out or "{}"))
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        detail = getattr(e, "stderr", None) or str(e)
+        raise RuntimeError(f"ffprobe failed for {path}: {str(detail).strip()}") from e
+
+
+def _remember(md5: str, info: Dict[str, Any]) -> None:
+    with _memo_lock:
+        _memo[md5] = info
+        _memo.move_to_end(md5)
+        while len(_memo) > _MEMO_MAX:
+            _memo.popitem(last=False)
+
+
+def _load(md5: str) -> Optional[Dict[str, Any]]:
+    if not has_app_context():
+        return None
+    from app.extensions import db
+    from app.models import MediaProbe
+    try:
+        row = db.session.get(MediaProbe, md5)
+        return dict(row.data) if row else None
+    except Exception:
+        db.session.rollback()
+        return None
+
+
+def _store(md5: str, info: Dict[str, Any]) -> None:
+    if not has_app_context():
+        return
+    from app.extensions import db
+    from app.models import MediaProbe
+    try:
+        db.session.merge(MediaProbe(md5=md5, data=info))
+        db.session.commit()
+    except Exception:
+        # Concurrent insert of the same hash or table not yet created; the
+        # in-process memo still holds the result.
+        db.session.rollback()
+
+
+def probe_media(path: str, md5: Optional[str] = None) -> Dict[str, Any]:
+    """Probe ``path`` once; reuse a cached result when ``md5`` is known.
+
+    Raises RuntimeError if ffprobe is missing or cannot read the file.
+    """
+    if md5:
+        with _memo_lock:
+            cached = _memo.get(md5)
+        if cached is None:
+            cached = _load(md5)
+            if cached is not None:
+                _remember(md5, cached)
+        if cached is not None:
+            return cached
+    info = _run_ffprobe(path)
+    if md5:
+        _remember(md5, info)
+        _store(md5, info)
+    return info
+
+
+
+def _check_output(cmd: List[str]) -> str:
+    return subprocess.check_output(cmd, stderr=subprocess.PIPE, text=True)
+
+
+def _run_streamhash(path: str, runner: Optional[Callable[[List[str]], str]] = None) -> str:
+    try:
+        out = (runner or _check_output)(
+            [_ffmpeg_bin(), "-v", "error", "-i", path, "-map", "0:v:0", "-map", "0:a:0?",
+             "-c", "copy", "-f", "streamhash", "-hash", "sha256", "-"])
+    except (OSError, subprocess.CalledProcessError) as e:
+        detail = getattr(e, "stderr", None) or str(e)
+        raise RuntimeError(f"ffmpeg streamhash failed for {path}: {str(detail).strip()}") from e
+    return hashlib.sha256(out.encode()).hexdigest()
+
+
+def content_hash(path: str, md5: Optional[str] = None,
+                 runner: Optional[Callable[[List[str]], str]] = None) -> str:
+    """Container-independent SHA-256 of the media in ``path``.
+
+    Cached on the file's ``media_probes`` row when ``md5`` is known and the
+    file was probed. Raises RuntimeError if ffmpeg cannot read the file.
+
+    ``runner(cmd)`` runs the ffmpeg command and returns its stdout (raising
+    CalledProcessError on failure); the transcode worker passes one that
+    applies its resource limits and lets a drain or lost lease stop it, as
+    hashing demuxes the whole source.
+    """
+    row = None
+    if md5 and has_app_context():
+        from app.extensions import db
+        from app.models import MediaProbe
+        row = db.session.get(MediaProbe, md5)
+        if row is not None and row.content_hash:
+            return row.content_hash
+    digest = _run_streamhash(path, runner)
+    if row is not None:
+        from app.extensions import db
+        try:
+            row.content_hash = digest
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+    return digest
@@ -0,0 +1,92 @@
+"""CPU/IO limits for ffmpeg jobs, so transcoding never starves the web processes.
+
+Every ffmpeg a worker starts is wrapped in ``nice``/``ionice``/``taskset``
+(each only when its binary exists and the setting is on; all three exec, so the
+tracked pid is still ffmpeg). Each job gets a thread budget: the usable cores
+(affinity set, or all cores minus the reserve for the web tier) split over the
+process's configured encode slots, so jobs started later never add threads on
+top of a budget sized for an idle worker. Idle slots hold off claiming work while the load
+average is above the configured ceiling.
+"""
+import logging
+import os
+import shutil
+from typing import Iterable, List, Mapping, Optional
+
+logger = logging.getLogger('tasks')
+
+IONICE_CLASSES = {"best-effort": "2", "idle": "3"}
+
+
+def parse_cpu_list(spec) -> Optional[List[int]]:
+    """"0-3,6" -> [0, 1, 2, 3, 6]; empty -> None (no pinning)."""
+    cpus = set()
+    for part in str(spec or "").replace(" ", "").split(","):
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        cpus.update(range(int(lo), int(hi or lo) + 1))
+    return sorted(cpus) or None
+
+
+class ResourceGovernor:
+    def __init__(self, reserved_cpus: int = 1, nice: int = 10, ionice_class: Optional[str] = "best-effort",
+                 ionice_level: int = 7, cpus: Optional[Iterable[int]] = None, max_load: float = 1.0,
+                 cpu_count: Optional[int] = None):
+        if ionice_class and ionice_class not in IONICE_CLASSES:
+            raise ValueError(f"ionice class must be one of {sorted(IONICE_CLASSES)}, got {ionice_class!r}")
+        self.reserved_cpus = max(0, int(reserved_cpus))
+        self.nice = max(0, min(19, int(nice)))
+        self.ionice_class = ionice_class or None
+        self.ionice_level = max(0, min(7, int(ionice_level)))
+        self.cpus = sorted(set(cpus)) if cpus else None
+        self.max_load = max(0.0, float(max_load))
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> "ResourceGovernor":
+        ionice = str(config.get("TRANSCODE_IONICE_CLASS", "best-effort")).strip().lower()
+        return cls(
+            reserved_cpus=int(config.get("TRANSCODE_RESERVED_CPUS", 1)),
+            nice=int(config.get("TRANSCODE_NICE", 10)),
+            ionice_class=None if ionice in ("", "none", "off") else ionice,
+            ionice_level=int(config.get("TRANSCODE_IONICE_LEVEL", 7)),
+            cpus=parse_cpu_list(config.get("TRANSCODE_CPU_AFFINITY", "")),
+            max_load=float(config.get("TRANSCODE_MAX_LOAD", 1.0)),
+        )
+
+    @property
+    def usable_cpus(self) -> int:
+        """Cores encodes may use: the affinity set, else every core but the reserve."""
+        if self.cpus:
+            return len(self.cpus)
+        return max(1, self.cpu_count - self.reserved_cpus)
+
+    def thread_budget(self, slots: int) -> int:
+        """Threads for one job of a process running up to ``slots`` jobs at once."""
+        return max(1, self.usable_cpus // max(1, int(slots)))
+
+    def wrap(self, cmd: List[str]) -> List[str]:
+        """Prefix ``cmd`` with the priority and affinity launchers."""
+        prefix: List[str] = []
+        if self.nice and shutil.which("nice"):
+            prefix += ["nice", "-n", str(self.nice)]
+        if self.ionice_class and shutil.which("ionice"):
+            prefix += ["ionice", "-c", IONICE_CLASSES[self.ionice_class]]
+            if self.ionice_class == "best-effort":
+                prefix += ["-n", str(self.ionice_level)]
+        if self.cpus and shutil.which("taskset"):
+            prefix += ["taskset", "-c", ",".join(str(c) for c in self.cpus)]
+        return prefix + list(cmd)
+
+    def overloaded(self, busy_jobs: int) -> bool:
+        """True when another job should not start: this process is already
+        encoding and the 1-minute load average is above max_load per core.
+        A process with nothing running always admits one job so the queue moves."""
+        if not self.max_load or busy_jobs <= 0:
+            return False
+        try:
+            load = os.getloadavg()[0]
+        except (AttributeError, OSError):
+            return False
+        return load > self.max_load * self.cpu_count
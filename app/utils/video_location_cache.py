@@ -0,0 +1,55 @@
+"""In-process LRU/TTL cache of where a video's HLS output lives.
+
+The streaming routes look a video up on every master, playlist, key and
+segment request; this keeps what they need (resolved output directory,
+status, duration) per video id so steady-state serving does no SQL. Writers
+that change a video's status or file_path invalidate its entry; other
+processes see the change once their entry's TTL lapses.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+
+class VideoLocation(NamedTuple):
+    base_dir: Optional[str]     # realpath of the master's directory (None: not encoded yet)
+    master: Optional[str]       # master playlist file name
+    status: object              # VideoStatus
+    published: bool             # playable on the public routes
+    duration: float
+
+
+_LOCK = threading.Lock()
+_ENTRIES: "OrderedDict[str, Tuple[float, VideoLocation]]" = OrderedDict()
+
+
+def get(video_id: str, ttl: float) -> Optional[VideoLocation]:
+    with _LOCK:
+        entry = _ENTRIES.get(video_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= ttl:
+            del _ENTRIES[video_id]
+            return None
+        _ENTRIES.move_to_end(video_id)
+        return entry[1]
+
+
+def put(video_id: str, location: VideoLocation, max_entries: int) -> None:
+    with _LOCK:
+        _ENTRIES[video_id] = (time.monotonic(), location)
+        _ENTRIES.move_to_end(video_id)
+        while len(_ENTRIES) > max(1, max_entries):
+            _ENTRIES.popitem(last=False)
+
+
+def invalidate(video_id: Optional[str] = None) -> None:
+    """Drop one video's entry, or all entries."""
+    with _LOCK:
+        if video_id is None:
+            _ENTRIES.clear()
+        else:
+            _ENTRIES.pop(str(video_id), None)
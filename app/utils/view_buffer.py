@@ -0,0 +1,134 @@
+"""Buffered view counting.
+
+Plays are recorded in a per-process buffer and written every
+VIEW_BUFFER_SECONDS as one ``UPDATE videos SET views = views + n`` per video
+plus one multi-row insert of view events. Increments are relative, so any
+number of processes can flush their own buffers concurrently without losing
+counts. The buffer is also flushed when it holds VIEW_BUFFER_MAX_PENDING
+events and at interpreter exit; a hard kill loses at most one interval.
+
+VIEW_BUFFER_SECONDS = 0 writes every view through immediately.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List
+
+from sqlalchemy import bindparam, func
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+MAX_RETAINED_EVENTS = 100_000    # kept across failed flushes; older events are dropped
+
+_LOCK = threading.Lock()
+_COUNTS: Counter = Counter()
+_EVENTS: List[dict] = []
+_STATE = {"app": None, "pid": None, "stop": threading.Event()}
+
+
+def record(video_id: str, user_id=None) -> None:
+    """Count one play of ``video_id``, with a view event when ``user_id`` is
+    known (a UUID, see security_utils.coerce_uuid)."""
+    from flask import current_app
+    with _LOCK:
+        _COUNTS[video_id] += 1
+        if user_id is not None:
+            _EVENTS.append({"user_id": user_id, "video_id": video_id,
+                            "created_at": datetime.now(timezone.utc).replace(tzinfo=None)})
+        buffered = len(_EVENTS) + len(_COUNTS)
+    interval = float(current_app.config.get("VIEW_BUFFER_SECONDS", 5))
+    if interval <= 0 or buffered >= int(current_app.config.get("VIEW_BUFFER_MAX_PENDING", 1000)):
+        flush()
+    elif not current_app.config.get("TESTING"):
+        # Unit tests call flush() themselves
+        _ensure_flusher(current_app._get_current_object(), interval)
+
+
+def _write(counts: dict, events: List[dict]) -> None:
+    # Own transaction: a flush from record() runs inside a request whose
+    # session may hold unrelated pending work
+    from app.models import Video
+    from app.models.video import VideoViewEvent
+    videos = Video.__table__
+    with db.engine.begin() as conn:
+        conn.execute(videos.update()
+                     .where(videos.c.uuid == bindparam("vid"))
+                     .values(views=func.coalesce(videos.c.views, 0) + bindparam("n")),
+                     [{"vid": vid, "n": n} for vid, n in counts.items()])
+        if events:
+            conn.execute(VideoViewEvent.__table__.insert(), events)
+
+
+def flush() -> int:
+    """Write buffered views; returns the number of plays written. Needs an
+    app context. If the database is unavailable the views go back into the
+    buffer; events it rejects (e.g. a deleted user) are dropped so they do
+    not block the counts."""
+    with _LOCK:
+        counts, events = dict(_COUNTS), list(_EVENTS)
+        _COUNTS.clear()
+        _EVENTS.clear()
+    if not counts:
+        return 0
+    try:
+        _write(counts, events)
+    except Exception:
+        try:
+            if not events:
+                raise
+            _write(counts, [])
+            logger.warning("Dropped %d view event(s) the database rejected", len(events), exc_info=True)
+        except Exception:
+            with _LOCK:
+                _COUNTS.update(counts)
+                _EVENTS[:0] = events
+                del _EVENTS[:-MAX_RETAINED_EVENTS]
+            logger.warning("View flush failed; %d play(s) kept for the next attempt", sum(counts.values()),
+                           exc_info=True)
+            return 0
+    return sum(counts.values())
+
+
+def pending() -> int:
+    with _LOCK:
+        return sum(_COUNTS.values())
+
+
+def _flush_loop(app, interval: float, stop: threading.Event) -> None:
+    while not stop.wait(interval):
+        try:
+            with app.app_context():
+                flush()
+        except Exception:
+            logger.warning("View flush failed", exc_info=True)
+
+
+def _flush_at_exit() -> None:
+    app = _STATE["app"]
+    if app is None or _STATE["pid"] != os.getpid():
+        return
+    _STATE["stop"].set()
+    with app.app_context():
+        flush()
+
+
+def _ensure_flusher(app, interval: float) -> None:
+    # One thread per process; started on first use so forked workers get their own
+    if _STATE["pid"] == os.getpid():
+        return
+    with _LOCK:
+        if _STATE["pid"] == os.getpid():
+            return
+        _STATE["app"], _STATE["pid"], _STATE["stop"] = app, os.getpid(), threading.Event()
+    threading.Thread(target=_flush_loop, args=(app, interval, _STATE["stop"]),
+                     name="view-flush", daemon=True).start()
+
+
+atexit.register(_flush_at_exit)
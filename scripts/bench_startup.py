@@ -0,0 +1,134 @@
+"""Startup latency of uniform vs short-startup HLS segmentation.
+
+Usage (from the repo root, ffmpeg/ffprobe on PATH):
+    python scripts/bench_startup.py INPUT [--segment 6] [--startup-segment 2]
+        [--startup-seconds 6] [--mbps 5] [--rtt-ms 80] [--keep]
+
+Encodes INPUT three ways (4s segments, --segment seconds, and --segment with
+the first --startup-seconds cut into --startup-segment pieces), serves each
+output over a local HTTP server throttled to --mbps with --rtt-ms added per
+request, and times what a player does before its first frame: master
+playlist, the highest variant that fits 80% of the link, its media playlist,
+the key, the init section (fMP4) and the first segment. Also prints the
+segment requests per minute of playback.
+
+Outputs go to app/static/hls_output/bench-startup-* and are removed
+afterwards unless --keep is given.
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.tasks import convert_to_hls  # noqa: E402
+
+
+class _Throttled(SimpleHTTPRequestHandler):
+    """Static files with Range support, a fixed per-request delay and a rate cap."""
+    rtt = 0.0
+    rate = 0.0    # bytes/s, 0 = unlimited
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        status = 200
+        m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if m:
+            start = int(m.group(1))
+            end = int(m.group(2)) if m.group(2) else len(data) - 1
+            data, status = data[start:end + 1], 206
+        time.sleep(self.rtt)
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        for pos in range(0, len(data), 16384):
+            chunk = data[pos:pos + 16384]
+            self.wfile.write(chunk)
+            if self.rate:
+                time.sleep(len(chunk) / self.rate)
+
+
+def _fetch(url: str, byterange: str = None) -> bytes:
+    req = urllib.request.Request(url)
+    if byterange:
+        length, offset = (int(x) for x in byterange.split("@"))
+        req.add_header("Range", f"bytes={offset}-{offset + length - 1}")
+    with urllib.request.urlopen(req) as r:
+        return r.read()
+
+
+def _startup(base: str, mbps: float) -> dict:
+    """Replay a player's startup requests; returns the chosen rung and timings."""
+    t0 = time.monotonic()
+    master = _fetch(base + "master.m3u8").decode()
+    variants = re.findall(r"BANDWIDTH=(\d+)[^\n]*\n([^\n#]+)", master)
+    fitting = [v for v in variants if int(v[0]) <= mbps * 1e6 * 0.8]
+    bandwidth, uri = max(fitting or [min(variants, key=lambda v: int(v[0]))], key=lambda v: int(v[0]))
+    rung_base = base + uri.rsplit("/", 1)[0] + "/"
+    playlist = _fetch(base + uri).decode()
+    key = re.search(r'#EXT-X-KEY:[^\n]*URI="([^"]+)"', playlist)
+    if key:
+        _fetch(rung_base + key.group(1))
+    init = re.search(r'#EXT-X-MAP:URI="([^"]+)"(?:,BYTERANGE="([^"]+)")?', playlist)
+    if init:
+        _fetch(rung_base + init.group(1), init.group(2))
+    first = re.search(r"#EXTINF:([\d.]+),\n(?:#EXT-X-BYTERANGE:(\S+)\n)?([^\n#]+)", playlist)
+    size = len(_fetch(rung_base + first.group(3), first.group(2)))
+    durations = [float(d) for d in re.findall(r"#EXTINF:([\d.]+),", playlist)]
+    return {"rung": uri.split("/", 1)[0], "first_bytes": size, "first_seconds": float(first.group(1)),
+            "startup": time.monotonic() - t0, "per_minute": 60 * len(durations) / sum(durations)}
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    p.add_argument("input")
+    p.add_argument("--segment", type=int, default=6)
+    p.add_argument("--startup-segment", type=float, default=2.0)
+    p.add_argument("--startup-seconds", type=float, default=6.0)
+    p.add_argument("--mbps", type=float, default=5.0)
+    p.add_argument("--rtt-ms", type=float, default=80.0)
+    p.add_argument("--keep", action="store_true")
+    args = p.parse_args()
+
+    root = os.path.join("app", "static", "hls_output")
+    _Throttled.rtt = args.rtt_ms / 1000
+    _Throttled.rate = args.mbps * 1e6 / 8
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_Throttled, directory=root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    runs = [("4s", {"segment_time": 4}),
+            (f"{args.segment}s", {"segment_time": args.segment}),
+            (f"{args.segment}s+{args.startup_segment:g}s",
+             {"segment_time": args.segment, "startup_segment_time": args.startup_segment,
+              "startup_seconds": args.startup_seconds})]
+    print(f"Input: {args.input} | link: {args.mbps:g} Mbit/s, {args.rtt_ms:g} ms per request")
+    print(f"{'segments':14s} {'rung':6s} {'first seg':>14s} {'startup':>9s} {'segs/min':>9s}")
+    try:
+        for label, kwargs in runs:
+            video_id = f"bench-startup-{uuid.uuid4().hex[:8]}"
+            master = convert_to_hls(args.input, video_id, trickplay_interval=None, **kwargs)
+            try:
+                r = _startup(f"http://127.0.0.1:{server.server_port}/{video_id}/", args.mbps)
+            finally:
+                if not args.keep:
+                    shutil.rmtree(os.path.dirname(master), ignore_errors=True)
+            first = f"{r['first_bytes'] / 1024:.0f} KiB/{r['first_seconds']:g}s"
+            print(f"{label:14s} {r['rung']:6s} {first:>14s} {r['startup']:8.2f}s {r['per_minute']:9.1f}")
+    finally:
+        server.shutdown()
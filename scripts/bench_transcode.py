@@ -0,0 +1,44 @@
+"""Wall-clock comparison of single-process vs chunked HLS encoding.
+
+Usage (from the repo root, ffmpeg/ffprobe on PATH):
+    python scripts/bench_transcode.py INPUT [chunk_seconds] [parallelism] [--keep]
+
+Outputs go to app/static/hls_output/bench-single-* and bench-chunked-* and
+are removed afterwards unless --keep is given.
+"""
+import os
+import sys
+import time
+import shutil
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.tasks import convert_to_hls  # noqa: E402
+
+
+def _run(label: str, input_file: str, keep: bool, **kwargs) -> float:
+    video_id = f"bench-{label}-{uuid.uuid4().hex[:8]}"
+    start = time.monotonic()
+    master = convert_to_hls(input_file, video_id, **kwargs)
+    elapsed = time.monotonic() - start
+    print(f"{label:8s} {elapsed:8.1f}s  -> {master}")
+    if not keep:
+        shutil.rmtree(os.path.dirname(master), ignore_errors=True)
+    return elapsed
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != "--keep"]
+    keep = "--keep" in sys.argv[1:]
+    if not args:
+        print(__doc__)
+        sys.exit(2)
+    src = args[0]
+    chunk = int(args[1]) if len(args) > 1 else 120
+    par = int(args[2]) if len(args) > 2 else None
+
+    print(f"Input: {src} | cpus: {os.cpu_count()} | chunk: {chunk}s | parallelism: {par or 'auto'}")
+    single = _run("single", src, keep)
+    chunked = _run("chunked", src, keep, chunked=True, chunk_seconds=chunk, parallelism=par)
+    print(f"speedup: {single / chunked:.2f}x")
@@ -4,11 +4,12 @@ set -euo pipefail
 PROJECT_ROOT="$(cd "$(dirname "$0")/.." && pwd)"
 VENV_DIR="$PROJECT_ROOT/env"
 PY="$VENV_DIR/bin/python"
-MODE="${MODE:-dev}" # dev | prod | gunicorn
+MODE="${MODE:-dev}" # dev | prod | gunicorn | worker
 HOST="${HOST:-0.0.0.0}"
 PORT="${PORT:-5000}"
 WORKERS="${WORKERS:-4}"
 LOG_LEVEL="${LOG_LEVEL:-info}"
+SLOTS="${SLOTS:-${HLS_WORKER_SLOTS:-1}}"
 APP_MODULE="run:my_app"
 
 if [ ! -x "$PY" ]; then
@@ -36,7 +37,11 @@ elif [ "$MODE" = "prod" ]; then
 elif [ "$MODE" = "gunicorn" ]; then
   echo "[run] Starting explicit gunicorn module=$APP_MODULE"
   exec "$VENV_DIR/bin/gunicorn" -w "$WORKERS" -b "$HOST:$PORT" --log-level "$LOG_LEVEL" "$APP_MODULE"
+elif [ "$MODE" = "worker" ]; then
+  echo "[run] Starting standalone HLS worker with slots=$SLOTS"
+  export HLS_WORKER_EMBEDDED=false
+  exec "$VENV_DIR/bin/flask" hls-worker --slots "$SLOTS"
 else
-  echo "[run] Unknown MODE=$MODE (expected dev|prod|gunicorn)" >&2
+  echo "[run] Unknown MODE=$MODE (expected dev|prod|gunicorn|worker)" >&2
   exit 3
 fi
@@ -0,0 +1,327 @@
+from app import tasks
+from app.utils import hls_iframes, hls_playlists
+
+
+def test_chunk_windows_cover_source_and_fold_short_tail():
+    assert tasks._chunk_windows(250.0, 120) == [(0.0, 120), (120.0, 130.0)]
+    w = tasks._chunk_windows(300.0, 120)
+    assert w == [(0.0, 120), (120.0, 120), (240.0, 60.0)]
+    assert sum(length for _, length in w) == 300.0
+
+
+def test_media_playlist_round_trip(tmp_path):
+    entries = [(4.0, "segments/segment_000000.ts"), (3.2, "segments/segment_000001.ts")]
+    key = '#EXT-X-KEY:METHOD=AES-128,URI="../keys/enc.key"'
+    text = hls_playlists.render_media_playlist(entries, key_line=key)
+    assert "#EXT-X-TARGETDURATION:4" in text and text.rstrip().endswith("#EXT-X-ENDLIST")
+    p = tmp_path / "v.m3u8"
+    hls_playlists.write_atomic(str(p), text)
+    assert hls_playlists.parse_media_playlist(str(p)) == entries
+
+
+def test_shared_audio_group_args_and_master():
+    variants = tasks._select_variants(1280, 720)
+    args, parts = tasks._ladder_encode_args(variants, True, 120, audio_kbps=[64, 128])
+    assert parts == ['v:0', 'v:1', 'v:2', 'a:0', 'a:1']
+    assert args.count('0:a:0') == 2 and '0:a:0?' not in args
+
+    streams = tasks._nominal_stream_info(variants, True, [64, 128])
+    assert [s['audio'] for s in streams] == ['aud128', 'aud128', 'aud64']
+    text = hls_playlists.render_master_playlist(streams, media=tasks._audio_media([64, 128]))
+    assert text.count('#EXT-X-MEDIA:TYPE=AUDIO') == 2
+    assert 'AUDIO="aud64"' in text and 'URI="audio_128k/audio_128k.m3u8"' in text
+
+
+def test_audio_bitrates_config():
+    assert tasks._audio_bitrates({"TRANSCODE_AUDIO_GROUP": False}) is None
+    assert tasks._audio_bitrates({"TRANSCODE_AUDIO_GROUP": True, "TRANSCODE_AUDIO_BITRATES": "128, 64,192"}) == [64, 128]
+
+
+COPYABLE_720P = {"video_codec": "h264", "video_profile": "High", "video_level": 31, "pix_fmt": "yuv420p",
+                 "rotation": 0, "width": 1280, "height": 720, "keyframe_interval": 2.0,
+                 "keyframe_regular": True, "video_bit_rate": 2_500_000}
+
+
+def test_stream_copy_rung_detection():
+    variants = tasks._select_variants(1280, 720)
+    rung = tasks._stream_copy_rung(COPYABLE_720P, variants, 4)
+    assert rung["name"] == "720p" and rung["copy"] and rung["bitrate"] == 2500
+    for change in ({"video_profile": "Main"}, {"video_level": 42}, {"pix_fmt": "yuv420p10le"},
+                   {"keyframe_interval": 3.0}, {"keyframe_regular": False}, {"width": 1280, "height": 704},
+                   {"video_bit_rate": 9_000_000}, {"rotation": 90}):
+        assert tasks._stream_copy_rung({**COPYABLE_720P, **change}, variants, 4) is None
+
+
+def test_stream_copy_args_skip_filter_branch():
+    variants = tasks._select_variants(1280, 720)
+    variants[0] = tasks._stream_copy_rung(COPYABLE_720P, variants, 4)
+    args, parts = tasks._ladder_encode_args(variants, True, 120)
+    graph = args[args.index("-filter_complex") + 1]
+    assert graph.startswith("[0:v]split=2[v1][v2]") and "[v0s]" not in graph
+    assert args[args.index("0:v:0"):args.index("0:v:0") + 3] == ["0:v:0", "-c:v:0", "copy"]
+    assert parts == ["v:0,a:0", "v:1,a:1", "v:2,a:2"]
+
+    only_copy, _ = tasks._ladder_encode_args(variants[:1], False, 120)
+    assert "-filter_complex" not in only_copy
+
+
+def test_master_uses_copied_rung_bitrate(tmp_path):
+    for name in ("720p", "480p"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / f"{name}.m3u8").write_text("#EXTM3U\n")
+    tasks._write_rung_meta(str(tmp_path / "720p"), {**tasks.HLS_LADDER[3], "bitrate": 1000, "copy": True})
+    tasks._write_rung_meta(str(tmp_path / "480p"), tasks.HLS_LADDER[4])
+    assert not (tmp_path / "480p" / tasks.RUNG_META).exists()
+    with open(tasks._publish_master(str(tmp_path), False)) as f:
+        text = f.read()
+    assert f"BANDWIDTH={int(1400 * 1000 * 1.1)}," in text
+
+
+def test_content_aware_ladder_shape():
+    variants = tasks._select_variants(1920, 1080)   # 1080p, 720p, 480p, 360p
+    # Static footage: 1080p barely needs more bits than 720p -> dropped; cheap rates
+    ladder = tasks._shape_ladder(variants, [1100, 1000, 500, 250])
+    assert [v["name"] for v in ladder] == ["720p", "480p", "360p"]
+    assert [v["bitrate"] for v in ladder] == [1200, 600, 300]
+    # High motion: every rung kept, capped at 1.25x the fixed ladder
+    ladder = tasks._shape_ladder(variants, [9000, 4000, 2000, 900])
+    assert [v["bitrate"] for v in ladder] == [6250, 3750, 1875, 1000]
+    assert tasks._analysis_offsets(100.0, 3, 4) == [23.0, 48.0, 73.0]
+    assert tasks._analysis_offsets(8.0, 3, 4) == [0.0]
+
+
+def test_trickplay_vtt_cues_map_to_sprite_cells():
+    vtt = tasks._trickplay_vtt([(0.0, 25.0, "sprite_")], 10, (160, 90))
+    assert vtt.startswith("WEBVTT")
+    assert "00:00:20.000 --> 00:00:25.000\nsprite_000.jpg#xywh=320,0,160,90" in vtt
+    # Chunked: each slice numbers its own sheets; 101st tile starts a new sheet
+    vtt = tasks._trickplay_vtt([(0.0, 1010.0, "sprite_000_"), (1010.0, 20.0, "sprite_001_")], 10, (160, 90))
+    assert "00:16:40.000 --> 00:16:50.000\nsprite_000_001.jpg#xywh=0,0,160,90" in vtt
+    assert "00:16:50.000 --> 00:17:00.000\nsprite_001_000.jpg#xywh=0,0,160,90" in vtt
+
+
+def test_previews_share_the_ladder_decode():
+    previews = {"poster": "thumbs/v.jpg", "poster_at": 1.0, "interval": 10.0,
+                "tile": tasks._tile_size({"display_width": 1080, "display_height": 1920}), "dir": "out/trickplay"}
+    assert previews["tile"] == (160, 284)
+    filters, outputs = tasks._preview_args(previews, "sprite_", with_poster=True)
+    args, _ = tasks._ladder_encode_args(tasks._select_variants(1280, 720), True, 120, extra_filters=filters)
+    graph = args[args.index("-filter_complex") + 1]
+    assert "[0:v]trim=start=1.000[poster]" in graph and "tile=10x10[sprite]" in graph
+    assert outputs[-1] == "out/trickplay/sprite_%03d.jpg" and "thumbs/v.jpg.tmp.jpg" in outputs
+    _, outputs = tasks._preview_args(previews, "sprite_001_", with_poster=False)
+    assert "[poster]" not in outputs
+
+
+def _event_run(run_dir, output, first, count, partial=False):
+    seg_dir = run_dir / str(output) / "segments"
+    seg_dir.mkdir(parents=True, exist_ok=True)
+    lines = ["#EXTM3U", "#EXT-X-PLAYLIST-TYPE:EVENT", "#EXT-X-TARGETDURATION:4",
+             f"#EXT-X-MEDIA-SEQUENCE:{first}", tasks.KEY_LINE]
+    for n in range(first, first + count):
+        (seg_dir / f"segment_{n:06d}.ts").write_bytes(b"ts")
+        lines += ["#EXTINF:4.000000,", f"segments/segment_{n:06d}.ts"]
+    if partial:   # ffmpeg was killed while writing the next segment
+        (seg_dir / f"segment_{first + count:06d}.ts.tmp").write_bytes(b"t")
+    (run_dir / str(output) / "index.m3u8").write_text("\n".join(lines) + "\n")
+
+
+def test_consolidate_runs_keeps_complete_segments_of_every_output(tmp_path):
+    _event_run(tmp_path, 0, 0, 3, partial=True)
+    _event_run(tmp_path, 1, 0, 2, partial=True)        # lagging output caps the resume point
+    assert tasks._consolidate_runs(str(tmp_path), 2) == (2, 8.0)
+    assert sorted(p.name for p in (tmp_path / "0" / "segments").iterdir()) == \
+        ["segment_000000.ts", "segment_000001.ts"]
+    text = (tmp_path / "0" / "index.m3u8").read_text()
+    assert text.rstrip().endswith("#EXT-X-ENDLIST") and "segment_000002" not in text
+
+    # A resumed run continues the numbering and is folded back into <i>/segments
+    for i in range(2):
+        _event_run(tmp_path / ".resume-000002", i, 2, 2)
+    assert tasks._consolidate_runs(str(tmp_path), 2) == (4, 16.0)
+    assert not (tmp_path / ".resume-000002").exists()
+    assert hls_playlists.parse_media_playlist(str(tmp_path / "1" / "index.m3u8"))[-1] == \
+        (4.0, "segments/segment_000003.ts")
+
+
+def test_checkpoint_requires_same_fingerprint_and_key(tmp_path):
+    src = tmp_path / "in.mp4"
+    src.write_bytes(b"x" * 10)
+    fp = tasks._resume_fingerprint(str(src), 4, ["720p"])
+    assert fp != tasks._resume_fingerprint(str(src), 6, ["720p"])
+    key = b"k" * 16
+    tasks._save_checkpoint(str(tmp_path), {"fingerprint": fp, "key": tasks.hashlib.sha256(key).hexdigest()})
+    assert tasks._load_checkpoint(str(tmp_path), fp, key)["fingerprint"] == fp
+    assert tasks._load_checkpoint(str(tmp_path), fp, b"n" * 16) is None
+    assert tasks._load_checkpoint(str(tmp_path), "other", key) is None
+    assert tasks._load_checkpoint(str(tmp_path), fp, None) is None
+
+
+def _box(kind, body):
+    return (8 + len(body)).to_bytes(4, "big") + kind + body
+
+
+def _init(stsd, duration):
+    stbl = _box(b"stbl", _box(b"stsd", stsd))
+    trak = _box(b"trak", _box(b"mdia", _box(b"mdhd", duration) + _box(b"minf", stbl)))
+    return _box(b"ftyp", b"iso6") + _box(b"moov", trak)
+
+
+def test_pack_fmp4_byte_ranges_decrypt(tmp_path):
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    seg_dir = tmp_path / "segments"
+    seg_dir.mkdir()
+    inits = {0: _init(b"avc1", b"\x00" * 4), 1: _init(b"avc1", b"\x01" * 4), 2: _init(b"hvc1", b"\x00" * 4)}
+    for n, data in inits.items():
+        (seg_dir / f"init_{n:06d}.mp4").write_bytes(data)
+    frags = [b"moof-%d" % n * (n + 3) for n in range(3)]
+    for n, data in enumerate(frags):
+        (seg_dir / f"segment_{n:06d}.m4s").write_bytes(data)
+    entries = [(4.0, f"segments/segment_{n:06d}.m4s") for n in range(3)]
+    maps = {n: f"segments/init_{n:06d}.mp4" for n in inits}
+    (tmp_path / "720p.m3u8").write_text(hls_playlists.render_media_playlist(entries, maps=maps))
+    assert hls_playlists.parse_media_maps(str(tmp_path / "720p.m3u8")) == maps
+
+    key = bytes(range(16))
+    tasks._pack_fmp4(str(tmp_path), "720p", key)
+    assert not seg_dir.exists()
+    text = (tmp_path / "720p.m3u8").read_text()
+    assert text.index("#EXT-X-KEY") < text.index("#EXT-X-MAP")
+    # The second init only differs in durations and is dropped; the codec change is kept
+    assert text.count("#EXT-X-MAP") == 2 and "#EXT-X-BYTERANGE" in text
+
+    packed = (tmp_path / "720p.mp4").read_bytes()
+
+    def decrypt(span, iv):
+        length, offset = (int(x) for x in span.split("@"))
+        dec = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+        unpadder = padding.PKCS7(128).unpadder()
+        data = dec.update(packed[offset:offset + length]) + dec.finalize()
+        return unpadder.update(data) + unpadder.finalize()
+
+    # Fragments decrypt under their sequence number, inits under the IV of
+    # the key line just above their #EXT-X-MAP
+    lines = text.splitlines()
+    ranges = [line.split(":", 1)[1] for line in lines if line.startswith("#EXT-X-BYTERANGE")]
+    assert [decrypt(r, n.to_bytes(16, "big")) for n, r in enumerate(ranges)] == frags
+    map_ivs = [bytes.fromhex(lines[i - 1].split("IV=0x")[1]) for i, line in enumerate(lines)
+               if line.startswith("#EXT-X-MAP")]
+    assert len(set(map_ivs)) == 2
+    map_ranges = [line.split('BYTERANGE="')[1].rstrip('"') for line in lines
+                  if line.startswith("#EXT-X-MAP")]
+    assert [decrypt(r, iv) for r, iv in zip(map_ranges, map_ivs)] == [inits[0], inits[2]]
+    first_map = next(i for i, line in enumerate(lines) if line.startswith("#EXT-X-MAP"))
+    assert lines[first_map + 1] == tasks.KEY_LINE     # segments are back on the playlist key
+    assert sum(int(r.split("@")[0]) for r in ranges + map_ranges) == len(packed)
+
+
+def test_startup_plan_keeps_steady_grid():
+    assert tasks._startup_plan(6, 2, 6) == (2.0, 3)
+    assert tasks._startup_plan(6, 1.5, 4) == (1.5, 4)    # window rounded up to one 6s segment
+    assert tasks._startup_plan(4, 2, 10) == (2.0, 6)
+    assert tasks._startup_plan(6, None, 6) is None and tasks._startup_plan(4, 4, 6) is None
+
+    plan = (2.0, 3)
+    assert tasks._startup_keyframes(plan, 0.0) == [2.0, 4.0, 6.0]
+    # A resumed run or later slice only forces the boundaries ahead of it
+    assert tasks._startup_keyframes(plan, 2.0) == [2.0, 4.0]
+    assert tasks._startup_keyframes(plan, 6.0) == []
+    assert tasks._hls_time(6, plan, [2.0]) == "2.000" and tasks._hls_time(6, plan, []) == "6"
+    # Chunk numbering (and so their IVs) continues across the window
+    assert [tasks._segment_index_at(t, 6, plan) for t in (0.0, 4.0, 6.0, 12.0, 126.0)] == [0, 2, 3, 4, 23]
+    assert tasks._segment_index_at(120.0, 6, None) == 20
+
+    variants = tasks._select_variants(1280, 720)
+    args, _ = tasks._ladder_encode_args(variants, True, 180, keyframes=[2.0, 4.0, 6.0])
+    assert args.count("-force_key_frames:v:0") == 1 and "2.000,4.000,6.000" in args
+    assert tasks._output_settings({"segment_time": 6, "startup_segment_time": 2, "startup_seconds": 6})[
+        "startup"] == [2.0, 3]
+    assert "startup" not in tasks._output_settings({})
+
+
+def _ts_packet(pid, payload, start=False, rai=False):
+    if rai:
+        header = bytes([0x47, (0x40 if start else 0) | pid >> 8, pid & 0xFF, 0x30, 1, 0x40])
+    else:
+        header = bytes([0x47, (0x40 if start else 0) | pid >> 8, pid & 0xFF, 0x10])
+    return (header + payload).ljust(188, b"\xff")
+
+
+def test_ts_iframe_keeps_tables_and_first_pes():
+    pat = _ts_packet(0, bytes([0, 0x00, 0xB0, 13, 0, 1, 0xC1, 0, 0, 0, 1, 0xF0, 0x00]) + b"crc!", start=True)
+    pmt = _ts_packet(0x1000, bytes([0, 0x02, 0xB0, 23, 0, 1, 0xC1, 0, 0, 0xE1, 0x00, 0xF0, 0x00,
+                                    0x0F, 0xE1, 0x01, 0xF0, 0x00, 0x1B, 0xE1, 0x00, 0xF0, 0x00]) + b"crc!",
+                     start=True)
+    idr = [_ts_packet(0x100, b"idr0", start=True, rai=True), _ts_packet(0x101, b"aac"),
+           _ts_packet(0x100, b"idr1")]
+    segment = pat + pmt + b"".join(idr) + _ts_packet(0x100, b"p", start=True)
+    assert hls_iframes.ts_iframe(segment) == pat + pmt + idr[0] + idr[2]
+    assert hls_iframes.ts_iframe(pat + pmt + _ts_packet(0x100, b"p", start=True)) is None
+
+
+def test_fmp4_iframe_cuts_first_video_sample():
+    import struct
+    box = hls_iframes._box
+    mfhd = box(b"mfhd", bytes(4) + struct.pack(">I", 7))
+    tfhd = box(b"tfhd", bytes([0, 2, 0, 0]) + struct.pack(">I", 1))
+    tfdt = box(b"tfdt", bytes([1, 0, 0, 0]) + struct.pack(">Q", 90000))
+
+    def fragment(first_flags):
+        trun = box(b"trun", bytes([0, 0, 0x02, 0x05]) + struct.pack(">IiI", 2, 0, first_flags) +
+                   struct.pack(">II", 5, 3))
+        moof = box(b"moof", mfhd + box(b"traf", tfhd + tfdt + trun))
+        moof = box(b"moof", mfhd + box(b"traf", tfhd + tfdt + trun.replace(
+            struct.pack(">i", 0), struct.pack(">i", len(moof) + 8), 1)))
+        return box(b"styp", b"msdh") + moof + box(b"mdat", b"IFRAMpP1")
+
+    # data offsets are relative to the moof (default-base-is-moof), not the segment
+    frag = hls_iframes.fmp4_iframe(fragment(0x02000000), 1)
+    kinds = [k for k, *_ in hls_iframes._boxes(frag)]
+    assert kinds == [b"moof", b"mdat"] and frag.endswith(b"IFRAM")
+    traf = next(b for k, _, b, e in hls_iframes._boxes(frag, 8) if k == b"traf")
+    trun = next(b for k, _, b, e in hls_iframes._boxes(frag, traf) if k == b"trun")
+    count, offset = struct.unpack_from(">Ii", frag, trun + 4)
+    assert count == 1 and frag[offset:] == b"IFRAM"
+    assert hls_iframes.fmp4_iframe(fragment(0x01010000), 1) is None    # not a sync sample
+    assert hls_iframes.fmp4_iframe(fragment(0x02000000), 2) is None
+
+
+def test_master_lists_iframe_streams(tmp_path):
+    rung = tmp_path / "360p"
+    (rung / "segments").mkdir(parents=True)
+    for n, size in enumerate((500, 1000)):
+        (rung / "segments" / f"iframe_{n:06d}.ts").write_bytes(b"x" * size)
+    (rung / "360p.m3u8").write_text(hls_playlists.render_media_playlist([(4.0, "segments/segment_000000.ts")]))
+    (rung / tasks.IFRAME_PLAYLIST).write_text(hls_playlists.render_media_playlist(
+        [(4.0, "segments/iframe_000000.ts"), (2.0, "segments/iframe_000001.ts")], iframes_only=True))
+    assert hls_playlists.parse_segment_sizes(str(rung / tasks.IFRAME_PLAYLIST)) == [500, 1000]
+    text = open(tasks._publish_master(str(tmp_path), True)).read()
+    assert '#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=4000,RESOLUTION=640x360,CODECS="avc1.640029",' \
+           'URI="360p/iframes.m3u8"' in text
+    assert tasks._iframe_rungs(tasks._select_variants(1280, 720), "lowest") == ["360p"]
+    assert tasks._iframe_rungs(tasks._select_variants(1280, 720), "none") == []
+
+
+def test_master_declares_measured_bitrates(tmp_path):
+    def rung(name, sizes, duration=4.0):
+        (tmp_path / name / "segments").mkdir(parents=True)
+        entries = []
+        for n, size in enumerate(sizes):
+            (tmp_path / name / "segments" / f"segment_{n:06d}.ts").write_bytes(b"x" * size)
+            entries.append((duration, f"segments/segment_{n:06d}.ts"))
+        (tmp_path / name / f"{name}.m3u8").write_text(hls_playlists.render_media_playlist(entries))
+
+    rung("720p", [500_000, 1_500_000, 1_000_000])
+    rung("360p", [100_000, 100_000])
+    rung("audio_64k", [32_000, 32_000])
+    tasks._write_rung_meta(str(tmp_path / "720p"), {**tasks.HLS_LADDER[3], "bitrate": 2500, "copy": True,
+                                                    "level": 40})
+    with open(tasks._publish_master(str(tmp_path), True, frame_rate=29.97)) as f:
+        text = f.read()
+    # 1.5 MB over 4s peak, 3 MB over 12s on average; the audio group's 64 kbit/s added to both
+    assert "BANDWIDTH=3064000,AVERAGE-BANDWIDTH=2064000,RESOLUTION=1280x720,FRAME-RATE=29.970," \
+           'CODECS="avc1.640028,mp4a.40.2",AUDIO="aud64"' in text
+    assert "BANDWIDTH=264000,AVERAGE-BANDWIDTH=264000,RESOLUTION=640x360" in text
+    assert 'CODECS="avc1.640029,mp4a.40.2"' in text
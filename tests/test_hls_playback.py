@@ -0,0 +1,269 @@
+from types import SimpleNamespace
+
+import pytest
+from flask_jwt_extended import create_access_token
+from app import create_app, Config
+from app.extensions import db
+from app.models.User import User, UserRole, Role
+from app.models.video import Video, VideoStatus
+from app import tasks
+
+MASTER = ('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\n720p/720p.m3u8\n'
+          '#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=1,URI="720p/iframes.m3u8"\n')
+SEGMENT = '720p/segments/segment_000000.ts'
+
+
+class TestConfig(Config):
+    TESTING = True
+    DEBUG = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    JWT_COOKIE_SECURE = False
+    JWT_COOKIE_CSRF_PROTECT = False
+
+
+@pytest.fixture()
+def app_ctx(tmp_path, monkeypatch):
+    from app.utils import video_location_cache, view_buffer
+    # HLS output lives under ./app/static/hls_output, as the pipeline writes it
+    monkeypatch.chdir(tmp_path)
+    video_location_cache.invalidate()
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        view_buffer.flush()
+
+
+@pytest.fixture()
+def hls(app_ctx, tmp_path):
+    """A published video with a one-rung encrypted HLS output, a client and a
+    viewer's Authorization header."""
+    u = User(username='uploader', email='uploader@example.com')
+    u.set_password('Str0ng!Pass2')
+    u.role_associations.append(UserRole(role=Role.UPLOADER))
+    db.session.add(u)
+    db.session.commit()
+    out = tmp_path / 'app' / 'static' / 'hls_output' / 'vid-p1'
+    (out / '720p' / 'segments').mkdir(parents=True)
+    (out / 'keys').mkdir()
+    (out / 'keys' / 'enc.key').write_bytes(b'k' * 16)
+    (out / '720p' / '720p.m3u8').write_text('#EXTM3U\n')
+    (out / '720p' / '720p.mp4').write_bytes(bytes(range(256)) * 4)
+    (out / SEGMENT).write_bytes(b'ts' * 100)
+    (out / 'master.m3u8').write_text(MASTER)
+    v = Video(uuid='vid-p1', title='P', description='', transcript='', original_file_path='/tmp/p.mp4',
+              file_path=str(out / 'master.m3u8'), status=VideoStatus.PUBLISHED, duration=60.0, user_id=u.id)
+    db.session.add(v)
+    db.session.commit()
+    token = create_access_token(identity=str(u.id), additional_claims={'roles': ['viewer']})
+    return SimpleNamespace(video=v, out=out, client=app_ctx.test_client(),
+                           auth={'Authorization': f'Bearer {token}'},
+                           base=f'/video/api/v1/video/hls/{v.uuid}/',
+                           public=f'/video/api/v1/video/public/hls/{v.uuid}/')
+
+
+def _master_prefix(h) -> str:
+    """The path prefix the JWT master puts in front of its URIs."""
+    uri = h.client.get(h.base + 'master.m3u8', headers=h.auth).get_data(as_text=True).splitlines()[2]
+    return uri.rsplit('/', 2)[0]
+
+
+def test_hls_asset_route_serves_byte_ranges(hls):
+    r = hls.client.get(hls.base + '720p/720p.mp4', headers={**hls.auth, 'Range': 'bytes=16-47'})
+    assert r.status_code == 206
+    assert r.headers['Content-Range'] == 'bytes 16-47/1024'
+    assert r.data == bytes(range(16, 48))
+
+
+def test_hls_assets_are_versioned_and_immutable(hls):
+    client, auth, base = hls.client, hls.auth, hls.base
+    master = client.get(base + 'master.m3u8', headers=auth)
+    assert master.headers['Cache-Control'] == 'no-store'
+    lines = master.get_data(as_text=True).splitlines()
+    prefix = lines[2].split('/')[0]
+    assert prefix.startswith('_v') and lines[2] == f'{prefix}/720p/720p.m3u8'
+    assert f'URI="{prefix}/720p/iframes.m3u8"' in lines[3]
+
+    seg = client.get(f'{base}{prefix}/{SEGMENT}', headers=auth)
+    assert seg.status_code == 200 and seg.data == b'ts' * 100
+    assert seg.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert seg.headers['ETag'] and not seg.headers['ETag'].startswith('W/') and seg.headers['Last-Modified']
+    again = client.get(f'{base}{prefix}/{SEGMENT}', headers={**auth, 'If-None-Match': seg.headers['ETag']})
+    assert again.status_code == 304
+    part = client.get(f'{base}{prefix}/{SEGMENT}', headers={**auth, 'Range': 'bytes=0-9'})
+    assert part.status_code == 206 and part.data == b'ts' * 5
+    key = client.get(f'{base}{prefix}/keys/enc.key', headers=auth)
+    assert key.headers['Cache-Control'].startswith('private,')
+
+    # A re-encode writes a new key: old versioned URLs stop resolving
+    (hls.out / 'keys' / 'enc.key').write_bytes(b'n' * 16)
+    assert client.get(f'{base}{prefix}/{SEGMENT}', headers=auth).status_code == 404
+    plain = client.get(base + SEGMENT, headers=auth)
+    assert plain.status_code == 200 and plain.headers['Cache-Control'] == 'no-cache'
+
+
+def test_hls_assets_offload_to_front_server(hls, app_ctx):
+    from app.models.AuditLog import AuditLog
+    client, auth, base = hls.client, hls.auth, hls.base
+    prefix = _master_prefix(hls)
+
+    app_ctx.config['HLS_OFFLOAD'] = 'nginx'
+    audits = AuditLog.query.count()
+    seg = client.get(f'{base}{prefix}/{SEGMENT}', headers=auth)
+    assert seg.status_code == 200 and seg.data == b''
+    assert seg.headers['X-Accel-Redirect'] == f'/_hls/{hls.video.uuid}/{SEGMENT}'
+    assert seg.headers['Content-Type'] == 'video/mp2t'
+    assert seg.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert AuditLog.query.count() == audits    # segments are not audited when offloaded
+    key = client.get(f'{base}{prefix}/keys/enc.key', headers=auth)
+    assert key.headers['X-Accel-Redirect'].endswith('/keys/enc.key') and AuditLog.query.count() == audits + 1
+    assert client.get(f'{base}{prefix}/720p/../../secret', headers=auth).status_code in (403, 404)
+    assert client.get(base + '_vdeadbeef/720p/720p.m3u8', headers=auth).status_code == 404
+    assert client.get(base + SEGMENT).status_code == 401
+
+    app_ctx.config['HLS_OFFLOAD'] = 'sendfile'
+    seg = client.get(f'{base}{prefix}/{SEGMENT}', headers=auth)
+    assert seg.headers['X-Sendfile'] == str(hls.out / SEGMENT)
+
+
+def test_unknown_hls_offload_mode_fails_at_startup():
+    class BadOffload(TestConfig):
+        HLS_OFFLOAD = 'apache'
+    with pytest.raises(ValueError, match='HLS_OFFLOAD'):
+        create_app(BadOffload)
+
+
+def test_signed_hls_urls_skip_jwt_and_database(hls, app_ctx):
+    import time
+    import uuid
+    from unittest import mock
+    app_ctx.config['HLS_SIGNED_URLS'] = True
+    client, base = hls.client, hls.base
+    token, version = _master_prefix(hls).split('/')
+    assert token.startswith('_s') and version.startswith('_v')
+
+    # No Authorization header and no queries: the token alone authorizes
+    seg_path = f'{base}{token}/{version}/{SEGMENT}'
+    with mock.patch.object(db.session, 'execute', side_effect=AssertionError('database hit')):
+        seg = client.get(seg_path)
+    assert seg.status_code == 200 and seg.data == b'ts' * 100
+    key = client.get(f'{base}{token}/{version}/keys/enc.key')
+    assert key.status_code == 200 and key.headers['Cache-Control'].startswith('private,')
+
+    tampered = token[:-2] + ('AA' if not token.endswith('AA') else 'BB')
+    assert client.get(f'{base}{tampered}/{version}/{SEGMENT}').status_code == 403
+    other = f'/video/api/v1/video/hls/{uuid.uuid4()}/{token}/{version}/{SEGMENT}'
+    assert client.get(other).status_code == 403
+    with mock.patch('time.time', return_value=time.time() + 60 + 601):
+        assert client.get(seg_path).status_code == 403
+    assert client.get(f'{base}{version}/{SEGMENT}').status_code == 401
+
+
+def test_signed_hls_tokens_are_scoped_to_their_routes(hls, app_ctx):
+    app_ctx.config.update(HLS_SIGNED_URLS=True, ALLOW_PUBLIC_PLAYBACK=True)
+    client = hls.client
+    jwt_prefix = _master_prefix(hls)
+    public_uri = client.get(hls.public + 'master.m3u8').get_data(as_text=True).splitlines()[2]
+    public_prefix = public_uri.rsplit('/', 2)[0]
+    assert client.get(f'{hls.public}{public_prefix}/{SEGMENT}').status_code == 200
+
+    # A token only works on the routes whose master issued it
+    assert client.get(f'{hls.public}{jwt_prefix}/{SEGMENT}').status_code == 403
+    assert client.get(f'{hls.base}{public_prefix}/{SEGMENT}').status_code == 403
+
+    # Unpublishing stops public playback before the token expires
+    tasks._on_fail(hls.video.uuid)
+    assert client.get(f'{hls.public}{public_prefix}/{SEGMENT}').status_code == 403
+
+
+def test_unencoded_upload_is_not_served_as_master(hls, tmp_path):
+    # Until the encode finishes, file_path is the raw upload
+    upload = tmp_path / 'uploads' / 'raw.mp4'
+    upload.parent.mkdir()
+    upload.write_bytes(b'\x00\x00\x00\x18ftypmp42\xff\xfe')
+    hls.video.file_path, hls.video.status = str(upload), VideoStatus.PENDING
+    db.session.commit()
+    assert hls.client.get(hls.base + 'master.m3u8', headers=hls.auth).status_code == 404
+    assert hls.client.get(hls.base + 'raw.mp4', headers=hls.auth).status_code == 404
+
+    # A binary file named like a master inside the output dir is not a playlist either
+    (hls.out / 'master.m3u8').write_bytes(b'\xff\xfe\x00binary')
+    hls.video.file_path = str(hls.out / 'master.m3u8')
+    db.session.commit()
+    assert hls.client.get(hls.base + 'master.m3u8', headers=hls.auth).status_code == 404
+
+
+def test_hls_location_cache_skips_queries_until_invalidated(hls, app_ctx):
+    from unittest import mock
+    app_ctx.config['ALLOW_PUBLIC_PLAYBACK'] = True
+    client = hls.client
+    assert client.get(hls.base + 'master.m3u8', headers=hls.auth).status_code == 200
+
+    with mock.patch.object(db.session, 'execute', side_effect=AssertionError('database hit')):
+        assert client.get(hls.public + '720p/720p.m3u8').status_code == 200
+
+    tasks._on_fail(hls.video.uuid)
+    assert client.get(hls.public + '720p/720p.m3u8').status_code == 403
+    assert client.get('/video/api/v1/video/public/hls/no-such-video/720p/720p.m3u8').status_code == 404
+
+    # Re-queueing flips the video back to pending
+    tasks._mark_status(hls.video.uuid, VideoStatus.PUBLISHED)
+    assert client.get(hls.public + '720p/720p.m3u8').status_code == 200
+    tasks.enqueue_transcode(hls.video.uuid)
+    assert client.get(hls.public + '720p/720p.m3u8').status_code == 403
+
+
+def test_hls_location_cache_skips_unencoded_videos(hls, app_ctx, tmp_path):
+    from app.utils import video_location_cache
+    master = hls.video.file_path
+    hls.video.file_path, hls.video.status = str(tmp_path / 'raw.mp4'), VideoStatus.PENDING
+    db.session.commit()
+    video_location_cache.invalidate()
+    assert hls.client.get(hls.base + 'master.m3u8', headers=hls.auth).status_code == 404
+    assert video_location_cache.get(hls.video.uuid, 30) is None
+
+    # The worker publishes from another process, without touching this cache
+    db.session.execute(db.update(Video).where(Video.uuid == hls.video.uuid)
+                       .values(file_path=master, status=VideoStatus.PUBLISHED))
+    db.session.commit()
+    assert hls.client.get(hls.base + 'master.m3u8', headers=hls.auth).status_code == 200
+    assert video_location_cache.get(hls.video.uuid, 30).base_dir == str(hls.out)
+
+
+def test_views_are_buffered_and_flushed_in_one_batch(hls, app_ctx):
+    from app.models.video import VideoViewEvent
+    from app.utils import view_buffer
+    app_ctx.config['ALLOW_PUBLIC_PLAYBACK'] = True
+    client, auth, video_id = hls.client, hls.auth, hls.video.uuid
+    for _ in range(3):
+        assert client.get(hls.base + 'master.m3u8', headers=auth).status_code == 200
+    assert client.get(hls.public + 'master.m3u8').status_code == 200
+    assert client.post(f'/video/api/v1/video/{video_id}/view', headers=auth).status_code == 201
+    assert client.post('/video/api/v1/video/no-such-video/view', headers=auth).status_code == 404
+
+    db.session.expire_all()
+    assert (db.session.get(Video, video_id).views or 0) == 0 and view_buffer.pending() == 5
+    db.session.execute(db.update(Video).where(Video.uuid == video_id).values(views=10))   # another process
+    db.session.commit()
+    assert view_buffer.flush() == 5 and view_buffer.pending() == 0
+    db.session.expire_all()
+    assert db.session.get(Video, video_id).views == 15
+    assert VideoViewEvent.query.filter_by(video_id=video_id).count() == 4    # the public play has no user
+
+    app_ctx.config['VIEW_BUFFER_SECONDS'] = 0
+    client.get(hls.public + 'master.m3u8')
+    db.session.expire_all()
+    assert db.session.get(Video, video_id).views == 16 and view_buffer.pending() == 0
+
+
+def test_inline_view_flush_leaves_the_request_session_alone(hls, app_ctx):
+    from app.utils import view_buffer
+    app_ctx.config['VIEW_BUFFER_SECONDS'] = 0
+    with app_ctx.test_request_context():
+        hls.video.title = 'edited, not committed'
+        view_buffer.record(hls.video.uuid)
+        assert view_buffer.pending() == 0
+        db.session.rollback()
+    db.session.expire_all()
+    video = db.session.get(Video, hls.video.uuid)
+    assert video.title == 'P' and video.views == 1
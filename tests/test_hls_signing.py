@@ -0,0 +1,22 @@
+import pytest
+
+from app.utils import hls_signing
+
+
+def test_signed_asset_tokens_bind_scope_video_user_and_expiry():
+    token = hls_signing.sign("k", "jwt", "vid-1", "42", 1000)
+    assert hls_signing.split(f"{token}/_vabc/720p/720p.m3u8") == (token, "_vabc/720p/720p.m3u8")
+    assert hls_signing.split("720p/720p.m3u8") == (None, "720p/720p.m3u8")
+    assert hls_signing.verify("k", "jwt", token, "vid-1", now=999) == "42"
+    assert hls_signing.verify("k", "public", token, "vid-1", now=999) is None
+    assert hls_signing.verify("k", "jwt", token, "vid-1", now=1001) is None
+    assert hls_signing.verify("k", "jwt", token, "vid-2", now=999) is None
+    assert hls_signing.verify("other", "jwt", token, "vid-1", now=999) is None
+    forged = token.replace("1000.", "9999.")
+    assert hls_signing.verify("k", "jwt", forged, "vid-1", now=999) is None
+    assert hls_signing.verify("k", "jwt", "_sgarbage", "vid-1") is None
+    public = hls_signing.sign("k", "public", "vid-1", None, 1000)
+    assert hls_signing.verify("k", "public", public, "vid-1", now=0) == ""
+    assert hls_signing.verify("k", "jwt", public, "vid-1", now=0) is None
+    with pytest.raises(ValueError):
+        hls_signing.sign("k", "admin", "vid-1", None, 1000)
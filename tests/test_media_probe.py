@@ -0,0 +1,96 @@
+import subprocess
+
+import pytest
+from app import create_app, Config
+from app.extensions import db
+from app.models import MediaProbe
+from app.utils import media_probe
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+
+
+FFPROBE_JSON = {
+    "format": {"duration": "125.400000", "bit_rate": "4000000", "size": "62700000", "format_name": "mov,mp4"},
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080,
+         "r_frame_rate": "30000/1001", "bit_rate": "3800000",
+         "side_data_list": [{"side_data_type": "Display Matrix", "rotation": -90}]},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac", "channels": 2,
+         "sample_rate": "48000", "bit_rate": "128000"},
+        {"index": 2, "codec_type": "video", "codec_name": "mjpeg", "width": 300, "height": 300,
+         "r_frame_rate": "0/0", "disposition": {"attached_pic": 1}},
+    ],
+}
+
+
+def test_summarise_single_pass_fields():
+    info = media_probe._summarise(FFPROBE_JSON)
+    assert info["duration"] == pytest.approx(125.4)
+    assert (info["width"], info["height"]) == (1920, 1080)
+    assert info["rotation"] == 270
+    assert (info["display_width"], info["display_height"]) == (1080, 1920)
+    assert info["fps"] == pytest.approx(29.97, abs=0.01)
+    assert info["has_audio"] and info["audio_channels"] == 2
+    assert info["video_codec"] == "h264"
+    assert len(info["streams"]) == 3
+
+
+def test_probe_cached_per_md5(monkeypatch):
+    calls = []
+
+    def fake_ffprobe(path):
+        calls.append(path)
+        return media_probe._summarise(FFPROBE_JSON)
+
+    monkeypatch.setattr(media_probe, "_run_ffprobe", fake_ffprobe)
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        first = media_probe.probe_media('/tmp/a.mp4', md5='a' * 32)
+        assert db.session.get(MediaProbe, 'a' * 32) is not None
+        # Drop the process memo: the persisted row must still satisfy the lookup
+        media_probe._memo.clear()
+        again = media_probe.probe_media('/tmp/renamed.mp4', md5='a' * 32)
+        assert again == first
+        # Without a hash every call probes
+        media_probe.probe_media('/tmp/a.mp4')
+    assert calls == ['/tmp/a.mp4', '/tmp/a.mp4']
+
+
+def test_keyframe_interval_from_packets():
+    meta = dict(FFPROBE_JSON, packets=[
+        {"stream_index": 0, "pts_time": f"{t:.6f}", "flags": "K__" if t % 2 == 0 else "___"}
+        for t in range(0, 11)] + [{"stream_index": 1, "pts_time": "1.000000", "flags": "K__"}])
+    info = media_probe._summarise(meta)
+    assert info["keyframe_interval"] == 2.0 and info["keyframe_regular"]
+    meta["packets"].append({"stream_index": 0, "pts_time": "11.000000", "flags": "K__"})
+    meta["packets"].append({"stream_index": 0, "pts_time": "15.000000", "flags": "K__"})
+    assert not media_probe._summarise(meta)["keyframe_regular"]
+
+
+def test_content_hash_cached_on_probe_row(monkeypatch):
+    calls = []
+    monkeypatch.setattr(media_probe, "_run_streamhash", lambda path, runner=None: calls.append(path) or "f" * 64)
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(MediaProbe(md5='e' * 32, data={}))
+        db.session.commit()
+        assert media_probe.content_hash('/tmp/a.mkv', md5='e' * 32) == "f" * 64
+        assert media_probe.content_hash('/tmp/a.mp4', md5='e' * 32) == "f" * 64
+        assert db.session.get(MediaProbe, 'e' * 32).content_hash == "f" * 64
+    assert calls == ['/tmp/a.mkv']
+
+
+def test_streamhash_goes_through_the_callers_runner():
+    cmds = []
+    digest = media_probe._run_streamhash('/tmp/a.mp4', runner=lambda cmd: cmds.append(cmd) or "0,v,SHA256=ab\n")
+    assert cmds[0][-4:] == ["streamhash", "-hash", "sha256", "-"] and len(digest) == 64
+
+    def failing(cmd):
+        raise subprocess.CalledProcessError(1, cmd, "", "moov atom not found")
+    with pytest.raises(RuntimeError, match="moov atom not found"):
+        media_probe._run_streamhash('/tmp/a.mp4', runner=failing)
@@ -0,0 +1,36 @@
+import pytest
+
+from app.utils import resource_governor
+from app.utils.resource_governor import ResourceGovernor, parse_cpu_list
+
+
+def test_thread_budget_splits_usable_cores():
+    gov = ResourceGovernor(reserved_cpus=2, cpu_count=16)
+    assert gov.usable_cpus == 14
+    assert [gov.thread_budget(n) for n in (0, 1, 2, 3, 20)] == [14, 14, 7, 4, 1]
+    pinned = ResourceGovernor(cpus=parse_cpu_list("4-7, 10"), cpu_count=16)
+    assert pinned.cpus == [4, 5, 6, 7, 10] and pinned.thread_budget(2) == 2
+
+
+def test_wrap_prefixes_priority_and_affinity(monkeypatch):
+    monkeypatch.setattr(resource_governor.shutil, "which", lambda name: f"/usr/bin/{name}")
+    gov = ResourceGovernor.from_config({"TRANSCODE_NICE": 5, "TRANSCODE_IONICE_CLASS": "idle",
+                                        "TRANSCODE_CPU_AFFINITY": "2,3"})
+    assert gov.wrap(["ffmpeg", "-i", "x"]) == ["nice", "-n", "5", "ionice", "-c", "3",
+                                               "taskset", "-c", "2,3", "ffmpeg", "-i", "x"]
+    plain = ResourceGovernor.from_config({"TRANSCODE_NICE": 0, "TRANSCODE_IONICE_CLASS": "none"})
+    assert plain.wrap(["ffmpeg"]) == ["ffmpeg"]
+    # A missing launcher is skipped rather than failing the encode
+    monkeypatch.setattr(resource_governor.shutil, "which", lambda name: None)
+    assert gov.wrap(["ffmpeg"]) == ["ffmpeg"]
+    with pytest.raises(ValueError):
+        ResourceGovernor(ionice_class="realtime")
+
+
+def test_overloaded_admits_first_job(monkeypatch):
+    gov = ResourceGovernor(max_load=1.0, cpu_count=4)
+    monkeypatch.setattr(resource_governor.os, "getloadavg", lambda: (6.0, 5.0, 4.0))
+    assert gov.overloaded(1) and not gov.overloaded(0)
+    monkeypatch.setattr(resource_governor.os, "getloadavg", lambda: (3.5, 5.0, 4.0))
+    assert not gov.overloaded(2)
+    assert not ResourceGovernor(max_load=0, cpu_count=4).overloaded(5)
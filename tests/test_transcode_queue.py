@@ -0,0 +1,560 @@
+from datetime import timedelta
+
+import pytest
+from app import create_app, Config
+from app.extensions import db
+from app.models.User import User, UserRole, Role
+from app.models.video import Video, VideoStatus
+from app.models.TranscodeJob import TranscodeJob
+from app.models.enumerations import TranscodeJobStatus
+from app import tasks
+from app.utils.resource_governor import ResourceGovernor
+
+
+class TestConfig(Config):
+    TESTING = True
+    DEBUG = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    JWT_COOKIE_SECURE = False
+    JWT_COOKIE_CSRF_PROTECT = False
+    TRANSCODE_MAX_ATTEMPTS = 2
+    TRANSCODE_RETRY_BACKOFF_SECONDS = 10
+
+
+@pytest.fixture()
+def app_ctx():
+    tasks._forecast_cache.clear()
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+@pytest.fixture()
+def video(app_ctx):
+    u = User(username='uploader', email='uploader@example.com')
+    u.set_password('Str0ng!Pass2')
+    u.role_associations.append(UserRole(role=Role.UPLOADER))
+    db.session.add(u)
+    db.session.commit()
+    v = Video(uuid='vid-q1', title='Q', description='', transcript='', original_file_path='/tmp/q.mp4',
+              file_path='/tmp/q.mp4', status=VideoStatus.PENDING, user_id=u.id)
+    db.session.add(v)
+    db.session.commit()
+    return v
+
+
+def test_enqueue_is_deduplicated(video):
+    j1 = tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    j2 = tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    assert j1.id == j2.id
+    assert TranscodeJob.query.count() == 1
+
+
+def test_claim_is_exclusive_and_completes(video):
+    tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    job = tasks.claim_next_job('w1', lease_seconds=60)
+    assert job is not None and job.status == TranscodeJobStatus.RUNNING and job.attempts == 1
+    assert tasks.claim_next_job('w2', lease_seconds=60) is None
+    assert not tasks.complete_job(job.id, 'w2')
+    assert tasks.complete_job(job.id, 'w1')
+    job = db.session.get(TranscodeJob, job.id)
+    assert job.status == TranscodeJobStatus.SUCCEEDED and job.active_key is None
+    # finished jobs no longer block a re-transcode
+    assert tasks.add_to_queue('/tmp/q.mp4', video.uuid).id != job.id
+
+
+def test_expired_lease_is_reclaimed(video):
+    tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    job = tasks.claim_next_job('w1', lease_seconds=60)
+    job.lease_expires_at = tasks._utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    again = tasks.claim_next_job('w2', lease_seconds=60)
+    assert again.id == job.id and again.lease_owner == 'w2' and again.attempts == 2
+    assert not tasks.renew_lease(job.id, 'w1', 60)
+
+
+def test_lost_lease_stops_ffmpeg_and_writes_nothing(video, app_ctx, monkeypatch):
+    import sys
+    import time
+    monkeypatch.setattr(tasks, 'FFMPEG_BIN', sys.executable)
+    monkeypatch.setattr(tasks, 'FFPROBE_BIN', sys.executable)
+    monkeypatch.setattr(tasks, 'probe_media', lambda path, md5=None: {'width': 1280, 'height': 720, 'duration': 6.0})
+    monkeypatch.setattr(tasks, 'content_hash', lambda path, md5=None, runner=None: None)
+    published = []
+
+    def fake_convert(path, vid, **kw):
+        tasks._run_ffmpeg([sys.executable, '-c', 'import time; time.sleep(60)'])
+        published.append(vid)
+        return '/tmp/master.m3u8'
+    monkeypatch.setattr(tasks, 'convert_to_hls', fake_convert)
+
+    job = tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    tasks.claim_next_job('w1', lease_seconds=60)
+    job.lease_expires_at = tasks._utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    tasks.claim_next_job('w2', lease_seconds=60)    # w1 stalled; w2 now owns the job
+
+    started = time.monotonic()
+    tasks._run_job(app_ctx, job.id, video.uuid, '/tmp/q.mp4', 1, 2, 'w1', 3)
+    assert time.monotonic() - started < 10 and not published and not tasks._active_procs
+    db.session.expire_all()
+    job = db.session.get(TranscodeJob, job.id)
+    assert job.status == TranscodeJobStatus.RUNNING and job.lease_owner == 'w2' and job.last_error is None
+    assert db.session.get(Video, video.uuid).status == VideoStatus.PENDING
+
+
+def test_failure_backs_off_then_gives_up(video):
+    tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    job = tasks.claim_next_job('w1', lease_seconds=60)
+    assert tasks.fail_job(job.id, 'w1', error='boom') is False
+    job = db.session.get(TranscodeJob, job.id)
+    assert job.status == TranscodeJobStatus.QUEUED and job.available_at > tasks._utcnow()
+    assert tasks.claim_next_job('w1', lease_seconds=60) is None
+    job.available_at = tasks._utcnow()
+    db.session.commit()
+    job = tasks.claim_next_job('w1', lease_seconds=60)
+    assert tasks.fail_job(job.id, 'w1', error='boom again') is True
+    job = db.session.get(TranscodeJob, job.id)
+    assert job.status == TranscodeJobStatus.FAILED and job.active_key is None
+
+
+def test_release_does_not_count_attempt(video):
+    tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    job = tasks.claim_next_job('w1', lease_seconds=60)
+    assert tasks.release_job(job.id, 'w1')
+    job = db.session.get(TranscodeJob, job.id)
+    assert job.status == TranscodeJobStatus.QUEUED and job.attempts == 0 and job.lease_owner is None
+
+
+def test_worker_heartbeat_reports_capacity(app_ctx):
+    from app.models.TranscodeWorker import TranscodeWorker
+    tasks._record_heartbeat(4)
+    row = db.session.get(TranscodeWorker, tasks.WORKER_ID)
+    assert row.slots == 4 and row.busy_slots == 0 and row.is_alive(60)
+    tasks._record_heartbeat(4, 'stopped')
+    assert not db.session.get(TranscodeWorker, tasks.WORKER_ID).is_alive(60)
+
+
+def test_no_embedded_worker_under_flask_cli(app_ctx, monkeypatch):
+    import threading
+    monkeypatch.setitem(app_ctx.config, 'TESTING', False)
+    monkeypatch.setenv('FLASK_RUN_FROM_CLI', 'true')
+    before = threading.active_count()
+    assert tasks.start_hls_worker(app_ctx) is None
+    assert threading.active_count() == before
+
+
+def test_progress_blocks_are_parsed_and_throttled(video, app_ctx):
+    import io
+    tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    job = tasks.claim_next_job('w1', lease_seconds=60)
+    job.duration_seconds = 100.0
+    db.session.commit()
+    reporter = tasks._ProgressReporter(app_ctx, job.id, 100.0, interval=60)
+    stream = io.StringIO(
+        "frame=10\nfps=0.00\nout_time_us=N/A\nspeed=N/A\nprogress=continue\n"
+        "frame=900\nfps=60.0\nout_time_us=25000000\nspeed=2.5x\nprogress=continue\n"
+    )
+    tasks._read_progress(stream, lambda p: reporter(0, p))
+    db.session.expire_all()
+    job = db.session.get(TranscodeJob, job.id)
+    # second block falls inside the throttle window
+    assert job.progress_out_time == 0.0 and job.progress_pct == 0.0
+    reporter._last_write = 0.0  # throttle window elapsed
+    reporter(0, {"out_time": 50.0, "fps": 60.0, "speed": 2.5, "done": False})
+    db.session.expire_all()
+    job = db.session.get(TranscodeJob, job.id)
+    assert job.progress_pct == 50.0 and job.progress_out_time == 50.0
+    assert job.progress_dict()['eta_seconds'] == 20.0
+
+
+def test_transcode_status_endpoint(video, app_ctx):
+    from flask_jwt_extended import create_access_token
+    tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    job = tasks.claim_next_job('w1', lease_seconds=60)
+    job.duration_seconds, job.progress_out_time, job.progress_pct, job.progress_speed = 60.0, 30.0, 50.0, 3.0
+    job.last_error = 'ffmpeg: /srv/uploads/q.mp4: Invalid data'
+    db.session.commit()
+    token = create_access_token(identity=str(video.user_id), additional_claims={'roles': ['uploader']})
+    r = app_ctx.test_client().get(f'/video/api/v1/video/{video.uuid}/transcode-status',
+                                  headers={'Authorization': f'Bearer {token}'})
+    assert r.status_code == 200
+    body = r.get_json()
+    assert body['job']['status'] == 'running'
+    assert body['job']['progress']['percent'] == 50.0
+    assert body['job']['progress']['eta_seconds'] == 10.0
+    # The uploader gets no worker identity, params or server paths
+    assert body['job']['error'] == 'Transcoding failed'
+    assert not {'lease_owner', 'params', 'last_error'} & set(body['job'])
+    admin = create_access_token(identity=str(video.user_id), additional_claims={'roles': ['admin']})
+    r = app_ctx.test_client().get(f'/video/api/v1/video/{video.uuid}/transcode-status',
+                                  headers={'Authorization': f'Bearer {admin}'})
+    assert r.get_json()['job']['lease_owner'] == 'w1' and '/srv/uploads' in r.get_json()['job']['last_error']
+
+
+def test_backfill_jobs_dedup_per_rung_and_run_after_uploads(video):
+    from app.models.enumerations import TranscodeJobKind
+    b1 = tasks.add_to_queue('/tmp/q.mp4', video.uuid, kind=TranscodeJobKind.BACKFILL,
+                            priority=-10, params={"rungs": ["1080p"]})
+    assert tasks.add_to_queue('/tmp/q.mp4', video.uuid, kind=TranscodeJobKind.BACKFILL,
+                              priority=-10, params={"rungs": ["1080p"]}).id == b1.id
+    b2 = tasks.add_to_queue('/tmp/q.mp4', video.uuid, kind=TranscodeJobKind.BACKFILL,
+                            priority=-10, params={"rungs": ["360p"]})
+    full = tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    assert len({b1.id, b2.id, full.id}) == 3
+    assert tasks.claim_next_job('w1', 60).id == full.id
+    assert tasks.claim_next_job('w1', 60).id == b1.id
+
+
+def test_fast_start_split_prefers_720p_then_cheapest_first():
+    ladder = tasks._select_variants(1920, 1080)
+    first, rest = tasks._fast_start_split(ladder, 720)
+    assert first == '720p' and rest == ['360p', '480p', '1080p']
+    assert tasks._fast_start_split(tasks._select_variants(640, 360), 720) == ('360p', [])
+
+
+def test_publish_rungs_merges_master_and_rejects_rekeyed_output(tmp_path):
+    out = tmp_path / 'vid'
+    (out / 'keys').mkdir(parents=True)
+    (out / 'keys' / 'enc.key').write_bytes(b'k' * 16)
+    for name in ('360p',):
+        (out / name).mkdir()
+        (out / name / f'{name}.m3u8').write_text('#EXTM3U\n')
+    stage = out / '.stage-720p'
+    (stage / '720p').mkdir(parents=True)
+    (stage / '720p' / '720p.m3u8').write_text('#EXTM3U\n')
+    names = ['720p']
+    master = tasks._publish_rungs(str(stage), str(out), names, True, b'k' * 16)
+    text = open(master).read()
+    assert text.index('720p/720p.m3u8') < text.index('360p/360p.m3u8')
+    assert not stage.exists()
+
+    (stage / '720p').mkdir(parents=True)
+    with pytest.raises(RuntimeError):
+        tasks._publish_rungs(str(stage), str(out), names, True, b'x' * 16)
+    assert not stage.exists()
+
+
+def test_publish_output_swaps_a_fresh_build_in(tmp_path):
+    out = tmp_path / 'vid'
+    (out / 'keys').mkdir(parents=True)
+    (out / 'keys' / 'enc.key').write_bytes(b'o' * 16)
+    (out / '1080p').mkdir()
+    (out / '1080p' / '1080p.m3u8').write_text('#EXTM3U\n')
+    build = tmp_path / ('vid' + tasks.BUILD_SUFFIX)
+    (build / 'keys').mkdir(parents=True)
+    (build / 'keys' / 'enc.key').write_bytes(b'n' * 16)
+    (build / '720p').mkdir()
+    (build / '720p' / '720p.m3u8').write_text('#EXTM3U\n')
+    master = tasks._publish_output(str(build), str(out), False)
+    text = open(master).read()
+    assert '720p/720p.m3u8' in text and '1080p' not in text
+    assert (out / 'keys' / 'enc.key').read_bytes() == b'n' * 16 and not (out / '1080p').exists()
+    assert str(out / 'keys' / 'enc.key') in (out / 'enc.keyinfo').read_text()
+    assert not build.exists() and not (tmp_path / 'vid.old').exists()
+
+
+def test_reencode_keeps_published_video_playable(video, app_ctx, tmp_path, monkeypatch):
+    import sys
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tasks, 'FFMPEG_BIN', sys.executable)
+    monkeypatch.setattr(tasks, 'FFPROBE_BIN', sys.executable)
+    monkeypatch.setattr(tasks, 'probe_media', lambda path, md5=None: {'width': 1280, 'height': 720, 'duration': 6.0})
+    monkeypatch.setattr(tasks, 'content_hash', lambda path, md5=None, runner=None: None)
+    master = tmp_path / 'app' / 'static' / 'hls_output' / video.uuid / 'master.m3u8'
+    master.parent.mkdir(parents=True)
+    master.write_text('#EXTM3U\n')
+    video.file_path, video.status = str(master), VideoStatus.PUBLISHED
+    db.session.commit()
+    statuses = []
+
+    def fake_convert(path, vid, **kw):
+        statuses.append(db.session.get(Video, vid).status)
+        raise RuntimeError('encode failed')
+    monkeypatch.setattr(tasks, 'convert_to_hls', fake_convert)
+
+    job = tasks.enqueue_batch(video, '/tmp/q.mp4', priority=-5)
+    job.max_attempts = 1
+    db.session.commit()
+    tasks.claim_next_job('w1', lease_seconds=60)
+    tasks._run_job(app_ctx, job.id, video.uuid, '/tmp/q.mp4', 1, 1, 'w1', 60, params=job.params)
+    db.session.expire_all()
+    assert statuses == [VideoStatus.PUBLISHED]
+    assert db.session.get(TranscodeJob, job.id).status == TranscodeJobStatus.FAILED
+    assert db.session.get(Video, video.uuid).status == VideoStatus.PUBLISHED
+
+
+def test_content_aware_ladder_is_kept_on_job_and_backfills(video, app_ctx, monkeypatch):
+    import sys
+    app_ctx.config.update(TRANSCODE_CONTENT_AWARE=True, TRANSCODE_FAST_START=True, TRANSCODE_DEDUP=False)
+    monkeypatch.setattr(tasks, 'FFMPEG_BIN', sys.executable)
+    monkeypatch.setattr(tasks, 'FFPROBE_BIN', sys.executable)
+    monkeypatch.setattr(tasks, 'probe_media', lambda path, md5=None: {'width': 1920, 'height': 1080, 'duration': 60.0})
+    ladder = [{'name': '720p', 'bitrate': 1200}, {'name': '480p', 'bitrate': 600}, {'name': '360p', 'bitrate': 300}]
+    analysed = []
+    monkeypatch.setattr(tasks, 'analyse_ladder', lambda *a, **kw: analysed.append(a) or ladder)
+    calls = []
+    monkeypatch.setattr(tasks, 'convert_to_hls', lambda path, vid, **kw: calls.append(kw) or '/tmp/master.m3u8')
+    # The first job on an idle 2-slot worker still only gets half the cores
+    monkeypatch.setattr(tasks, '_governor', ResourceGovernor(reserved_cpus=0, cpu_count=8))
+    monkeypatch.setattr(tasks, '_slots', 2)
+
+    tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    job = tasks.claim_next_job('w1', lease_seconds=60)
+    tasks._run_job(app_ctx, job.id, video.uuid, '/tmp/q.mp4', 1, 2, 'w1', 60)
+
+    assert len(analysed) == 1 and calls[0]['ladder'] == ladder and calls[0]['rungs'] == ['720p']
+    assert calls[0]['threads'] == 4
+    db.session.expire_all()
+    assert db.session.get(TranscodeJob, job.id).params == {'ladder': ladder}
+    backfills = TranscodeJob.query.filter(TranscodeJob.id != job.id).order_by(TranscodeJob.id).all()
+    assert [b.params for b in backfills] == [{'rungs': ['360p'], 'ladder': ladder},
+                                             {'rungs': ['480p'], 'ladder': ladder}]
+
+
+def _uploader_video(name, uuid, md5=None):
+    u = User(username=name, email=f'{name}@example.com')
+    u.set_password('Str0ng!Pass2')
+    db.session.add(u)
+    db.session.commit()
+    v = Video(uuid=uuid, title=uuid, description='', transcript='', original_file_path=f'/tmp/{uuid}.mp4',
+              file_path=f'/tmp/{uuid}.mp4', status=VideoStatus.PENDING, user_id=u.id, md5=md5)
+    db.session.add(v)
+    db.session.commit()
+    return v
+
+
+def test_fair_share_and_shortest_job_first(video):
+    from app.models import MediaProbe
+    db.session.add(MediaProbe(md5='b' * 32, data={'duration': 300.0, 'width': 1280, 'height': 720}))
+    db.session.add(MediaProbe(md5='c' * 32, data={'duration': 3600.0, 'width': 1280, 'height': 720}))
+    db.session.commit()
+    surgeon = _uploader_video('surgeon', 'vid-short', md5='b' * 32)
+    bulk = [tasks.add_to_queue(f'/tmp/bulk{i}.mp4', f'vid-bulk{i}') for i in range(3)]
+    for i in range(3):
+        db.session.get(TranscodeJob, bulk[i].id).owner_id = str(video.user_id)
+    db.session.commit()
+    assert tasks.claim_next_job('w1', 60).id == bulk[0].id
+    long_job = tasks.add_to_queue('/tmp/long.mp4', _uploader_video('other', 'vid-long', md5='c' * 32).uuid)
+    short_job = tasks.add_to_queue('/tmp/short.mp4', surgeon.uuid)
+    db.session.commit()
+    assert short_job.owner_id == str(surgeon.user_id)
+    assert short_job.cost_estimate == round(300 * (1280 * 720 + 854 * 480 + 640 * 360) / 1e6, 3)
+
+    # Bulk uploader already has a job running: the other uploaders go first, shortest first
+    assert [j.id for j in tasks.queue_order()] == [short_job.id, long_job.id, bulk[1].id, bulk[2].id]
+    assert tasks.claim_next_job('w2', 60).id == short_job.id
+
+    # Priority classes outrank fair share; admins can reorder
+    reencode = tasks.add_to_queue('/tmp/q.mp4', video.uuid, priority=-5)
+    assert tasks.queue_order()[-1].id == reencode.id
+    tasks.reprioritize_job(reencode, action='bump')
+    assert tasks.queue_order()[0].id == reencode.id and reencode.priority == 1
+    tasks.reprioritize_job(db.session.get(TranscodeJob, long_job.id), action='demote')
+    assert tasks.queue_order()[-1].id == long_job.id
+
+
+def test_deep_queue_is_windowed_and_forecast_cached(video, monkeypatch):
+    monkeypatch.setattr(tasks, 'SCHEDULE_WINDOW', 5)
+    other = _uploader_video('other', 'vid-o')
+    jobs = [tasks.add_to_queue(f'/tmp/{i}.mp4', f'vid-d{i}') for i in range(8)]
+    for i, job in enumerate(jobs):
+        job.owner_id = str((other if i in (3, 4) else video).user_id)
+    db.session.commit()
+    # Like claim_next_job, only the oldest window is ordered; uploaders take turns inside it
+    order = tasks.queue_order(limit=5)
+    assert [j.id for j in order] == [jobs[0].id, jobs[3].id, jobs[1].id, jobs[4].id, jobs[2].id]
+    assert tasks.queued_count() == 8
+
+    f = tasks.queue_forecast(cache_seconds=30)
+    assert len(f['items']) == 5 and f['queue_depth'] == 8
+    tasks.add_to_queue('/tmp/late.mp4', 'vid-late')
+    assert tasks.queue_forecast(cache_seconds=30) is f
+    assert tasks.queue_forecast()['queue_depth'] == 9
+
+
+def test_admin_bumps_queued_job(video, app_ctx):
+    from flask_jwt_extended import create_access_token
+    first = tasks.add_to_queue('/tmp/q.mp4', video.uuid)
+    other = tasks.add_to_queue('/tmp/o.mp4', _uploader_video('other', 'vid-o').uuid)
+    client = app_ctx.test_client()
+    admin = {'Authorization': 'Bearer ' + create_access_token(identity=str(video.user_id),
+                                                               additional_claims={'roles': ['admin']})}
+    r = client.post(f'/video/api/v1/admin/transcode/jobs/{other.id}/priority', json={'action': 'bump'}, headers=admin)
+    assert r.status_code == 200 and r.get_json()['priority'] == 1
+    items = client.get('/video/api/v1/admin/transcode/queue', headers=admin).get_json()['items']
+    assert [(j['id'], j['queue_position']) for j in items] == [(other.id, 1), (first.id, 2)]
+    assert client.post(f'/video/api/v1/admin/transcode/jobs/{first.id}/priority', json={'priority': 'high'},
+                       headers=admin).status_code == 400
+    tasks.claim_next_job('w1', 60)
+    assert client.post(f'/video/api/v1/admin/transcode/jobs/{other.id}/priority', json={'priority': 3},
+                       headers=admin).status_code == 409
+    uploader = {'Authorization': 'Bearer ' + create_access_token(identity=str(video.user_id),
+                                                                  additional_claims={'roles': ['uploader']})}
+    assert client.post(f'/video/api/v1/admin/transcode/jobs/{first.id}/priority', json={'action': 'bump'},
+                       headers=uploader).status_code == 403
+
+
+def test_queue_forecast_uses_measured_speed(video, app_ctx):
+    from flask_jwt_extended import create_access_token
+    from app.models import MediaProbe
+    db.session.add(MediaProbe(md5='d' * 32, data={'duration': 100.0, 'width': 640, 'height': 360}))
+    db.session.commit()
+    small = _uploader_video('clipper', 'vid-small', md5='d' * 32)
+    # History: a 360p job of cost 23.04 took 10s -> 2.304 units/s for "360p/veryfast"
+    done = tasks.add_to_queue('/tmp/s.mp4', small.uuid)
+    assert done.speed_class == '360p/veryfast' and done.cost_estimate == 23.04
+    tasks.claim_next_job('w1', 60)
+    db.session.get(TranscodeJob, done.id).started_at = tasks._utcnow() - timedelta(seconds=10)
+    db.session.commit()
+    assert tasks.complete_job(done.id, 'w1')
+    db.session.expire_all()
+    assert round(db.session.get(TranscodeJob, done.id).encode_seconds) == 10
+
+    tasks._record_heartbeat(1)
+    first = tasks.add_to_queue('/tmp/s.mp4', small.uuid)
+    second = tasks.add_to_queue('/tmp/q.mp4', video.uuid)     # no probe: mean wall time (10s)
+    f = tasks.queue_forecast(window_hours=1)
+    assert f['speeds']['360p/veryfast'] == pytest.approx(2.304, rel=0.01)
+    # clipper was served last, so the other uploader's job runs first
+    assert [(i['job_id'], i['start_in_seconds']) for i in f['items']] == \
+        [(second.id, 0.0), (first.id, pytest.approx(10.0, abs=0.2))]
+    assert f['queue_depth'] == 2 and f['estimated_drain_seconds'] == pytest.approx(20.0, abs=0.5)
+    assert not f['capacity']['over_capacity'] and f['capacity']['incoming_jobs'] == 3
+
+    admin = {'Authorization': 'Bearer ' + create_access_token(identity=str(video.user_id),
+                                                               additional_claims={'roles': ['admin']})}
+    r = app_ctx.test_client().get('/video/api/v1/admin/transcode/forecast?window_hours=0.001', headers=admin)
+    assert r.status_code == 200 and r.get_json()['capacity']['window_hours'] == 1.0
+    r = app_ctx.test_client().get(f'/video/api/v1/video/{video.uuid}/transcode-status', headers=admin)
+    assert r.get_json()['job']['queue_eta_seconds'] == pytest.approx(10.0, abs=0.5)
+
+
+def test_rendition_registry_hardlinks_output(app_ctx, tmp_path, monkeypatch):
+    import os
+    monkeypatch.chdir(tmp_path)
+    src = tmp_path / 'app' / 'static' / 'hls_output' / 'vid-a'
+    (src / '720p' / 'segments').mkdir(parents=True)
+    (src / 'keys').mkdir()
+    (src / 'master.m3u8').write_text('#EXTM3U\n')
+    (src / '720p' / 'segments' / 'segment_000000.ts').write_bytes(b'ts')
+    (src / 'keys' / 'enc.key').write_bytes(b'k' * 16)
+    (src / 'enc.keyinfo').write_text('x')
+    (src / '.resume.json').write_text('{}')
+    (tmp_path / tasks.THUMBNAILS_DIR).mkdir(parents=True)
+    (tmp_path / tasks.THUMBNAILS_DIR / 'vid-a.jpg').write_bytes(b'jpg')
+
+    key = tasks._rendition_key('c' * 64, {'stream_copy': True})
+    assert key != tasks._rendition_key('c' * 64, {'stream_copy': False})
+    assert tasks.reuse_renditions(key, 'vid-b') is None
+    tasks.register_renditions(key, 'c' * 64, 'vid-a')
+    master = tasks.reuse_renditions(key, 'vid-b')
+    dst = tmp_path / 'app' / 'static' / 'hls_output' / 'vid-b'
+    assert master == str(dst / 'master.m3u8')
+    seg = '720p/segments/segment_000000.ts'
+    assert os.stat(dst / seg).st_ino == os.stat(src / seg).st_ino
+    assert not (dst / '.resume.json').exists()
+    assert str(dst / 'keys' / 'enc.key') in (dst / 'enc.keyinfo').read_text()
+    assert (tmp_path / tasks.THUMBNAILS_DIR / 'vid-b.jpg').read_bytes() == b'jpg'
+
+    # Re-keying the source replaces its key file; the linked copy keeps the old key
+    tasks._write_hls_key(str(src))
+    assert (dst / 'keys' / 'enc.key').read_bytes() == b'k' * 16
+    # Output gone -> stale row dropped
+    (src / 'master.m3u8').unlink()
+    assert tasks.reuse_renditions(key, 'vid-c') is None
+    from app.models import RenditionSet
+    assert db.session.get(RenditionSet, key) is None
+
+
+def test_identical_content_skips_encode(video, app_ctx, tmp_path, monkeypatch):
+    import sys
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tasks, 'FFMPEG_BIN', sys.executable)
+    monkeypatch.setattr(tasks, 'FFPROBE_BIN', sys.executable)
+    monkeypatch.setattr(tasks, 'probe_media', lambda path, md5=None: {'width': 1280, 'height': 720, 'duration': 6.0})
+    monkeypatch.setattr(tasks, 'content_hash', lambda path, md5=None, runner=None: 'a' * 64)   # same media, any container
+
+    def fake_convert(path, vid, **kw):
+        out = tmp_path / 'app' / 'static' / 'hls_output' / vid
+        out.mkdir(parents=True, exist_ok=True)
+        (out / 'master.m3u8').write_text('#EXTM3U\n')
+        calls.append(vid)
+        return str(out / 'master.m3u8')
+    calls = []
+    monkeypatch.setattr(tasks, 'convert_to_hls', fake_convert)
+
+    other = _uploader_video('remuxer', 'vid-remux')
+    for vid, path in ((video.uuid, '/tmp/q.mp4'), (other.uuid, '/tmp/q.mkv')):
+        job = tasks.add_to_queue(path, vid)
+        tasks.claim_next_job('w1', lease_seconds=60)
+        tasks._run_job(app_ctx, job.id, vid, path, 1, 2, 'w1', 60)
+    assert calls == [video.uuid]
+    db.session.expire_all()
+    assert db.session.get(Video, other.uuid).status == VideoStatus.PROCESSED
+    assert (tmp_path / 'app' / 'static' / 'hls_output' / other.uuid / 'master.m3u8').exists()
+
+    # A deleted video's output is no longer offered for linking
+    from flask_jwt_extended import create_access_token
+    from app.models import RenditionSet
+    assert RenditionSet.query.filter_by(video_uuid=video.uuid).count() == 1
+    token = create_access_token(identity=str(video.user_id), additional_claims={'roles': ['uploader']})
+    r = app_ctx.test_client().delete(f'/video/api/v1/video/{video.uuid}', headers={'Authorization': f'Bearer {token}'})
+    assert r.status_code == 200
+    assert RenditionSet.query.filter_by(video_uuid=video.uuid).count() == 0
+
+
+def test_hls_batch_skips_current_outputs_and_resumes(video, app_ctx, tmp_path, monkeypatch):
+    import json
+    import sys
+    from app.commands import batch_commands
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tasks, 'FFMPEG_BIN', sys.executable)
+    monkeypatch.setattr(tasks, 'FFPROBE_BIN', sys.executable)
+    monkeypatch.setattr(tasks, 'probe_media', lambda path, md5=None: {'width': 1280, 'height': 720, 'duration': 6.0})
+    app_ctx.config['TRANSCODE_DEDUP'] = False
+
+    def fake_convert(path, vid, **kw):
+        out = tmp_path / 'app' / 'static' / 'hls_output' / vid
+        out.mkdir(parents=True, exist_ok=True)
+        (out / 'master.m3u8').write_text('#EXTM3U\n')
+        return str(out / 'master.m3u8')
+    monkeypatch.setattr(tasks, 'convert_to_hls', fake_convert)
+
+    def worker_tick(seconds):   # stands in for hls-worker between polls
+        job = tasks.claim_next_job('w1', lease_seconds=60)
+        if job is not None:
+            tasks._run_job(app_ctx, job.id, job.video_uuid, job.input_path, 1, 2, 'w1', 60,
+                           kind=job.kind, params=job.params)
+    monkeypatch.setattr(batch_commands.time, 'sleep', worker_tick)
+
+    other = _uploader_video('batcher', 'vid-b2')
+    for v in (video, other):
+        (tmp_path / f'{v.uuid}.mp4').write_bytes(b'src')
+        v.original_file_path = str(tmp_path / f'{v.uuid}.mp4')
+        v.file_path = f'app/static/hls_output/{v.uuid}/master.m3u8'
+    video.status = VideoStatus.PUBLISHED
+    db.session.commit()
+    fake_convert(None, other.uuid)
+    tasks._write_output_fingerprint(other.uuid, tasks.output_fingerprint(app_ctx.config))
+
+    runner = app_ctx.test_cli_runner()
+    out = runner.invoke(args=['hls-batch', '--dry-run']).output
+    assert '1 video(s) to re-encode, 1 already current' in out
+    assert TranscodeJob.query.count() == 0
+
+    checkpoint = tmp_path / 'batch.json'
+    out = runner.invoke(args=['hls-batch', '--checkpoint', str(checkpoint)]).output
+    assert 'Summary: 1 succeeded' in out
+    state = json.loads(checkpoint.read_text())
+    assert list(state['videos']) == [video.uuid]
+    db.session.expire_all()
+    assert db.session.get(Video, video.uuid).status == VideoStatus.PUBLISHED
+    assert tasks.read_output_fingerprint(video.uuid) == state['fingerprint']
+
+    # Resumed run: the finished video is not queued again, even with --force
+    out = runner.invoke(args=['hls-batch', '--force', '--limit', '5', '--checkpoint', str(checkpoint)]).output
+    assert '1 video(s) to queue' in out and 'Summary: 2 succeeded' in out
+    assert TranscodeJob.query.filter_by(video_uuid=video.uuid).count() == 1
+    assert tasks.batch_candidates(state['fingerprint']) == ([], 2)